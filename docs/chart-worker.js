@@ -0,0 +1,99 @@
+// 价值图数据解析 Web Worker
+// 在后台线程把数据文件文本解析为 Float64Array，并以 transferable 的方式传回主线程 (不复制内存)。
+//   - type 'series': scripts/chart_series.py 预先降采样的 JSON (data/chart/value_<点数>.json)
+//   - type 'csv':    降采样文件不可用时，直接解析 portfolio_details_history.csv (只含当前年份的热分区) 并在这里用 LTTB 降采样到 points 个点
+
+// Largest-Triangle-Three-Buckets 降采样，返回选中点的位置 (与 scripts/chart_series.py 的 lttb_indices 相同)
+function lttbIndices(x, y, threshold) {
+    const n = y.length;
+    if (threshold >= n || threshold < 3) return Array.from({ length: n }, (_, i) => i);
+
+    const every = (n - 2) / (threshold - 2);
+    const edges = [];
+    for (let k = 0; k < threshold - 1; k++) edges.push(Math.min(Math.floor(k * every) + 1, n - 1));
+    edges.push(n - 1);
+
+    const selected = [0];
+    let a = 0;
+    for (let i = 0; i < threshold - 2; i++) {
+        const start = edges[i], end = edges[i + 1];
+        const nextStart = edges[i + 1], nextEnd = Math.max(edges[i + 2], edges[i + 1] + 1);
+        let avgX = 0, avgY = 0;
+        for (let j = nextStart; j < nextEnd; j++) {
+            avgX += x[j];
+            avgY += y[j];
+        }
+        avgX /= nextEnd - nextStart;
+        avgY /= nextEnd - nextStart;
+
+        let best = -1, bestIndex = start;
+        for (let j = start; j < end; j++) {
+            const area = Math.abs((x[a] - avgX) * (y[j] - y[a]) - (x[a] - x[j]) * (avgY - y[a]));
+            if (area > best) {
+                best = area;
+                bestIndex = j;
+            }
+        }
+        a = bestIndex;
+        selected.push(a);
+    }
+    selected.push(n - 1);
+    return selected;
+}
+
+function parseSeries(text) {
+    const series = JSON.parse(text);
+    return {
+        dates: series.dates,
+        assets: series.assets,
+        total: Float64Array.from(series.total_value),
+        values: series.values.map(column => Float64Array.from(column)),
+    };
+}
+
+// 历史 CSV 按日期降序存储，单元格为 '(价值|价格)'
+function parseCsv(text, points) {
+    const lines = text.trim().split('\n');
+    const headers = lines.shift().split(',');
+    const dateIndex = headers.indexOf('date');
+    const totalIndex = headers.indexOf('total_value');
+    const assetIndexes = headers.map((h, i) => i).filter(i => i !== dateIndex && i !== totalIndex);
+
+    const rows = lines.filter(line => line.split(',').length === headers.length).reverse();
+    const n = rows.length;
+    const dates = new Array(n);
+    const days = new Float64Array(n);
+    const total = new Float64Array(n);
+    const values = assetIndexes.map(() => new Float64Array(n));
+    rows.forEach((line, r) => {
+        const cells = line.split(',');
+        dates[r] = cells[dateIndex];
+        days[r] = Date.parse(cells[dateIndex]) / 86400000;
+        total[r] = parseFloat(cells[totalIndex]) || 0;
+        assetIndexes.forEach((col, k) => {
+            const cell = cells[col];
+            const value = cell.startsWith('(') ? parseFloat(cell.slice(1)) : parseFloat(cell);
+            values[k][r] = value || 0;
+        });
+    });
+
+    const positions = lttbIndices(days, total, points);
+    const pick = array => Float64Array.from(positions, p => array[p]);
+    return {
+        dates: positions.map(p => dates[p]),
+        assets: assetIndexes.map(i => headers[i]),
+        total: pick(total),
+        values: values.map(pick),
+    };
+}
+
+self.onmessage = (event) => {
+    const { id, type, text, points } = event.data;
+    try {
+        const result = type === 'csv' ? parseCsv(text, points) : parseSeries(text);
+        const buffers = [result.total.buffer, ...result.values.map(column => column.buffer)];
+        self.postMessage({ id, result }, buffers);
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+};
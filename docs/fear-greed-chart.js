@@ -1,12 +1,11 @@
 document.addEventListener('DOMContentLoaded', () => {
-    // 确保 getRepoInfoFromURL 函数已经从 script.js 加载并可用
-    if (typeof getRepoInfoFromURL !== 'function') {
-        console.error("`getRepoInfoFromURL` function not found. Make sure script.js is loaded first.");
+    // 确保 fetchDataJson 函数已经从 script.js 加载并可用
+    if (typeof fetchDataJson !== 'function') {
+        console.error("`fetchDataJson` function not found. Make sure script.js is loaded first.");
         return;
     }
 
-    const { owner, repo } = getRepoInfoFromURL();
-    const FEAR_GREED_DATA_URL = `https://raw.githubusercontent.com/${owner}/${repo}/main/data/fear_greed_index.json`;
+    const FEAR_GREED_DATA_FILE = 'fear_greed_index.json';
 
     // 为情绪评级定义颜色
     const RATING_COLORS = {
@@ -32,11 +31,8 @@ document.addEventListener('DOMContentLoaded', () => {
      */
     async function loadFearGreedData() {
         try {
-            const response = await fetch(`${FEAR_GREED_DATA_URL}?t=${new Date().getTime()}`);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            const data = await response.json();
+            // 通过 script.js 的数据文件缓存获取，内容未变化时不重新下载
+            const data = await fetchDataJson(FEAR_GREED_DATA_FILE);
 
             updateSummary(data.fear_and_greed);
             updateComparisonValues(data.fear_and_greed);
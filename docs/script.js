@@ -143,15 +143,8 @@ function updateAssetVisibilityIcon() {
  * 修复数据处理问题并优化样式，特别处理CASH资产
  */
 async function createPortfolioPieChart() {
-    const assetsUrl = `https://raw.githubusercontent.com/${owner}/${repo}/main/data/portfolio_assets_returns.json`;
-    const timestamp = new Date().getTime();
-
     try {
-        const response = await fetch(`${assetsUrl}?t=${timestamp}`);
-        if (!response.ok) {
-            throw new Error(`无法加载资产数据文件 (状态: ${response.status})`);
-        }
-        const assetsData = await response.json();
+        const assetsData = await fetchDataJson('portfolio_assets_returns.json');
 
         // 处理数据，过滤掉占比小于0.1%的资产
         const portfolioReturns = assetsData.portfolio_returns;
@@ -362,10 +355,60 @@ function toRgba(hex, alpha = 1) {
  * [优化] 2. 左上角齿轮按钮，展开设置面板
  * [优化] 3. 支持切换简化/详细模式，本地缓存
  */
-async function createPortfolioValueChart() {
-    const historyUrl = `https://raw.githubusercontent.com/${owner}/${repo}/main/data/portfolio_details_history.csv`;
-    const timestamp = new Date().getTime();
+// ========== 价值图数据 (Web Worker + 降采样) ==========
+// scripts/chart_series.py 预先生成多个分辨率的降采样序列 (data/chart/)，这里按图表宽度选择最接近的分辨率，
+// 在 chart-worker.js 中解析为 Float64Array 后传回；降采样文件不可用时由 Worker 解析完整 CSV 并降采样。
+
+const CHART_SHIMMER_FRAME_MS = 33;
+let chartWorker = null;
+let chartWorkerRequestId = 0;
+const chartWorkerCallbacks = new Map();
+
+function parseInChartWorker(message) {
+    if (!chartWorker) {
+        chartWorker = new Worker('chart-worker.js');
+        chartWorker.onmessage = (event) => {
+            const { id, result, error } = event.data;
+            const callbacks = chartWorkerCallbacks.get(id);
+            chartWorkerCallbacks.delete(id);
+            if (!callbacks) return;
+            if (error) callbacks.reject(new Error(error));
+            else callbacks.resolve(result);
+        };
+    }
+    const id = ++chartWorkerRequestId;
+    return new Promise((resolve, reject) => {
+        chartWorkerCallbacks.set(id, { resolve, reject });
+        chartWorker.postMessage({ ...message, id });
+    });
+}
 
+async function loadValueChartSeries(points) {
+    let manifest = null;
+    try {
+        manifest = await fetchDataJson('chart/manifest.json');
+    } catch (error) {
+        console.warn('降采样序列不可用，改为解析完整历史数据:', error.message);
+    }
+    if (manifest && manifest.levels.length > 0) {
+        const level = manifest.levels.find(l => l.points >= points) || manifest.levels[manifest.levels.length - 1];
+        return parseInChartWorker({ type: 'series', text: await fetchDataText(`chart/${level.file}`) });
+    }
+    return parseInChartWorker({ type: 'csv', text: await fetchDataText('portfolio_details_history.csv'), points });
+}
+
+// 有序数组中最后一个 <= target 的位置 (target 小于第一个元素时返回 0)
+function bisectRight(sorted, target) {
+    let lo = 0, hi = sorted.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (sorted[mid] <= target) lo = mid + 1;
+        else hi = mid;
+    }
+    return Math.max(0, lo - 1);
+}
+
+async function createPortfolioValueChart() {
     // --- 从 localStorage 读取用户偏好（默认详细模式）---
     const STORAGE_KEY = 'portfolio_chart_settings';
     let chartSettings = JSON.parse(localStorage.getItem(STORAGE_KEY) || '{"simpleTooltip": false}');
@@ -375,16 +418,12 @@ async function createPortfolioValueChart() {
     let shimmerPosition = 0;
 
     try {
-        const response = await fetch(`${historyUrl}?t=${timestamp}`);
-        if (!response.ok) throw new Error(`无法加载历史数据文件 (状态: ${response.status})`);
-
-        const csvText = await response.text();
-        const lines = csvText.trim().split('\n');
-        if (lines.length < 2) throw new Error('历史数据不足');
+        // 每个 CSS 像素最多一个点，绘制和悬停的成本与历史长度无关
+        const canvas = document.getElementById('portfolio-value-chart');
+        const series = await loadValueChartSeries(Math.max(2, Math.round(canvas.clientWidth || 1000)));
+        if (series.dates.length < 1) throw new Error('历史数据不足');
 
-        const headers = lines.shift().split(',');
-        const dataRows = lines.reverse();
-        const assetColumns = headers.filter(h => h !== 'date' && h !== 'total_value');
+        const assetColumns = series.assets;
 
         const themeColorsHex = generateThemeColors(assetColumns.length);
         const originalColorsRgba = themeColorsHex.map(color => toRgba(color, 0.85));
@@ -427,51 +466,32 @@ async function createPortfolioValueChart() {
             stack: 'combined',
             pointRadius: 0,
             pointHoverRadius: 6,
-            tension: 0.4,
+            tension: 0,
         }));
 
         datasets.push({
             label: 'Total Value', data: [], type: 'line', fill: false, order: -1,
             borderColor: 'rgba(255, 255, 255, 0.9)', backgroundColor: 'transparent',
-            borderWidth: 2.5, borderDash: [5, 5], pointRadius: 0, pointHoverRadius: 6, tension: 0.4,
-        });
-
-        const labels = [];
-        const assetData = Object.fromEntries(assetColumns.map(asset => [asset, []]));
-        const totalValueData = [];
-
-        const parseValue = (cell) => {
-            if (typeof cell !== 'string') return 0;
-            const match = cell.match(/\(([^|]+)/);
-            return match ? parseFloat(match[1]) : parseFloat(cell) || 0;
-        };
-
-        dataRows.forEach(row => {
-            const values = row.split(',');
-            if (values.length !== headers.length) return;
-            const dateStr = values[headers.indexOf('date')];
-            if (!dateStr) return;
-
-            labels.push(dateStr);
-            totalValueData.push(parseFloat(values[headers.indexOf('total_value')]) || 0);
-            assetColumns.forEach(asset => {
-                assetData[asset].push(parseValue(values[headers.indexOf(asset)]));
-            });
+            borderWidth: 2.5, borderDash: [5, 5], pointRadius: 0, pointHoverRadius: 6, tension: 0,
         });
 
-        datasets.forEach(ds => {
-            if (ds.label === 'Total Value') ds.data = totalValueData;
-            else if (assetData[ds.label]) ds.data = assetData[ds.label];
-        });
+        const labels = series.dates;
+        const labelTimes = labels.map(date => Date.parse(date));
+        assetColumns.forEach((asset, i) => { datasets[i].data = Array.from(series.values[i]); });
+        datasets[datasets.length - 1].data = Array.from(series.total);
 
-        const ctx = document.getElementById('portfolio-value-chart').getContext('2d');
+        const ctx = canvas.getContext('2d');
         if (portfolioValueChart) portfolioValueChart.destroy();
 
-        // --- 动画循环 ---
-        const shimmerLoop = () => {
-            shimmerPosition = (shimmerPosition + 0.01) % 1.5;
-            if (portfolioValueChart) {
-                portfolioValueChart.update('none');
+        // --- 动画循环 (约30帧/秒，每帧只重新解析降采样后的点) ---
+        let lastShimmerFrame = 0;
+        const shimmerLoop = (now = performance.now()) => {
+            if (now - lastShimmerFrame >= CHART_SHIMMER_FRAME_MS) {
+                lastShimmerFrame = now;
+                shimmerPosition = (shimmerPosition + 0.02) % 1.5;
+                if (portfolioValueChart) {
+                    portfolioValueChart.update('none');
+                }
             }
             shimmerAnimationId = requestAnimationFrame(shimmerLoop);
         };
@@ -681,7 +701,6 @@ async function createPortfolioValueChart() {
         createChartSettingsUI(chartSettings, STORAGE_KEY);
 
         // ========== 带插值的区域检测逻辑 ==========
-        const canvas = document.getElementById('portfolio-value-chart');
         const lerp = (v0, v1, t) => v0 * (1 - t) + v1 * t;
 
         canvas.addEventListener('mousemove', (event) => {
@@ -698,21 +717,17 @@ async function createPortfolioValueChart() {
 
             const xScale = portfolioValueChart.scales.x;
             const yScale = portfolioValueChart.scales.y;
-            const dataLength = portfolioValueChart.data.labels.length;
-            let leftIndex = 0, rightIndex = 0, interpolationFactor = 0;
-
-            for (let i = 0; i < dataLength - 1; i++) {
-                const xLeft = xScale.getPixelForValue(portfolioValueChart.data.labels[i]);
-                const xRight = xScale.getPixelForValue(portfolioValueChart.data.labels[i + 1]);
-                if (x >= xLeft && x <= xRight) {
-                    leftIndex = i; rightIndex = i + 1;
-                    interpolationFactor = (x - xLeft) / (xRight - xLeft);
-                    break;
-                }
-            }
-            if (x > xScale.getPixelForValue(portfolioValueChart.data.labels[dataLength - 1])) {
-                leftIndex = rightIndex = dataLength - 1;
-                interpolationFactor = 0;
+            const dataLength = labelTimes.length;
+            // 二分查找鼠标所在的相邻两个数据点
+            let leftIndex = bisectRight(labelTimes, xScale.getValueForPixel(x));
+            let rightIndex = Math.min(leftIndex + 1, dataLength - 1);
+            let interpolationFactor = 0;
+            const xLeft = xScale.getPixelForValue(labelTimes[leftIndex]);
+            const xRight = xScale.getPixelForValue(labelTimes[rightIndex]);
+            if (rightIndex > leftIndex && x >= xLeft && x <= xRight) {
+                interpolationFactor = (x - xLeft) / (xRight - xLeft);
+            } else if (x > xRight) {
+                leftIndex = rightIndex;
             }
 
             let cumulativeValueBottom = 0;
@@ -865,8 +880,159 @@ function showToast(message) {
     }, 3000);
 }
 
+// ========== 数据文件缓存 (IndexedDB) ==========
+// 工作流每次运行都会发布 data/data_manifest.json (每个数据文件的内容哈希，见 scripts/data_manifest.py)。
+// 页面加载时只重新获取这个很小的清单；哈希与 IndexedDB 中缓存的版本一致时直接使用缓存，
+// 否则按 "?v=哈希" 下载新内容 (同一版本的 URL 不变，浏览器缓存也可以复用)，校验哈希后写入缓存。
+
+const DATA_MANIFEST_FILE = 'data_manifest.json';
+const DATA_CACHE_DB = 'portfolio-data-cache';
+const DATA_CACHE_STORE = 'files';
+let dataManifestPromise = null;
+let dataCacheDbPromise = null;
+const inflightDataFiles = new Map();
+
+function dataFileUrl(path) {
+    return `https://raw.githubusercontent.com/${owner}/${repo}/main/data/${path}`;
+}
+
+function loadDataManifest() {
+    if (!dataManifestPromise) {
+        dataManifestPromise = fetch(`${dataFileUrl(DATA_MANIFEST_FILE)}?t=${new Date().getTime()}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(manifest => (manifest && manifest.files) || {})
+            .catch(() => ({}));
+        dataManifestPromise.then(pruneDataCache);
+    }
+    return dataManifestPromise;
+}
+
+function openDataCache() {
+    if (!dataCacheDbPromise) {
+        dataCacheDbPromise = new Promise(resolve => {
+            if (!window.indexedDB) {
+                resolve(null);
+                return;
+            }
+            const request = indexedDB.open(DATA_CACHE_DB, 1);
+            request.onupgradeneeded = () => request.result.createObjectStore(DATA_CACHE_STORE, { keyPath: 'path' });
+            request.onsuccess = () => resolve(request.result);
+            // 隐私模式等无法使用 IndexedDB 时退回为直接下载
+            request.onerror = () => resolve(null);
+        });
+    }
+    return dataCacheDbPromise;
+}
+
+function dataCacheRequest(db, mode, operation) {
+    return new Promise(resolve => {
+        const store = db.transaction(DATA_CACHE_STORE, mode).objectStore(DATA_CACHE_STORE);
+        const request = operation(store);
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => resolve(null);
+    });
+}
+
+// 删除已不在清单中的缓存 (如历史表格分页数减少后的旧页面)
+async function pruneDataCache(files) {
+    const db = await openDataCache();
+    if (!db || Object.keys(files).length === 0) return;
+    const paths = await dataCacheRequest(db, 'readonly', store => store.getAllKeys());
+    for (const path of paths || []) {
+        if (!(path in files)) dataCacheRequest(db, 'readwrite', store => store.delete(path));
+    }
+}
+
+async function contentDigest(text) {
+    if (!window.crypto || !crypto.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+/**
+ * 获取 data/ 下数据文件的文本内容。清单中有该文件时按哈希复用缓存，
+ * 否则 (清单缺失或文件未发布) 按原来的方式附加时间戳直接下载。同一文件的并发请求只下载一次。
+ */
+function fetchDataText(path) {
+    if (!inflightDataFiles.has(path)) {
+        const request = (async () => {
+            const hash = (await loadDataManifest())[path];
+            if (!hash) {
+                const response = await fetch(`${dataFileUrl(path)}?t=${new Date().getTime()}`);
+                if (!response.ok) throw new Error(`无法加载 ${path} (状态: ${response.status})`);
+                return response.text();
+            }
+
+            const db = await openDataCache();
+            const cached = db ? await dataCacheRequest(db, 'readonly', store => store.get(path)) : null;
+            if (cached && cached.hash === hash) return cached.body;
+
+            const response = await fetch(`${dataFileUrl(path)}?v=${hash}`);
+            if (!response.ok) throw new Error(`无法加载 ${path} (状态: ${response.status})`);
+            const body = await response.text();
+            // 只缓存与清单哈希一致的内容，避免把 CDN 返回的旧版本当作新版本保存
+            const digest = await contentDigest(body);
+            if (db && digest && digest.startsWith(hash)) {
+                dataCacheRequest(db, 'readwrite', store => store.put({ path, hash, body }));
+            }
+            return body;
+        })();
+        inflightDataFiles.set(path, request);
+        request.finally(() => inflightDataFiles.delete(path)).catch(() => {});
+    }
+    return inflightDataFiles.get(path);
+}
+
+async function fetchDataJson(path) {
+    return JSON.parse(await fetchDataText(path));
+}
+
 // ========== 页面加载与数据处理 ==========
 
+// 历史数据表格 (分页 + 虚拟滚动)，数据由 scripts/history_pages.py 生成: manifest.json + 固定行数的分页文件 + 每列的排序索引。
+// 行号按日期升序编号，默认按日期降序显示；只渲染可见区域附近的行，只获取这些行所在的页面。
+
+const HISTORY_OVERSCAN_ROWS = 8;
+const HISTORY_DEFAULT_ROW_HEIGHT = 42;
+
+const historyTable = {
+    manifest: null,
+    pages: new Map(),     // 页号 -> 行数组
+    pendingPages: new Map(),
+    indexes: new Map(),   // 列名 -> { order, nonzero }
+    sortColumn: null,
+    sortDescending: true,
+    heldOnly: false,
+    columnFilter: '',
+    rowIds: null,         // 当前排序/筛选下按显示顺序排列的行号；null 表示默认的日期降序
+    rowHeight: HISTORY_DEFAULT_ROW_HEIGHT,
+    renderToken: 0,
+    elements: null,
+};
+
+function fetchHistoryJson(file) {
+    return fetchDataJson(`history/${file}`);
+}
+
+function loadHistoryPage(page) {
+    if (historyTable.pages.has(page)) return Promise.resolve();
+    if (!historyTable.pendingPages.has(page)) {
+        const request = fetchHistoryJson(historyTable.manifest.pages[page].file)
+            .then(data => historyTable.pages.set(page, data.rows))
+            .finally(() => historyTable.pendingPages.delete(page));
+        historyTable.pendingPages.set(page, request);
+    }
+    return historyTable.pendingPages.get(page);
+}
+
+async function loadHistoryIndex(column) {
+    if (!historyTable.indexes.has(column)) {
+        const data = await fetchHistoryJson(historyTable.manifest.indexes[column]);
+        historyTable.indexes.set(column, { order: data.order, nonzero: new Set(data.nonzero) });
+    }
+    return historyTable.indexes.get(column);
+}
+
 async function showHistoryTable() {
     document.body.classList.add('modal-open');
     historyModal.backdrop.classList.remove('hidden');
@@ -879,18 +1045,17 @@ async function showHistoryTable() {
 
     historyModal.content.innerHTML = '<p style="text-align:center; padding: 20px;">正在加载历史数据...</p>';
     try {
-        const csvUrl = `https://raw.githubusercontent.com/${owner}/${repo}/main/data/portfolio_details_history.csv`;
-        const timestamp = new Date().getTime();
-        const response = await fetch(`${csvUrl}?t=${timestamp}`);
-
-        if (!response.ok) {
-            throw new Error(`无法加载 CSV 文件 (状态: ${response.status})`);
+        Object.assign(historyTable, {
+            pages: new Map(), pendingPages: new Map(), indexes: new Map(),
+            sortColumn: null, sortDescending: true, heldOnly: false, columnFilter: '', rowIds: null,
+        });
+        historyTable.manifest = await fetchHistoryJson('manifest.json');
+        if (historyTable.manifest.rows === 0) {
+            historyModal.content.innerHTML = '<p>没有历史数据。</p>';
+            return;
         }
-
-        const csvText = await response.text();
-        const tableHtml = parseCsvToHtmlTable(csvText);
-        historyModal.content.innerHTML = tableHtml;
-
+        buildHistoryTableShell();
+        renderHistoryRows();
     } catch (error) {
         console.error('加载历史数据失败:', error);
         historyModal.content.innerHTML = `<div class="status-error" style="display:block; margin: 20px;">加载失败: ${error.message}</div>`;
@@ -907,36 +1072,159 @@ function hideHistoryTable() {
     historyModal.container.classList.remove('is-active');
 }
 
-function parseCsvToHtmlTable(csvText) {
-    const lines = csvText.trim().split('\n');
-    if (lines.length === 0) return '<p>没有历史数据。</p>';
-
-    let html = '<table class="history-table">';
-    const headers = lines[0].split(',');
-    html += '<thead><tr>';
-    headers.forEach(header => {
-        html += `<th>${header.trim().replace(/_/g, ' ')}</th>`;
+function buildHistoryTableShell() {
+    historyModal.content.innerHTML = `
+        <div class="history-toolbar">
+            <input type="text" id="history-column-filter" placeholder="筛选列 (如 SPY、PUT)">
+            <label><input type="checkbox" id="history-held-only" disabled> 只显示持有排序列资产的日期</label>
+            <span id="history-row-count"></span>
+        </div>
+        <div class="history-viewport">
+            <table class="history-table">
+                <thead><tr></tr></thead>
+                <tbody></tbody>
+            </table>
+        </div>`;
+    const elements = {
+        filter: historyModal.content.querySelector('#history-column-filter'),
+        heldOnly: historyModal.content.querySelector('#history-held-only'),
+        rowCount: historyModal.content.querySelector('#history-row-count'),
+        viewport: historyModal.content.querySelector('.history-viewport'),
+        headerRow: historyModal.content.querySelector('thead tr'),
+        body: historyModal.content.querySelector('tbody'),
+    };
+    historyTable.elements = elements;
+
+    elements.viewport.addEventListener('scroll', () => requestAnimationFrame(renderHistoryRows));
+    elements.filter.addEventListener('input', () => {
+        historyTable.columnFilter = elements.filter.value.trim().toUpperCase();
+        renderHistoryHeader();
+        renderHistoryRows();
     });
-    html += '</tr></thead>';
-
-    html += '<tbody>';
-    for (let i = 1; i < lines.length; i++) {
-        if (!lines[i]) continue;
-        const cells = lines[i].split(',');
-        html += '<tr>';
-        cells.forEach(cell => {
-            const trimmedCell = cell.trim();
-            const num = Number(trimmedCell);
-            if (!isNaN(num) && trimmedCell.includes('.')) {
-                html += `<td>${num.toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}</td>`;
-            } else {
-                html += `<td>${trimmedCell}</td>`;
-            }
-        });
-        html += '</tr>';
+    elements.heldOnly.addEventListener('change', async () => {
+        historyTable.heldOnly = elements.heldOnly.checked;
+        await updateHistoryRowIds();
+    });
+    elements.headerRow.addEventListener('click', async (event) => {
+        const th = event.target.closest('th');
+        if (th) await toggleHistorySort(th.dataset.column);
+    });
+    renderHistoryHeader();
+}
+
+// 当前可见列在行数组中的位置 (日期和总价值总是显示)
+function visibleHistoryColumns() {
+    const columns = historyTable.manifest.columns;
+    const filter = historyTable.columnFilter;
+    return columns.map((name, i) => i).filter(i => i < 2 || !filter || columns[i].includes(filter));
+}
+
+function renderHistoryHeader() {
+    const { columns } = historyTable.manifest;
+    historyTable.elements.headerRow.innerHTML = visibleHistoryColumns().map(i => {
+        const name = columns[i];
+        const arrow = historyTable.sortColumn === name ? (historyTable.sortDescending ? ' ▼' : ' ▲') : '';
+        return `<th data-column="${name}">${name.replace(/_/g, ' ')}${arrow}</th>`;
+    }).join('');
+}
+
+// 点击表头: 降序 -> 升序 -> 恢复默认的日期降序；点击日期列直接恢复默认
+async function toggleHistorySort(column) {
+    if (column === 'date' || (historyTable.sortColumn === column && !historyTable.sortDescending)) {
+        historyTable.sortColumn = null;
+    } else if (historyTable.sortColumn === column) {
+        historyTable.sortDescending = false;
+    } else {
+        historyTable.sortColumn = column;
+        historyTable.sortDescending = true;
+    }
+    const heldOnly = historyTable.elements.heldOnly;
+    heldOnly.disabled = !historyTable.sortColumn || historyTable.sortColumn === 'total_value';
+    if (heldOnly.disabled) {
+        heldOnly.checked = false;
+        historyTable.heldOnly = false;
+    }
+    renderHistoryHeader();
+    await updateHistoryRowIds();
+}
+
+async function updateHistoryRowIds() {
+    const column = historyTable.sortColumn;
+    if (!column) {
+        historyTable.rowIds = null;
+    } else {
+        try {
+            const index = await loadHistoryIndex(column);
+            let ids = historyTable.sortDescending ? index.order.slice().reverse() : index.order;
+            if (historyTable.heldOnly) ids = ids.filter(id => index.nonzero.has(id));
+            historyTable.rowIds = ids;
+        } catch (error) {
+            showToast(`加载排序索引失败: ${error.message}`);
+            historyTable.sortColumn = null;
+            historyTable.rowIds = null;
+            renderHistoryHeader();
+        }
+    }
+    historyTable.elements.viewport.scrollTop = 0;
+    renderHistoryRows();
+}
+
+function historyRowCount() {
+    return historyTable.rowIds ? historyTable.rowIds.length : historyTable.manifest.rows;
+}
+
+function historyRowIdAt(position) {
+    return historyTable.rowIds ? historyTable.rowIds[position] : historyTable.manifest.rows - 1 - position;
+}
+
+async function renderHistoryRows() {
+    const { elements, manifest } = historyTable;
+    if (!elements || !elements.viewport.isConnected) return;
+
+    const count = historyRowCount();
+    const rowHeight = historyTable.rowHeight;
+    const scrollTop = elements.viewport.scrollTop;
+    const first = Math.max(0, Math.floor(scrollTop / rowHeight) - HISTORY_OVERSCAN_ROWS);
+    const last = Math.min(count, Math.ceil((scrollTop + elements.viewport.clientHeight) / rowHeight) + HISTORY_OVERSCAN_ROWS);
+    elements.rowCount.textContent = `共 ${count.toLocaleString('en-US')} 行`;
+
+    const ids = [];
+    for (let position = first; position < last; position++) ids.push(historyRowIdAt(position));
+    const missing = [...new Set(ids.map(id => Math.floor(id / manifest.page_rows)))]
+        .filter(page => !historyTable.pages.has(page));
+
+    const token = ++historyTable.renderToken;
+    if (missing.length > 0) {
+        try {
+            await Promise.all(missing.map(loadHistoryPage));
+        } catch (error) {
+            elements.body.innerHTML = `<tr><td colspan="${manifest.columns.length}">加载失败: ${error.message}</td></tr>`;
+            return;
+        }
+        // 等待期间用户可能已经滚动到别处，只渲染最新一次请求
+        if (token !== historyTable.renderToken) return;
+        renderHistoryRows();
+        return;
+    }
+
+    const columns = visibleHistoryColumns();
+    const rowsHtml = ids.map((id, k) => {
+        const row = historyTable.pages.get(Math.floor(id / manifest.page_rows))[id % manifest.page_rows];
+        const parity = (first + k) % 2 === 1 ? ' class="history-row-alt"' : '';
+        return `<tr${parity}>${columns.map(i => `<td>${row[i]}</td>`).join('')}</tr>`;
+    }).join('');
+    const topSpacer = first * rowHeight;
+    const bottomSpacer = (count - last) * rowHeight;
+    const spacer = height => `<tr class="history-spacer" style="height:${height}px"><td colspan="${columns.length}"></td></tr>`;
+    elements.body.innerHTML = (topSpacer > 0 ? spacer(topSpacer) : '') + rowsHtml + (bottomSpacer > 0 ? spacer(bottomSpacer) : '');
+
+    // 按实际渲染的行高校准 (字体与缩放不同时行高会变化)
+    const sample = elements.body.querySelector('tr:not(.history-spacer)');
+    const measured = sample ? sample.getBoundingClientRect().height : 0;
+    if (measured > 0 && Math.abs(measured - rowHeight) > 0.5) {
+        historyTable.rowHeight = measured;
+        renderHistoryRows();
     }
-    html += '</tbody></table>';
-    return html;
 }
 
 function initializeAuth() {
@@ -1123,10 +1411,12 @@ function displayPortfolio(lines) {
             sectionDiv.className = 'portfolio-section';
             sectionDiv.innerHTML = `<h3>${currentSection}</h3>`;
 
+            // 命名组合 (如 [Portfolio:ira]) 按其基础分区处理
+            const baseSection = currentSection.split(':')[0];
             const positionSections = ['Portfolio', 'OptionsPortfolio', 'Cash'];
-            const targetEditor = positionSections.includes(currentSection) ? editors.positions : editors.settings;
+            const targetEditor = positionSections.includes(baseSection) ? editors.positions : editors.settings;
 
-            if (['Portfolio', 'OptionsPortfolio'].includes(currentSection)) {
+            if (['Portfolio', 'OptionsPortfolio'].includes(baseSection)) {
                 const addBtn = document.createElement('button');
                 addBtn.textContent = '＋ 新增一行';
                 addBtn.className = 'add-btn';
@@ -1136,8 +1426,9 @@ function displayPortfolio(lines) {
             targetEditor.appendChild(sectionDiv);
 
         } else if (currentSection && processedLine.includes('=')) {
+            const baseSection = currentSection.split(':')[0];
             const positionSections = ['Portfolio', 'OptionsPortfolio', 'Cash'];
-            const parentEditor = positionSections.includes(currentSection) ? editors.positions : editors.settings;
+            const parentEditor = positionSections.includes(baseSection) ? editors.positions : editors.settings;
             const sectionDiv = Array.from(parentEditor.querySelectorAll('.portfolio-section h3')).find(h3 => h3.textContent === currentSection)?.parentElement;
             if (!sectionDiv) return;
 
@@ -1170,10 +1461,10 @@ function displayPortfolio(lines) {
                     input.type = 'text'; input.value = value;
                     itemDiv.append(label, input);
                 }
-            } else if (currentSection === 'OptionsPortfolio') {
+            } else if (baseSection === 'OptionsPortfolio') {
                 const parts = key.split('_');
                 if (parts.length === 4) itemDiv = createOptionRowUI(parts[0], parts[1], parts[2], parts[3], value);
-            } else if (currentSection === 'Portfolio') {
+            } else if (baseSection === 'Portfolio') {
                 itemDiv = document.createElement('div');
                 itemDiv.className = 'portfolio-item';
                 const keyInput = document.createElement('input');
@@ -1215,17 +1506,10 @@ function getRepoInfoFromURL() {
 }
 
 async function loadReturnsData() {
-    const returnsUrl = `https://raw.githubusercontent.com/${owner}/${repo}/main/data/portfolio_return.json`;
-    const timestamp = new Date().getTime();
-
     returnsDisplayContainer.innerHTML = '<p style="font-size: 14px; color: #6a737d;">正在加载收益率...</p>';
 
     try {
-        const response = await fetch(`${returnsUrl}?t=${timestamp}`);
-        if (!response.ok) {
-            throw new Error(`无法加载收益率文件 (状态: ${response.status})`);
-        }
-        const returnsData = await response.json();
+        const returnsData = await fetchDataJson('portfolio_return.json');
 
         if (!Array.isArray(returnsData) || returnsData.length === 0) {
             returnsDisplayContainer.innerHTML = '<p style="font-size: 14px; color: #6a737d;">暂无收益率数据。</p>';
@@ -1296,9 +1580,7 @@ async function loadReturnsData() {
 
 // ========== 修改：更新页面加载逻辑 ==========
 async function loadInitialSummary() {
-    const csvUrl = `https://raw.githubusercontent.com/${owner}/${repo}/main/data/portfolio_details_history.csv`;
     const lastUpdatedTime = document.getElementById('last-updated-time');
-    const timestamp = new Date().getTime();
 
     // 加载所有图表和数据
     loadReturnsData();
@@ -1306,10 +1588,7 @@ async function loadInitialSummary() {
     createPortfolioValueChart(); // 新增调用
 
     try {
-        const response = await fetch(`${csvUrl}?t=${timestamp}`);
-        if (!response.ok) throw new Error(`无法加载 CSV: ${response.statusText}`);
-
-        const csvText = await response.text();
+        const csvText = await fetchDataText('portfolio_details_history.csv');
         const lines = csvText.trim().split('\n');
 
         if (lines.length < 2) throw new Error('CSV 文件内容不正确。');
@@ -1366,11 +1645,12 @@ function createOptionRowUI(ticker = '', date = '', strike = '', type = 'CALL', q
 
 function addNewRow(sectionDiv) {
     const sectionTitle = sectionDiv.querySelector('h3').textContent;
+    const baseSection = sectionTitle.split(':')[0];
     const addBtn = sectionDiv.querySelector('.add-btn');
     let itemDiv;
-    if (sectionTitle === 'OptionsPortfolio') {
+    if (baseSection === 'OptionsPortfolio') {
         itemDiv = createOptionRowUI();
-    } else if (sectionTitle === 'Portfolio') {
+    } else if (baseSection === 'Portfolio') {
         itemDiv = document.createElement('div');
         itemDiv.className = 'portfolio-item';
         const keyInput = document.createElement('input');
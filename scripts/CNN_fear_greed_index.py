@@ -11,6 +11,8 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from output_writer import write_json
+
 
 def fetch_fear_greed_index():
     """
@@ -77,10 +79,11 @@ def save_data(data):
     latest_filepath = data_dir / "fear_greed_index.json"
 
     try:
-        # 保存最新版本
-        with open(latest_filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        print(f"最新数据已保存到: {latest_filepath}")
+        # 保存最新版本 (内容未变化时不写入)
+        if write_json(latest_filepath, data):
+            print(f"最新数据已保存到: {latest_filepath}")
+        else:
+            print(f"数据未变化，无需写入: {latest_filepath}")
 
         return True
 
@@ -0,0 +1,382 @@
+"""
+历史数据异常检测 (向量化)
+validate_and_repair_history 只检查 "价值 > 0 但价格 <= 0" 和 CASH 格式，
+价格跳变、长期不变的陈旧价格、价值/价格/数量不一致都会原样进入 calculate_inferred_cash_flows，
+例如一次错误的报价会变成一笔巨额的虚假现金流。
+本脚本在整个历史的 (天数 × 资产数) 价值/价格矩阵上一次性完成以下检查，不逐行逐列循环:
+  - price_spike: 价格对数收益率 (已按拆股/分红调整) 相对该资产前 ZSCORE_WINDOW 个交易日的滚动 z 分数过大；
+                 次日反向回落的单日跳变判定为错误报价
+  - stale_price: 持有中的非现金资产价格连续 STALE_RUN_DAYS 个交易日以上完全不变
+  - quantity_jump: 持有数量 (价值 / 价格) 大幅变化，却没有相应的现金变动与之抵消 (整笔表现为外部现金流)；
+                 次日恢复原数量的判定为错误数据
+  - reference_mismatch: 股票/ETF 的价格与本地收盘价缓存 (price_cache) 中同一天的收盘价相差过大
+结果写入 data/portfolio_anomalies.json。带有修复建议的异常 (错误报价、瞬时的数量跳变、与参考收盘价不符)
+在 --repair 时改写回所在的历史分区: 保持持有数量不变、用参考收盘价 (或前后两日价格的几何平均) 替换价格，
+或恢复前一日的持有数量，并相应调整 total_value。
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from calculate_return import calculate_flows_from_arrays
+from corporate_actions import build_adjustment_factors, load_held_actions
+from history_store import (
+    format_history_cells,
+    history_partitions,
+    iter_history_chunks,
+    load_history_arrays,
+    parse_history_matrix,
+    write_history_chunks,
+)
+from instruments import REGISTRY
+from output_writer import write_json
+from price_cache import get_close_panel, load_cached_closes
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_anomalies.json')
+# 滚动 z 分数: 窗口行数、窗口内最少的有效收益率个数、判定阈值，以及触发所需的最小单日涨跌幅
+ZSCORE_WINDOW = 20
+ZSCORE_MIN_OBSERVATIONS = 10
+ZSCORE_THRESHOLD = 6.0
+MIN_SPIKE_MOVE = 0.15
+# 次日回落幅度达到跳变幅度的这一比例时，判定为错误报价
+REVERSION_SHARE = 0.5
+# 价格连续不变的最少交易日数
+STALE_RUN_DAYS = 5
+# 数量变化超过前一日数量的这一比例、且金额超过前一日总价值的 MIN_FLOW_SHARE 时检查是否有现金抵消
+QUANTITY_JUMP_RATIO = 0.5
+MIN_FLOW_SHARE = 0.01
+# 当日推断现金流至少覆盖交易金额的这一比例时，视为没有相应的现金变动
+UNMATCHED_SHARE = 0.5
+# 与参考收盘价的相对偏差上限
+REFERENCE_TOLERANCE = 0.05
+
+
+# ==============================================================================
+# 1. 参考收盘价
+# ==============================================================================
+
+def reference_close_matrix(dates, assets, refresh=False):
+    """
+    与历史日期和资产列对齐的参考收盘价矩阵，只包含股票/ETF列，没有参考价格的位置为 NaN。
+    默认只读取本地收盘价缓存；refresh=True 时先通过 price_cache 增量下载缺失的区间。
+    """
+    reference = np.full((len(dates), len(assets)), np.nan)
+    stocks = {j: REGISTRY[asset].yfinance for j, asset in enumerate(assets)
+              if REGISTRY.get(asset) is not None and REGISTRY[asset].is_stock}
+    if not stocks or len(dates) == 0:
+        return reference
+
+    if refresh:
+        panel = get_close_panel(list(stocks.values()), dates[0], dates[-1])
+    else:
+        panel = pd.DataFrame({symbol: load_cached_closes(symbol) for symbol in dict.fromkeys(stocks.values())})
+    panel = panel.reindex(pd.DatetimeIndex(dates))
+    for j, symbol in stocks.items():
+        if symbol in panel.columns:
+            reference[:, j] = panel[symbol].to_numpy(dtype=np.float64)
+    return reference
+
+
+def load_factors(arrays):
+    """
+    返回 (累计拆股/分红调整因子, 只含拆股的累计因子)，均只使用本地缓存的公司行动表
+    """
+    dates, assets, prices = arrays['dates'], arrays['assets'], arrays['prices']
+    if len(dates) < 2:
+        ones = np.ones(prices.shape, dtype=np.float64)
+        return ones, ones
+    actions = load_held_actions(dates, assets, (arrays['values'] != 0).any(axis=0), refresh=False)
+    split_actions = {symbol: {'splits': entry.get('splits') or {}} for symbol, entry in actions.items()}
+    return (build_adjustment_factors(dates, assets, prices, actions),
+            build_adjustment_factors(dates, assets, prices, split_actions))
+
+
+def to_recorded_basis(reference, split_factors):
+    """
+    yfinance 的 Close 即使 auto_adjust=False 也已按之后的拆股调整到最新的股数口径，
+    而历史文件记录的是当时的价格。第 t 行的参考价乘以 (最新累计拆股因子 / 第 t 行累计拆股因子) 换算回记录口径。
+    """
+    if split_factors is None:
+        return reference
+    return reference * (split_factors[-1] / split_factors)
+
+
+# ==============================================================================
+# 2. 各项检查 (输入均为按日期升序的 天数 × 资产数 矩阵)
+# ==============================================================================
+
+def rolling_zscores(returns, valid, window=ZSCORE_WINDOW, min_observations=ZSCORE_MIN_OBSERVATIONS):
+    """
+    每个收益率相对其之前 window 行内有效收益率的 z 分数 (不含当前行)；有效观测不足或标准差为0时为 NaN
+    """
+    zero_row = np.zeros((1, returns.shape[1]))
+    weighted = np.where(valid, returns, 0.0)
+    s1 = np.vstack([zero_row, np.cumsum(weighted, axis=0)])
+    s2 = np.vstack([zero_row, np.cumsum(weighted ** 2, axis=0)])
+    count = np.vstack([zero_row, np.cumsum(valid, axis=0)])
+
+    ends = np.arange(returns.shape[0])
+    starts = np.maximum(ends - window, 0)
+    n = count[ends] - count[starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (s1[ends] - s1[starts]) / n
+        std = np.sqrt(np.maximum((s2[ends] - s2[starts]) / n - mean ** 2, 0.0))
+        z = (returns - mean) / std
+    return np.where(valid & (n >= min_observations) & (std > 0), z, np.nan)
+
+
+def detect_price_spikes(prices, held, non_cash, day_factors, reference):
+    """
+    返回 (跳变掩码, 错误报价掩码, 对数收益率, z 分数)，掩码均对齐价格行 (第0行恒为 False)。
+    参考收盘价确认了当日价格的跳变不算异常。
+    """
+    prev, curr = prices[:-1], prices[1:]
+    valid = (prev > 0) & (curr > 0) & held[:-1] & non_cash
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.where(valid, np.log(curr * day_factors / prev), 0.0)
+    z = rolling_zscores(returns, valid)
+    spike = valid & (np.abs(np.nan_to_num(z)) > ZSCORE_THRESHOLD) & (np.abs(np.expm1(returns)) > MIN_SPIKE_MOVE)
+
+    # 次日反向回落: 两日收益率符号相反，且合计幅度小于单日跳变的 (1 - REVERSION_SHARE)
+    next_returns = np.vstack([returns[1:], np.zeros((1, returns.shape[1]))])
+    next_valid = np.vstack([valid[1:], np.zeros((1, returns.shape[1]), dtype=bool)])
+    reverted = spike & next_valid & (np.sign(next_returns) == -np.sign(returns)) & \
+        (np.abs(returns + next_returns) < (1 - REVERSION_SHARE) * np.abs(returns))
+    # 错误报价回落的那一天本身也可能超过阈值，不重复报告
+    after_bad = np.vstack([np.zeros((1, returns.shape[1]), dtype=bool), reverted[:-1]])
+    spike &= ~after_bad
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        confirmed = np.abs(curr / reference[1:] - 1) <= REFERENCE_TOLERANCE
+    spike &= ~confirmed
+
+    pad = np.zeros((1, prices.shape[1]), dtype=bool)
+    return np.vstack([pad, spike]), np.vstack([pad, spike & reverted]), returns, z
+
+
+def detect_stale_runs(prices, held, non_cash, min_days=STALE_RUN_DAYS):
+    """
+    价格连续不变的区间: 返回 [(资产列, 开始行, 结束行)]，区间内每一天都持有且价格相同
+    """
+    same = (prices[1:] == prices[:-1]) & (prices[1:] > 0) & held[1:] & held[:-1] & non_cash
+    count = np.cumsum(same, axis=0)
+    last_reset = np.maximum.accumulate(np.where(same, 0, count), axis=0)
+    run = count - last_reset
+    # 区间在下一行不再相同 (或到达最后一行) 时结束；run 为相同的相邻对数，天数 = run + 1
+    ends_here = same & np.vstack([~same[1:], np.ones((1, same.shape[1]), dtype=bool)])
+    rows, cols = np.nonzero(ends_here & (run + 1 >= min_days))
+    return [(int(c), int(r + 1 - run[r, c]), int(r + 1)) for r, c in zip(rows, cols)]
+
+
+def detect_quantity_jumps(values, prices, non_cash, day_factors, flows, totals):
+    """
+    返回 (跳变掩码, 瞬时跳变掩码, 交易金额)，均对齐价格行。
+    交易金额 = (今日数量 - 昨日数量 × 拆股调整) × 今日价格；当日推断现金流覆盖了大部分交易金额 (方向相同)
+    说明没有相应的现金变动与之抵消。次日数量恢复到前一日 (1% 以内) 的为瞬时跳变。
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quantity = np.where(prices > 0, values / prices, 0.0)
+    expected_quantity = quantity[:-1] * day_factors
+    change = quantity[1:] - expected_quantity
+    both = (quantity[:-1] != 0) & (quantity[1:] != 0) & non_cash
+    trade = np.where(both, change * prices[1:], 0.0)
+
+    day_flows = flows[1:, None]
+    jump = both & (np.abs(change) > QUANTITY_JUMP_RATIO * np.abs(expected_quantity)) & \
+        (np.abs(trade) >= MIN_FLOW_SHARE * np.abs(totals[:-1, None])) & \
+        (np.sign(day_flows) == np.sign(trade)) & (np.abs(day_flows) >= UNMATCHED_SHARE * np.abs(trade))
+
+    next_quantity = np.vstack([quantity[2:], np.zeros((1, quantity.shape[1]))])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        restored = np.abs(next_quantity / expected_quantity - 1) <= 0.01
+    transient = jump & restored
+    # 瞬时跳变恢复原数量的那一天本身也是一次跳变，不重复报告
+    pad = np.zeros((1, values.shape[1]), dtype=bool)
+    jump &= ~np.vstack([pad, transient[:-1]])
+    trade = np.vstack([np.zeros((1, values.shape[1])), trade])
+    return np.vstack([pad, jump]), np.vstack([pad, transient]), trade
+
+
+# ==============================================================================
+# 3. 汇总报告
+# ==============================================================================
+
+def _cell(day, asset, kind, severity, detail, repair=None):
+    return {'kind': kind, 'date': day, 'asset': asset, 'severity': severity, 'detail': detail, 'repair': repair}
+
+
+def detect_anomalies(arrays, adjustments=None, reference=None, split_factors=None):
+    """
+    对 load_history_arrays 的结果运行全部检查，返回异常列表 (按日期降序)。
+    reference 为 reference_close_matrix 的参考收盘价 (已按拆股调整到最新口径)，先用 split_factors
+    (只含拆股的累计因子；未提供时使用 adjustments) 换算回历史记录的价格口径再比较。
+    修复建议 repair = {'value', 'price'}: 错误价格按参考收盘价 (没有时为前后两日价格的几何平均) 替换并保持数量不变，
+    瞬时的数量跳变恢复为前一日的数量。
+    """
+    dates, assets = arrays['dates'], list(arrays['assets'])
+    values, prices = arrays['values'], arrays['prices']
+    if len(dates) < 2:
+        return []
+
+    shape = values.shape
+    day_factors = np.ones((shape[0] - 1, shape[1])) if adjustments is None else adjustments[1:] / adjustments[:-1]
+    if reference is None:
+        reference = np.full(shape, np.nan)
+    else:
+        reference = to_recorded_basis(reference, adjustments if split_factors is None else split_factors)
+    non_cash = np.array([not (REGISTRY.get(asset) is not None and REGISTRY[asset].is_cash) for asset in assets])
+    held = values != 0
+    totals = values.sum(axis=1)
+    _, flows, _ = calculate_flows_from_arrays(values, prices, totals, adjustments)
+    days = dates.strftime('%Y-%m-%d')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quantity = np.where(prices > 0, values / prices, 0.0)
+        deviation = prices / reference - 1
+    anomalies = []
+
+    # 与参考收盘价不符
+    mismatch = held & (prices > 0) & (np.abs(np.nan_to_num(deviation)) > REFERENCE_TOLERANCE)
+    for r, c in zip(*np.nonzero(mismatch)):
+        ref = float(reference[r, c])
+        anomalies.append(_cell(days[r], assets[c], 'reference_mismatch', 'error',
+                               {'price': round(float(prices[r, c]), 4), 'reference_close': round(ref, 4),
+                                'deviation': round(float(deviation[r, c]), 6)},
+                               {'value': round(float(quantity[r, c] * ref), 2), 'price': round(ref, 4)}))
+
+    # 价格跳变 (与参考收盘价不符的单元格已报告，不重复)
+    spike, bad_print, returns, z = detect_price_spikes(prices, held, non_cash[None, :], day_factors, reference)
+    for r, c in zip(*np.nonzero(spike & ~mismatch)):
+        repair = None
+        if bad_print[r, c] and r + 1 < shape[0]:
+            # 前后两日的价格都换算到当日的股数口径
+            price = float(np.sqrt(prices[r - 1, c] / day_factors[r - 1, c] * prices[r + 1, c] * day_factors[r, c]))
+            repair = {'value': round(float(quantity[r, c] * price), 2), 'price': round(price, 4)}
+        anomalies.append(_cell(days[r], assets[c], 'price_spike', 'error' if bad_print[r, c] else 'warning',
+                               {'price': round(float(prices[r, c]), 4),
+                                'previous_price': round(float(prices[r - 1, c]), 4),
+                                'return': round(float(np.expm1(returns[r - 1, c])), 6),
+                                'zscore': round(float(z[r - 1, c]), 2), 'reverted': bool(bad_print[r, c])},
+                               repair))
+
+    # 价格长期不变
+    for c, start, end in detect_stale_runs(prices, held, non_cash[None, :]):
+        anomalies.append(_cell(days[end], assets[c], 'stale_price', 'warning',
+                               {'price': round(float(prices[end, c]), 4), 'start': days[start],
+                                'days': end - start + 1}))
+
+    # 没有现金抵消的数量跳变
+    jump, transient, trade = detect_quantity_jumps(values, prices, non_cash[None, :], day_factors, flows, totals)
+    for r, c in zip(*np.nonzero(jump)):
+        previous = float(quantity[r - 1, c] * day_factors[r - 1, c])
+        repair = {'value': round(previous * float(prices[r, c]), 2), 'price': round(float(prices[r, c]), 4)} \
+            if transient[r, c] else None
+        anomalies.append(_cell(days[r], assets[c], 'quantity_jump', 'error' if transient[r, c] else 'warning',
+                               {'quantity': round(float(quantity[r, c]), 4), 'previous_quantity': round(previous, 4),
+                                'trade_amount': round(float(trade[r, c]), 2),
+                                'inferred_cash_flow': round(float(flows[r]), 2), 'transient': bool(transient[r, c])},
+                               repair))
+
+    anomalies.sort(key=lambda item: (item['date'], item['asset'], item['kind']), reverse=True)
+    return anomalies
+
+
+def build_report(arrays, anomalies):
+    kinds = ['price_spike', 'stale_price', 'quantity_jump', 'reference_mismatch']
+    return {
+        'as_of': arrays['dates'][-1].strftime('%Y-%m-%d') if len(arrays['dates']) else None,
+        'rows': len(arrays['dates']),
+        'assets': len(arrays['assets']),
+        'summary': {kind: sum(item['kind'] == kind for item in anomalies) for kind in kinds},
+        'repairable': sum(item['repair'] is not None for item in anomalies),
+        'anomalies': anomalies,
+    }
+
+
+# ==============================================================================
+# 4. 自动修复
+# ==============================================================================
+
+def apply_repairs(history_file, anomalies):
+    """
+    把带有修复建议的单元格改写回所在的历史分区 (只改写包含这些日期的分区)，并相应调整 total_value。
+    同一单元格有多条建议时以参考收盘价为准。返回改写的单元格数。
+    """
+    repairs = {}
+    for item in sorted(anomalies, key=lambda a: a['kind'] == 'reference_mismatch'):
+        if item['repair'] is not None:
+            repairs[(item['date'], item['asset'])] = item['repair']
+    if not repairs:
+        return 0
+
+    patched = set()
+
+    def patched_chunks(partition):
+        for chunk in iter_history_chunks(partition):
+            for (day, asset), repair in repairs.items():
+                if day not in chunk.index or asset not in chunk.columns:
+                    continue
+                old_value = parse_history_matrix(chunk.loc[[day]], [asset])[0][0, 0]
+                chunk.at[day, asset] = format_history_cells([[repair['value']]], [[repair['price']]])[0, 0]
+                total = float(pd.to_numeric(chunk.at[day, 'total_value'], errors='coerce') or 0.0)
+                chunk.at[day, 'total_value'] = f"{total - old_value + repair['value']:.2f}"
+                patched.add((day, asset))
+            yield chunk
+
+    days = sorted(day for day, _ in repairs)
+    for partition in history_partitions(history_file, days[0], days[-1]):
+        write_history_chunks(partition, patched_chunks(partition))
+    return len(patched)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检测历史数据中的价格跳变、陈旧价格、数量跳变和与参考价格不符的数据")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="异常报告输出路径")
+    parser.add_argument('--start', default=None, help="只检查该日期之后的数据 (只读取与之重叠的历史分区)")
+    parser.add_argument('--refresh-reference', action='store_true', help="先下载收盘价缓存中缺失的参考价格")
+    parser.add_argument('--repair', action='store_true', help="把可修复的异常改写回历史文件")
+    args = parser.parse_args()
+
+    try:
+        arrays = load_history_arrays(args.history, start=args.start)
+    except FileNotFoundError:
+        print(f"错误: 找不到历史文件 '{args.history}'。")
+        return
+
+    adjustments, split_factors = load_factors(arrays)
+    reference = reference_close_matrix(arrays['dates'], arrays['assets'], refresh=args.refresh_reference)
+    anomalies = detect_anomalies(arrays, adjustments, reference, split_factors)
+    report = build_report(arrays, anomalies)
+
+    print("=" * 70)
+    print(f"历史数据异常检测 ({report['rows']} 行 × {report['assets']} 个资产)")
+    print("=" * 70)
+    for kind, count in report['summary'].items():
+        print(f"  {kind:<20} {count:>6}")
+    for item in anomalies[:20]:
+        print(f"  - [{item['severity']}] {item['date']} {item['asset']} {item['kind']}: {item['detail']}")
+    if len(anomalies) > 20:
+        print(f"  ... 共 {len(anomalies)} 条，完整列表见报告文件")
+
+    if write_json(args.output, report):
+        print(f"\n已生成异常报告: '{args.output}'")
+    else:
+        print(f"\n异常报告内容未变化，无需写入: '{args.output}'")
+
+    if args.repair:
+        patched = apply_repairs(args.history, anomalies)
+        print(f"已修复 {patched} 个单元格 (共 {report['repairable']} 条可修复的异常)。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+历史时点 (as-of) 各标的收益率回放
+get_asset_performance.PortfolioAnalyzer 只针对历史文件的最新一行、以运行当天推算的起始日期计算收益率，
+并且每个标的、每个时间段都要单独请求 yfinance。本脚本对一组参考日期 (默认是历史覆盖范围内每个已结束月份的月末)
+生成与 portfolio_assets_returns.json 相同结构的报告，用于回顾和核对:
+  - 每个参考日期取不晚于该日期的最后一行历史作为当时的持仓 (价值 > 0 的标的) 和当前价格
+  - 交易日历来自 market_calendar (本地规则生成，不请求网络)，
+    上一交易日 / 本周至今 / 本月至今 / 本年至今 / 过去30和250个交易日的起始交易日对所有参考日期一次性用 searchsorted 求出
+  - 股票/ETF 的起始价格取自本地收盘价缓存 (price_cache)，缺失时用历史文件中记录的价格；期权使用历史文件中记录的价格。
+    缓存的收盘价已按拆股调整到最新口径，先换算回当日的实际价格，与历史文件记录的当前价格口径一致
+  - 股票/ETF 的收益率按拆股/分红累计调整因子调整 (与 yfinance 复权收盘价的口径一致)
+所有参考日期 × 时间段 × 资产的收益率在一个三维数组上一次算出，默认不发起任何网络请求；
+--refresh 时只通过 price_cache 和 corporate_actions 批量增量更新一次缓存。
+结果写入 data/portfolio_assets_returns_asof.json: {'reference_dates': [...], 'reports': {参考日期: 报告}}。
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from corporate_actions import build_adjustment_factors, load_held_actions, split_basis_factors
+from history_store import load_history_arrays
+from instruments import REGISTRY
+from market_calendar import trading_days_between
+from output_writer import write_json
+from price_cache import get_close_panel, load_cached_closes
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_assets_returns_asof.json')
+# 参考日期之前需要覆盖的日历天数 (足以包含250个交易日和上一年的最后一个交易日)
+LOOKBACK_DAYS = 400
+# 起始交易日缺少价格时，最多沿用之前几个交易日的价格
+FILL_LIMIT = 5
+# 输出的时间段键，顺序与 portfolio_assets_returns.json 一致
+PERIODS = ['previous_trading_day', 'week_to_date', 'month_to_date', 'year_to_date',
+           'past_30_trading_days', 'past_250_trading_days']
+
+
+# ==============================================================================
+# 1. 参考日期与起始交易日
+# ==============================================================================
+
+def month_end_dates(dates):
+    """
+    历史覆盖范围内每个已结束月份的最后一个日历日 (最新一行所在的月份尚未结束，不包含在内)
+    """
+    if len(dates) == 0:
+        return pd.DatetimeIndex([])
+    month_starts = pd.date_range(dates[0] + pd.Timedelta(days=1), dates[-1], freq='MS')
+    return month_starts - pd.Timedelta(days=1)
+
+
+def asof_rows(dates, reference_dates):
+    """
+    每个参考日期对应的历史行 (不晚于参考日期的最后一行)；早于第一行的参考日期为 -1
+    """
+    return dates.searchsorted(reference_dates, side='right') - 1
+
+
+def period_start_sessions(sessions, asof_dates):
+    """
+    各时间段的起始交易日在 sessions 中的位置，返回 (参考日期数 × 时间段数) 的数组，超出 sessions 范围的为 -1。
+    起始交易日即收益率的基准收盘: 本周/本月/本年至今取上一周期的最后一个交易日，
+    过去 N 个交易日取当前交易日之前的第 N 个交易日。
+    """
+    asof_dates = pd.DatetimeIndex(asof_dates).normalize()
+    current = sessions.searchsorted(asof_dates, side='right') - 1
+
+    def last_session_before(days):
+        return sessions.searchsorted(days, side='left') - 1
+
+    week_start = asof_dates - pd.to_timedelta(asof_dates.weekday, unit='D')
+    month_start = asof_dates - pd.to_timedelta(asof_dates.day - 1, unit='D')
+    year_start = pd.to_datetime({'year': asof_dates.year, 'month': 1, 'day': 1})
+
+    starts = np.stack([
+        current - 1,
+        last_session_before(week_start),
+        last_session_before(month_start),
+        last_session_before(pd.DatetimeIndex(year_start)),
+        current - 30,
+        current - 250,
+    ], axis=1)
+    return current, np.where(current[:, None] >= 0, np.maximum(starts, -1), -1)
+
+
+# ==============================================================================
+# 2. 交易日价格面板
+# ==============================================================================
+
+def session_price_matrix(arrays, sessions, actions, refresh=False):
+    """
+    与交易日和资产列对齐的价格矩阵 (交易日数 × 资产数)，均为当日的实际价格 (未按之后的拆股调整)。
+    股票/ETF 优先使用收盘价缓存 (按 split_basis_factors 换算回当日口径)，其余位置使用历史文件记录的价格；
+    缺失的交易日沿用之前最多 FILL_LIMIT 个交易日的价格。
+    """
+    assets = arrays['assets']
+    recorded = pd.DataFrame(np.where(arrays['prices'] > 0, arrays['prices'], np.nan),
+                            index=arrays['dates'], columns=range(len(assets)))
+    recorded = recorded[~recorded.index.duplicated(keep='last')].reindex(sessions)
+
+    stocks = {j: REGISTRY[asset].yfinance for j, asset in enumerate(assets)
+              if REGISTRY.get(asset) is not None and REGISTRY[asset].is_stock}
+    if stocks and len(sessions):
+        symbols = list(dict.fromkeys(stocks.values()))
+        if refresh:
+            panel = get_close_panel(symbols, sessions[0], sessions[-1])
+        else:
+            panel = pd.DataFrame({symbol: load_cached_closes(symbol) for symbol in symbols})
+        panel = panel.reindex(sessions)
+        basis = split_basis_factors(sessions, assets, actions)
+        for j, symbol in stocks.items():
+            if symbol in panel.columns:
+                recorded[j] = (panel[symbol] * basis[:, j]).combine_first(recorded[j])
+
+    return recorded.ffill(limit=FILL_LIMIT).to_numpy(dtype=np.float64)
+
+
+# ==============================================================================
+# 3. 向量化计算
+# ==============================================================================
+
+def asset_type(asset):
+    instrument = REGISTRY.get(asset)
+    if instrument is not None and instrument.is_cash:
+        return 'cash'
+    if instrument is not None and instrument.is_option:
+        return 'option'
+    return 'stock'
+
+
+def asof_returns(arrays, reference_dates, refresh=False):
+    """
+    计算每个参考日期的报告，返回 {参考日期字符串: 报告}；没有对应历史行的参考日期被跳过。
+    """
+    dates, assets = arrays['dates'], arrays['assets']
+    reference_dates = pd.DatetimeIndex(reference_dates)
+    rows = asof_rows(dates, reference_dates)
+    keep = rows >= 0
+    reference_dates, rows = reference_dates[keep], rows[keep]
+    if len(rows) == 0:
+        return {}
+
+    asof_dates = dates[rows]
+    first_day = (asof_dates.min() - pd.Timedelta(days=LOOKBACK_DAYS)).date()
+    sessions = pd.DatetimeIndex(trading_days_between(first_day, asof_dates.max().date()))
+    current, starts = period_start_sessions(sessions, asof_dates)
+
+    held = (arrays['values'] > 0).any(axis=0)
+    actions = load_held_actions(sessions, assets, held, refresh)
+    prices = session_price_matrix(arrays, sessions, actions, refresh)
+    factors = build_adjustment_factors(sessions, assets, np.nan_to_num(prices), actions)
+
+    # 参考日期 × 时间段 × 资产
+    start_index = np.maximum(starts, 0)
+    current_index = np.maximum(current, 0)
+    current_prices = arrays['prices'][rows]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = factors[current_index][:, None, :] / factors[start_index]
+        returns = (current_prices[:, None, :] * growth / prices[start_index] - 1.0) * 100.0
+    valid = (starts >= 0)[:, :, None] & np.isfinite(returns) & (prices[start_index] > 0)
+
+    is_cash = np.array([REGISTRY.get(asset) is not None and REGISTRY[asset].is_cash for asset in assets])
+    returns = np.where(is_cash, 0.0, np.round(returns, 2))
+    valid |= is_cash
+
+    reports = {}
+    for r, reference in enumerate(reference_dates):
+        row = rows[r]
+        portfolio_returns = {}
+        for j in np.flatnonzero(arrays['values'][row] > 0):
+            asset = assets[j]
+            portfolio_returns[asset] = {
+                'current_price': float(current_prices[r, j]),
+                'total_value': float(arrays['values'][row, j]),
+                'asset_type': asset_type(asset),
+                'returns': {key: (float(returns[r, k, j]) + 0.0 if valid[r, k, j] else None)
+                            for k, key in enumerate(PERIODS)},
+            }
+        reports[reference.strftime('%Y-%m-%d')] = {
+            'analysis_date': dates[row].strftime('%Y-%m-%d'),
+            'portfolio_returns': portfolio_returns,
+        }
+    return reports
+
+
+def parse_reference_dates(text):
+    return pd.DatetimeIndex(sorted({pd.Timestamp(part.strip()) for part in text.split(',') if part.strip()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放历史上任意日期的各标的收益率报告")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="输出路径")
+    parser.add_argument('--dates', default=None, help="逗号分隔的参考日期 (默认: 每个已结束月份的月末)")
+    parser.add_argument('--refresh', action='store_true', help="先批量增量更新收盘价和拆股/分红缓存")
+    args = parser.parse_args()
+
+    reference_dates = parse_reference_dates(args.dates) if args.dates else None
+    # 只读取覆盖参考日期及其回看区间的历史分区
+    start = end = None
+    if reference_dates is not None and len(reference_dates):
+        start = (reference_dates.min() - pd.Timedelta(days=LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        end = reference_dates.max().strftime('%Y-%m-%d')
+    try:
+        arrays = load_history_arrays(args.history, start=start, end=end)
+    except FileNotFoundError:
+        print(f"错误: 找不到历史文件 '{args.history}'。")
+        return
+    if reference_dates is None:
+        reference_dates = month_end_dates(arrays['dates'])
+
+    reports = asof_returns(arrays, reference_dates, refresh=args.refresh)
+    if not reports:
+        print("没有可回放的参考日期 (参考日期均早于历史的第一行)。")
+        return
+
+    print("=" * 70)
+    print(f"历史时点收益率回放 ({len(reports)} 个参考日期)")
+    print("=" * 70)
+    for reference, report in reports.items():
+        holdings = report['portfolio_returns']
+        missing = sum(value is None for item in holdings.values() for value in item['returns'].values())
+        print(f"  {reference} (数据日期 {report['analysis_date']}): {len(holdings)} 个标的，{missing} 个收益率无数据")
+
+    output = {'reference_dates': list(reports), 'reports': reports}
+    if write_json(args.output, output):
+        print(f"\n结果已保存到: '{args.output}'")
+    else:
+        print(f"\n结果未变化，无需写入: '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
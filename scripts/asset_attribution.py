@@ -0,0 +1,204 @@
+"""
+资产收益归因 (离线)
+直接从历史文件中存储的 '(价值|价格)' 数据推导每个资产的每日持有数量、价格收益率
+以及对组合收益率的贡献矩阵，不发起任何网络请求
+(拆股/分红调整只读取 calculate_return.py 已更新的本地缓存)。
+输出所有曾持有资产在各报告周期内的收益率与贡献，是 get_asset_performance.py 的快速离线替代。
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from calculate_return import build_periods
+from corporate_actions import load_adjustment_factors
+from history_store import load_history_arrays
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_assets_attribution.json')
+
+# build_periods 的周期名称 -> portfolio_assets_returns.json 中使用的键名
+PERIOD_KEYS = {
+    "上一交易日": 'previous_trading_day',
+    "本周至今": 'week_to_date',
+    "本月至今": 'month_to_date',
+    "本年至今": 'year_to_date',
+    "过去30个交易日": 'past_30_trading_days',
+    "过去250个交易日": 'past_250_trading_days',
+}
+
+
+# ==============================================================================
+# 1. 数据加载
+# ==============================================================================
+
+def load_history_matrices(history_file=HISTORY_FILE):
+    """
+    分块读取历史文件并解析为按日期升序排列的
+    (日期索引, 资产列表, 价值矩阵, 价格矩阵, 累计拆股/分红调整因子矩阵)
+    """
+    arrays = load_history_arrays(history_file)
+    adjustments = load_adjustment_factors(arrays, refresh=False)
+    return arrays['dates'], arrays['assets'], arrays['values'], arrays['prices'], adjustments
+
+
+# ==============================================================================
+# 2. 每日归因矩阵
+# ==============================================================================
+
+def build_attribution_matrices(values, prices, total_values=None, adjustments=None):
+    """
+    由价值/价格矩阵推导每日归因矩阵，所有矩阵形状均为 (天数 × 资产数)，第0行为0
+    (adjustments 为累计拆股/分红调整因子矩阵，价格收益率按其调整为总收益口径):
+      - quantity: 持有数量 (价值 / 价格)
+      - price_return: 当日价格收益率 (前后两日价格均有效时才计算)
+      - contribution: 对组合收益率的贡献 (昨日权重 × 今日价格收益率)
+      - gain: 市场收益金额 (昨日数量 × 价格变化)
+      - valid: 当日价格收益率是否有效
+    """
+    if total_values is None:
+        total_values = values.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quantity = np.where(prices > 0, values / prices, 0.0)
+
+        prev_prices, curr_prices = prices[:-1], prices[1:]
+        prev_totals = total_values[:-1, None]
+        valid = (prev_prices > 0) & (curr_prices > 0)
+        # 按拆股/分红调整后的今日价格 (以昨日的股数计)
+        if adjustments is not None:
+            curr_prices = curr_prices * (adjustments[1:] / adjustments[:-1])
+
+        price_return = np.where(valid, curr_prices / prev_prices - 1, 0.0)
+        weights = np.where(np.abs(prev_totals) > 1e-6, values[:-1] / prev_totals, 0.0)
+        gain = np.where(valid, quantity[:-1] * (curr_prices - prev_prices), 0.0)
+
+    zero_row = np.zeros((1, values.shape[1]))
+    return {
+        'quantity': quantity,
+        'price_return': np.vstack([zero_row, price_return]),
+        'contribution': np.vstack([zero_row, weights * price_return]),
+        'gain': np.vstack([zero_row, gain]),
+        'valid': np.vstack([zero_row.astype(bool), valid]),
+    }
+
+
+def period_attribution(matrices, starts, ends):
+    """
+    一次性计算所有 (开始位置, 结束位置) 窗口内每个资产的
+    累计价格收益率、累计贡献和收益金额，返回 (窗口数 × 资产数) 矩阵。
+    没有任何有效价格收益率的窗口，其收益率为 NaN。
+    """
+    starts = np.maximum(np.asarray(starts), 1)
+    ends = np.asarray(ends)
+
+    growth = np.cumprod(1 + matrices['price_return'], axis=0)
+    zero_row = np.zeros((1, growth.shape[1]))
+    contribution_sum = np.vstack([zero_row, np.cumsum(matrices['contribution'], axis=0)])
+    gain_sum = np.vstack([zero_row, np.cumsum(matrices['gain'], axis=0)])
+    valid_count = np.vstack([zero_row, np.cumsum(matrices['valid'], axis=0)])
+
+    has_data = (valid_count[ends + 1] - valid_count[starts]) > 0
+    returns = np.where(has_data, growth[ends] / growth[starts - 1] - 1, np.nan)
+    return {
+        'return': returns,
+        'contribution': contribution_sum[ends + 1] - contribution_sum[starts],
+        'gain': gain_sum[ends + 1] - gain_sum[starts],
+    }
+
+
+# ==============================================================================
+# 3. 主执行逻辑
+# ==============================================================================
+
+def _percent(x):
+    return None if not np.isfinite(x) else round(float(x) * 100, 2)
+
+
+def calculate_attribution_report(index, assets, values, prices, adjustments=None):
+    """
+    计算所有曾持有资产在各报告周期内的收益率与贡献
+    """
+    matrices = build_attribution_matrices(values, prices, adjustments=adjustments)
+
+    periods = {}
+    for name, (start_date, end_date) in build_periods(index).items():
+        start_loc = index.searchsorted(start_date, side='left')
+        end_loc = index.searchsorted(end_date, side='right') - 1
+        if name in PERIOD_KEYS and 0 <= start_loc <= end_loc:
+            periods[PERIOD_KEYS[name]] = (start_loc, end_loc)
+
+    keys = list(periods.keys())
+    result = period_attribution(matrices,
+                                [periods[k][0] for k in keys],
+                                [periods[k][1] for k in keys])
+
+    # 资产最近一次有效价格（已清仓资产使用清仓前的最后价格）
+    has_price = prices > 0
+    last_price_loc = np.where(has_price.any(axis=0), len(index) - 1 - np.argmax(has_price[::-1], axis=0), -1)
+
+    report = {}
+    for j, asset in enumerate(assets):
+        if not (values[:, j] != 0).any():
+            continue
+        report[asset] = {
+            'current_price': float(prices[last_price_loc[j], j]) if last_price_loc[j] >= 0 else None,
+            'current_quantity': round(float(matrices['quantity'][-1, j]), 4),
+            'total_value': float(values[-1, j]),
+            'returns': {k: _percent(result['return'][i, j]) for i, k in enumerate(keys)},
+            'contributions': {k: _percent(result['contribution'][i, j]) for i, k in enumerate(keys)},
+            'gains': {k: round(float(result['gain'][i, j]), 2) for i, k in enumerate(keys)},
+        }
+
+    return {
+        'analysis_date': index[-1].strftime('%Y-%m-%d'),
+        'portfolio_returns': report,
+    }
+
+
+def main():
+    """
+    主执行函数
+    """
+    print("资产收益归因 (离线, 仅使用历史文件)")
+
+    try:
+        index, assets, values, prices, adjustments = load_history_matrices()
+    except FileNotFoundError:
+        print(f"错误: 找不到历史文件 '{HISTORY_FILE}'。")
+        return
+
+    if len(index) < 2:
+        print("错误: 历史数据不足两个交易日，无法计算资产收益归因。")
+        return
+
+    report = calculate_attribution_report(index, assets, values, prices, adjustments)
+
+    print(f"\n分析基准日期: {report['analysis_date']}，共 {len(report['portfolio_returns'])} 个曾持有资产")
+    summary = pd.DataFrame({asset: data['returns'] for asset, data in report['portfolio_returns'].items()}).T
+    print("\n收益率 (%):")
+    print(summary.to_string())
+    contributions = pd.DataFrame({asset: data['contributions']
+                                  for asset, data in report['portfolio_returns'].items()}).T
+    print("\n对组合收益率的贡献 (%):")
+    print(contributions.to_string())
+
+    try:
+        if write_json(OUTPUT_FILE, report):
+            print(f"\n结果已保存到: {OUTPUT_FILE}")
+        else:
+            print(f"\n结果未变化，无需写入: {OUTPUT_FILE}")
+    except Exception as e:
+        print(f"\n错误：无法写入归因结果文件 '{OUTPUT_FILE}': {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+基准比较
+portfolio_return.json 只给出组合自身的时间加权收益率 (TWRR)。本脚本对每个报告周期 (build_periods)
+把组合的 TWRR (calculate_period_return) 与一组可配置的基准比较:
+  - 基准在 config.ini 的 [Benchmarks] 小节中配置: 名称 = 代码，或 名称 = 代码:权重, 代码:权重 (组合基准，每日按权重再平衡)；
+    未配置时使用 SPY 和 QQQ。组合基准中的 CASH 收益率为0
+  - 所有基准成分的收盘价通过 price_cache.get_close_panel 一次批量获取 (本地缓存已覆盖的区间不再下载)，
+    收盘价已按拆股调整，只需再按本地缓存的分红记录调整 (不额外请求网络)，与组合收益率的口径一致
+  - 基准收盘价对齐到历史文件的日期 (缺失的日期沿用上一个收盘价)，每个周期输出以周期起点为基准的
+    组合/基准累计收益率序列，以及组合相对各基准的超额收益率 (累计收益率之差)
+结果写入 data/portfolio_benchmarks.json。
+"""
+
+import configparser
+import os
+
+import numpy as np
+import pandas as pd
+
+from calculate_return import HISTORY_FILE, build_periods, calculate_period_return, load_history_with_flows
+from corporate_actions import actions_of_kind, build_adjustment_factors, load_held_actions
+from instruments import REGISTRY
+from output_writer import write_json
+from price_cache import get_close_panel
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+CONFIG_FILE = os.path.join(ROOT_DIR, 'config.ini')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_benchmarks.json')
+BENCHMARK_SECTION = 'Benchmarks'
+DEFAULT_BENCHMARKS = {'SPY': {'SPY': 1.0}, 'QQQ': {'QQQ': 1.0}}
+# 第一天之前多取的日历天数，保证第一天有可沿用的收盘价
+PRICE_LOOKBACK_DAYS = 10
+PERIOD_ORDER = ["上一交易日", "本周至今", "本月至今", "本年至今", "过去30个交易日", "过去250个交易日"]
+
+
+# ==============================================================================
+# 1. 基准配置
+# ==============================================================================
+
+def parse_benchmark(text):
+    """
+    解析 'SPY' 或 'SPY:0.6, AGG:0.4'，返回权重之和为1的 {代码: 权重}；格式错误时抛出 ValueError
+    """
+    components = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        symbol, _, weight = part.partition(':')
+        components[symbol.strip().upper()] = float(weight) if weight.strip() else 1.0
+    total = sum(components.values())
+    if not components or total <= 0 or any(weight < 0 for weight in components.values()):
+        raise ValueError(f"基准 '{text}' 的权重必须非负且总和为正")
+    return {symbol: weight / total for symbol, weight in components.items() if weight > 0}
+
+
+def load_benchmarks(config_file=CONFIG_FILE):
+    """
+    读取 [Benchmarks] 小节 (保留名称的大小写)，返回 {名称: {代码: 权重}}
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    config.optionxform = str
+    config.read(config_file, encoding='utf-8')
+    if not config.has_section(BENCHMARK_SECTION):
+        return dict(DEFAULT_BENCHMARKS)
+    return {name: parse_benchmark(value) for name, value in config.items(BENCHMARK_SECTION)}
+
+
+# ==============================================================================
+# 2. 基准每日收益率
+# ==============================================================================
+
+def component_returns(index, symbols):
+    """
+    各成分在 index 上的每日收益率 (交易日数 × 成分数，第一天为0)。
+    股票/ETF 成分一次批量获取收盘价面板；没有任何价格的成分整列为 NaN，现金为0。
+    """
+    returns = np.zeros((len(index), len(symbols)))
+    stocks = {k: REGISTRY[symbol].yfinance for k, symbol in enumerate(symbols)
+              if REGISTRY.get(symbol) is not None and REGISTRY[symbol].is_stock}
+    if not stocks or len(index) == 0:
+        return returns
+
+    panel = get_close_panel(list(dict.fromkeys(stocks.values())),
+                            index[0] - pd.Timedelta(days=PRICE_LOOKBACK_DAYS), index[-1])
+    aligned = panel.reindex(panel.index.union(index)).ffill().reindex(index)
+    prices = np.full((len(index), len(symbols)), np.nan)
+    for k, symbol in stocks.items():
+        if symbol in aligned.columns:
+            prices[:, k] = aligned[symbol].to_numpy(dtype=np.float64)
+
+    # 只使用本地缓存的拆股/分红表 (refresh=False)，不额外请求网络；Close 已按拆股调整，只乘以分红因子
+    actions = load_held_actions(index, symbols, np.ones(len(symbols), dtype=bool), refresh=False)
+    dividends = actions_of_kind(actions, 'dividends')
+    adjusted = prices * build_adjustment_factors(index, symbols, np.nan_to_num(prices), dividends)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = adjusted[1:] / adjusted[:-1] - 1.0
+    returns[1:] = np.where(np.isfinite(daily), daily, 0.0)
+    for k in stocks:
+        if np.isnan(prices[:, k]).all():
+            returns[:, k] = np.nan
+    return returns
+
+
+def benchmark_returns(index, benchmarks):
+    """
+    各基准的每日收益率 {名称: 数组}；成分缺少价格的基准为 None
+    """
+    symbols = sorted({symbol for components in benchmarks.values() for symbol in components})
+    returns = component_returns(index, symbols)
+    column = {symbol: k for k, symbol in enumerate(symbols)}
+
+    result = {}
+    for name, components in benchmarks.items():
+        columns = [column[symbol] for symbol in components]
+        missing = [symbol for symbol in components if np.isnan(returns[:, column[symbol]]).all()]
+        if missing:
+            print(f"警告: 基准 '{name}' 的成分 {', '.join(missing)} 没有可用的收盘价，跳过该基准。")
+            result[name] = None
+            continue
+        result[name] = returns[:, columns] @ np.array(list(components.values()))
+    return result
+
+
+# ==============================================================================
+# 3. 各周期比较
+# ==============================================================================
+
+def _round(values, digits=6):
+    return [round(float(x), digits) + 0.0 for x in values]
+
+
+def compare_periods(df_with_flows, bench_returns):
+    """
+    对每个报告周期比较组合与各基准，返回按 PERIOD_ORDER 排列的列表
+    """
+    index = df_with_flows.index
+    portfolio_daily = df_with_flows['daily_return'].to_numpy(dtype=np.float64, copy=True)
+    portfolio_daily[0] = 0.0
+    wealth = {'portfolio': np.cumprod(1.0 + portfolio_daily)}
+    wealth.update({name: np.cumprod(1.0 + daily) for name, daily in bench_returns.items() if daily is not None})
+
+    reports = []
+    for name, (start_date, end_date) in build_periods(index).items():
+        result = calculate_period_return(df_with_flows, start_date, end_date, name)
+        if result is None:
+            continue
+        start_loc = index.searchsorted(start_date, side='left')
+        end_loc = index.searchsorted(end_date, side='right') - 1
+        # 累计收益率以周期开始前一个交易日的收盘为基准 (从第一天开始的周期以第一天为基准)
+        base = max(start_loc - 1, 0)
+        cumulative = {key: series[start_loc:end_loc + 1] / series[base] - 1.0 for key, series in wealth.items()}
+
+        report = {
+            'period': name,
+            'start_date': result['Start Date'],
+            'end_date': result['End Date'],
+            'portfolio_return': result['Return'],
+            'benchmarks': {},
+            'series': {
+                'dates': index[start_loc:end_loc + 1].strftime('%Y-%m-%d').tolist(),
+                'portfolio': _round(cumulative['portfolio']),
+                'benchmarks': {},
+                'excess': {},
+            },
+        }
+        for bench in bench_returns:
+            if bench not in cumulative:
+                report['benchmarks'][bench] = None
+                continue
+            bench_return = float(cumulative[bench][-1])
+            report['benchmarks'][bench] = {'return': bench_return,
+                                           'excess_return': result['Return'] - bench_return}
+            report['series']['benchmarks'][bench] = _round(cumulative[bench])
+            report['series']['excess'][bench] = _round(cumulative['portfolio'] - cumulative[bench])
+        reports.append(report)
+
+    order = {name: i for i, name in enumerate(PERIOD_ORDER)}
+    return sorted(reports, key=lambda r: order.get(r['period'], 99))
+
+
+def main():
+    """
+    主执行函数
+    """
+    try:
+        benchmarks = load_benchmarks()
+    except ValueError as e:
+        print(f"错误: 配置文件 [{BENCHMARK_SECTION}] 格式不正确: {e}")
+        return
+
+    df_with_flows = load_history_with_flows(HISTORY_FILE)
+    if df_with_flows is None:
+        return
+
+    bench_returns = benchmark_returns(df_with_flows.index, benchmarks)
+    periods = compare_periods(df_with_flows, bench_returns)
+
+    print("=" * 90)
+    print(f"基准比较 (截至 {df_with_flows.index[-1].strftime('%Y-%m-%d')})")
+    print("=" * 90)
+    rows = []
+    for report in periods:
+        row = {'周期': report['period'], '组合': f"{report['portfolio_return']:.2%}"}
+        for bench, item in report['benchmarks'].items():
+            row[bench] = f"{item['return']:.2%} ({item['excess_return']:+.2%})" if item else '无数据'
+        rows.append(row)
+    if rows:
+        print(pd.DataFrame(rows).set_index('周期').to_string())
+    print("括号内为组合相对该基准的超额收益率。")
+
+    output = {
+        'as_of': df_with_flows.index[-1].strftime('%Y-%m-%d'),
+        'benchmarks': {name: {symbol: round(weight, 6) for symbol, weight in components.items()}
+                       for name, components in benchmarks.items()},
+        'periods': periods,
+    }
+    if write_json(OUTPUT_FILE, output):
+        print(f"\n已成功生成基准比较文件: '{OUTPUT_FILE}'")
+    else:
+        print(f"\n基准比较文件内容未变化，无需写入: '{OUTPUT_FILE}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime
-import json
 import os
 
+from corporate_actions import load_sparse_adjustments, sparse_adjustment_summary
+from history_store import parse_history_matrix
+from output_writer import write_json
+from sparse_history import entry_keys, load_sparse_history, lookup_sorted
+
 # <<< 新增: 动态构建路径 >>>
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(SCRIPT_DIR)
@@ -12,8 +17,8 @@ os.makedirs(DATA_DIR, exist_ok=True)
 # --- 配置 ---
 HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
 OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_return.json')
-# 此列表用于计算 'total_value'，total_value 自身也应被排除
-EXCLUDE_COLS_FROM_SUM = ['total_value']
+# calculate_inferred_cash_flows 生成的计算列，连同 total_value 都不属于资产列
+CALCULATED_COLUMNS = ['total_value', 'investment_gain', 'inferred_cash_flow', 'daily_return']
 
 
 def parse_cell(cell):
@@ -36,59 +41,112 @@ def parse_cell(cell):
         return 0.0, 0.0  # 处理空值或解析失败
 
 
-def calculate_inferred_cash_flows(df):
+def get_asset_columns(df):
     """
-    计算每日的投资收益、推断的现金流和每日收益率。
+    返回所有资产列（排除 total_value 和所有计算列）
     """
-    df = df.sort_index(ascending=True)
-    df['investment_gain'] = 0.0
-    df['inferred_cash_flow'] = 0.0
-    df['daily_return'] = 0.0  # <-- 【新增】每日收益率 (TWRR的基础)
+    return [col for col in df.columns if col not in CALCULATED_COLUMNS]
 
-    # 找出所有资产列（排除所有计算列）
-    asset_columns = [col for col in df.columns if col not in [
-        'total_value', 'investment_gain', 'inferred_cash_flow', 'daily_return'
-    ]]
 
-    for i in range(1, len(df)):
-        prev_day = df.iloc[i - 1]
-        curr_day = df.iloc[i]
+def flows_from_expected_values(total_values, expected_end_of_day_value):
+    """
+    由每日收盘总值和 "持仓不变、仅价格更新" 的期望期末值 (长度为天数 - 1，对应第1天起的每一天)
+    计算每日的投资收益、推断现金流和每日收益率。返回三个长度为天数的数组，第一天均为0。
+    """
+    investment_gain = np.zeros(len(total_values))
+    inferred_cash_flow = np.zeros(len(total_values))
+    daily_return = np.zeros(len(total_values))
+    if len(total_values) < 2:
+        return investment_gain, inferred_cash_flow, daily_return
+
+    # 期初值 = 上一日的收盘市值，期末实际值 = 今日的收盘市值
+    start_of_day_value = total_values[:-1]
+    actual_end_of_day_value = total_values[1:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1. 投资收益 = 期望期末值 - 期初值
+        investment_gain[1:] = expected_end_of_day_value - start_of_day_value
+        # 2. 推断现金流 = 实际期末值 - 期望期末值
+        inferred_cash_flow[1:] = actual_end_of_day_value - expected_end_of_day_value
+        # 3. 每日收益率 = 投资收益 / 期初值 (避免除以零)
+        daily_return[1:] = np.where(np.abs(start_of_day_value) > 1e-6,
+                                    investment_gain[1:] / start_of_day_value, 0.0)
+
+    return investment_gain, inferred_cash_flow, daily_return
 
-        # 期初值 = 上一日的收盘市值
-        start_of_day_value = prev_day['total_value']
-        # 期末实际值 = 今日的收盘市值
-        actual_end_of_day_value = curr_day['total_value']
 
+def calculate_flows_from_arrays(values, prices, total_values=None, adjustments=None):
+    """
+    由 (天数 × 资产数) 的价值/价格矩阵向量化计算每日的投资收益、推断现金流和每日收益率。
+    adjustments 为 corporate_actions 计算的累计拆股/分红调整因子矩阵，缺省时不做调整。
+    返回三个长度为天数的数组，第一天均为0。
+    """
+    if total_values is None:
+        total_values = values.sum(axis=1)
+    if len(total_values) < 2:
+        return flows_from_expected_values(total_values, None)
+
+    prev_values, prev_prices, curr_prices = values[:-1], prices[:-1], prices[1:]
+    has_price = (prev_prices > 0) & (curr_prices > 0)
+    # 拆股/分红的单日调整因子 = 相邻两日累计因子之比
+    day_factors = 1.0 if adjustments is None else adjustments[1:] / adjustments[:-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
         # 计算期末期望值：假设没有交易，持仓不变，仅价格更新
-        expected_end_of_day_value = 0.0
-        for asset in asset_columns:
-            prev_val, prev_price = parse_cell(prev_day.get(asset, '(0|0)'))
-            _, curr_price = parse_cell(curr_day.get(asset, '(0|0)'))
-
-            if prev_price > 0 and curr_price > 0:
-                # 通过昨天的 价值/价格 计算出持有数量
-                quantity = prev_val / prev_price
-                # 数量 * 今天的价格 = 今天的期望价值
-                expected_end_of_day_value += quantity * curr_price
-            else:
-                # 如果价格信息缺失（例如CASH或数据错误），则假定其价值不变
-                expected_end_of_day_value += prev_val
+        # 通过昨天的 价值/价格 计算出持有数量，数量 * 今天的价格 = 今天的期望价值
+        # 如果价格信息缺失（例如CASH或数据错误），则假定其价值不变
+        # 拆股日持有数量按拆股比例调整，除息日把分红计入期望价值，避免被误判为现金流
+        expected_end_of_day_value = np.where(has_price, prev_values / prev_prices * curr_prices * day_factors,
+                                             prev_values).sum(axis=1)
 
-        # 1. 投资收益 = 期望期末值 - 期初值
-        gain = expected_end_of_day_value - start_of_day_value
-        df.loc[curr_day.name, 'investment_gain'] = gain
+    return flows_from_expected_values(total_values, expected_end_of_day_value)
 
-        # 2. 推断现金流 = 实际期末值 - 期望期末值
-        flow = actual_end_of_day_value - expected_end_of_day_value
-        df.loc[curr_day.name, 'inferred_cash_flow'] = flow
 
-        # 3. 【新增】每日收益率 = 投资收益 / 期初值
-        if abs(start_of_day_value) > 1e-6:  # 避免除以零
-            daily_ret = gain / start_of_day_value
-            df.loc[curr_day.name, 'daily_return'] = daily_ret
-        else:
-            df.loc[curr_day.name, 'daily_return'] = 0.0
+def calculate_flows_from_sparse(sparse, adjustments=None):
+    """
+    calculate_flows_from_arrays 的稀疏版本 (sparse_history 的 COO 表示)，只遍历非零单元格，
+    计算量与实际持仓数成正比，结果与宽表计算一致。
+    adjustments 为 corporate_actions.load_sparse_adjustments 返回的 (条目键, 单日调整因子)，缺省时不做调整。
+    返回 (总价值, 投资收益, 推断现金流, 每日收益率)，总价值为当日所有资产价值之和。
+    """
+    days, rows = len(sparse['dates']), sparse['rows']
+    total_values = np.bincount(rows, weights=sparse['values'], minlength=days)
+    if days < 2:
+        return (total_values,) + flows_from_expected_values(total_values, None)
+
+    # 只有昨日价值非零的持仓会影响今日的期望价值；今日价格在该资产次日的条目中查找 (没有条目即价格为0)
+    keys = entry_keys(sparse)
+    held = (sparse['values'] != 0) & (rows < days - 1)
+    next_keys = keys[held] + len(sparse['assets'])
+    prev_values, prev_prices = sparse['values'][held], sparse['prices'][held]
+    curr_prices = lookup_sorted(keys, sparse['prices'], next_keys)
+    has_price = (prev_prices > 0) & (curr_prices > 0)
+    day_factors = 1.0 if adjustments is None else lookup_sorted(adjustments[0], adjustments[1], next_keys, 1.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 与 calculate_flows_from_arrays 相同: 持有数量 × 今日价格 (拆股/分红调整)，价格缺失时假定价值不变
+        expected = np.where(has_price, prev_values / prev_prices * curr_prices * day_factors, prev_values)
+    expected_end_of_day_value = np.bincount(rows[held] + 1, weights=expected, minlength=days)[1:]
 
+    return (total_values,) + flows_from_expected_values(total_values, expected_end_of_day_value)
+
+
+def calculate_inferred_cash_flows(df, adjustments=None):
+    """
+    计算每日的投资收益、推断的现金流和每日收益率。
+    adjustments 须与按日期升序排列后的 df 及其资产列对齐。
+    """
+    df = df.sort_index(ascending=True)
+
+    # 找出所有资产列（排除所有计算列）
+    asset_columns = get_asset_columns(df)
+    values, prices = parse_history_matrix(df, asset_columns)
+
+    gain, flow, daily_return = calculate_flows_from_arrays(
+        values, prices, df['total_value'].to_numpy(dtype=np.float64), adjustments)
+    df['investment_gain'] = gain
+    df['inferred_cash_flow'] = flow
+    df['daily_return'] = daily_return  # <-- 【新增】每日收益率 (TWRR的基础)
     return df
 
 
@@ -160,62 +218,78 @@ def calculate_period_return(df_with_flows, start_date, end_date, period_name):
     }
 
 
-def main():
+def build_flows_frame(arrays):
     """
-    主执行函数
+    由 history_store.load_history_arrays 的结果构建按日期升序排列的数值DataFrame，
+    包含 total_value (所有资产列之和) 以及每日推断现金流与收益率列。
+    arrays 中含 'adjustments' (累计拆股/分红调整因子) 时按其调整。
     """
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', 1000)
+    # 根据所有资产列（包括CASH）之和修正 'total_value'
+    total_values = arrays['values'].sum(axis=1)
+    gain, flow, daily_return = calculate_flows_from_arrays(arrays['values'], arrays['prices'], total_values,
+                                                           arrays.get('adjustments'))
+    return pd.DataFrame({
+        'total_value': total_values,
+        'investment_gain': gain,
+        'inferred_cash_flow': flow,
+        'daily_return': daily_return,
+    }, index=pd.DatetimeIndex(arrays['dates'], name='date'))
+
+
+def build_sparse_flows_frame(sparse, adjustments=None):
+    """
+    build_flows_frame 的稀疏版本，输入为 sparse_history 的稀疏表示，输出的DataFrame结构相同
+    """
+    total_values, gain, flow, daily_return = calculate_flows_from_sparse(sparse, adjustments)
+    return pd.DataFrame({
+        'total_value': total_values,
+        'investment_gain': gain,
+        'inferred_cash_flow': flow,
+        'daily_return': daily_return,
+    }, index=pd.DatetimeIndex(sparse['dates'], name='date'))
 
+
+def load_history_with_flows(history_file=HISTORY_FILE, adjust_corporate_actions=True):
+    """
+    读取历史的稀疏长表形式 (见 sparse_history.py)，修正 'total_value' 并计算每日推断现金流与收益率
+    (默认按拆股/分红调整，见 corporate_actions.py)。
+    返回按日期升序排列的DataFrame；文件缺失或为空时返回None。
+    """
     try:
-        df = pd.read_csv(HISTORY_FILE, index_col='date', parse_dates=True)
+        sparse = load_sparse_history(history_file)
     except FileNotFoundError:
-        print(f"错误: 找不到历史文件 '{HISTORY_FILE}'。")
-        return
+        print(f"错误: 找不到历史文件 '{history_file}'。")
+        return None
+
+    adjustments = None
+    if adjust_corporate_actions:
+        adjustments = load_sparse_adjustments(sparse)
+        for day, asset, factor in sparse_adjustment_summary(sparse, adjustments):
+            print(f"拆股/分红调整: {day} {asset} 调整因子 {factor:.6f}")
 
-    # 1. 修正 'total_value'
-    # 找出所有非排除列（即资产列）
-    asset_columns = [col for col in df.columns if col not in EXCLUDE_COLS_FROM_SUM]
-    df['total_value'] = df.apply(
-        lambda row: sum(parse_cell(row.get(col, 0))[0] for col in asset_columns),
-        axis=1
-    )
+    # 1. 修正 'total_value'，并计算每日流水
+    df_with_flows = build_sparse_flows_frame(sparse, adjustments)
     print("数据已加载，并根据所有资产列（包括CASH）之和，在内部修正了'total_value'列。\n")
 
-    # 2. 计算每日流水
-    if len(df) < 1:
+    if len(df_with_flows) < 1:
         print("错误: 历史数据为空，无法计算。")
-        return
-    elif len(df) < 2:
+        return None
+    elif len(df_with_flows) < 2:
         print("注意: 历史数据不足两个交易日，无法计算推断现金流和'上一交易日'的收益。")
-        df['investment_gain'] = 0.0
-        df['inferred_cash_flow'] = 0.0
-        df['daily_return'] = 0.0  # <-- 【新增】
-        df_with_flows = df
-    else:
-        # 核心计算：推断现金流和每日收益率
-        df_with_flows = calculate_inferred_cash_flows(df)
 
-    print("=" * 60)
-    print("每日推断现金流与收益率分析 (最近5条):")
-    print("=" * 60)
-    # 【修改】增加 'daily_return' 的打印
-    print(df_with_flows[['total_value', 'investment_gain', 'inferred_cash_flow', 'daily_return']].tail())
-    print("\n说明:")
-    print(" - investment_gain: 当日由市场价格波动产生的纯收益/亏损。")
-    print(" - inferred_cash_flow: 推断的当日净现金流（非市场波动引起的市值变化）。")
-    print(" - daily_return: 当日的时间加权收益率 (gain / prev_day_total_value)。\n")
+    return df_with_flows
 
-    # 3. 定义周期
-    # 将所有计算的结束日期定义为CSV文件中的最后一天
-    end_of_period_date = df_with_flows.index[-1]
-    all_trading_days = df_with_flows.index
-    print(f"所有周期的计算将截止到数据中的最新日期: {end_of_period_date.strftime('%Y-%m-%d')}\n")
 
+def build_periods(all_trading_days):
+    """
+    根据数据中的交易日构建各报告周期的 (开始日期, 结束日期)。
+    所有周期的结束日期都是数据中的最后一天。
+    """
+    end_of_period_date = all_trading_days[-1]
     periods = {}
 
     # 添加“上一交易日” (start 和 end 都是最后一天)
-    if len(df_with_flows) >= 2:
+    if len(all_trading_days) >= 2:
         periods["上一交易日"] = (end_of_period_date, end_of_period_date)
 
     # 添加其他周期
@@ -230,6 +304,37 @@ def main():
     start_250 = all_trading_days[0] if len(all_trading_days) < 250 else all_trading_days[-250]
     periods["过去250个交易日"] = (start_250, end_of_period_date)
 
+    return periods
+
+
+def main():
+    """
+    主执行函数
+    """
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', 1000)
+
+    df_with_flows = load_history_with_flows()
+    if df_with_flows is None:
+        return
+
+    print("=" * 60)
+    print("每日推断现金流与收益率分析 (最近5条):")
+    print("=" * 60)
+    # 【修改】增加 'daily_return' 的打印
+    print(df_with_flows[['total_value', 'investment_gain', 'inferred_cash_flow', 'daily_return']].tail())
+    print("\n说明:")
+    print(" - investment_gain: 当日由市场价格波动产生的纯收益/亏损。")
+    print(" - inferred_cash_flow: 推断的当日净现金流（非市场波动引起的市值变化）。")
+    print(" - daily_return: 当日的时间加权收益率 (gain / prev_day_total_value)。\n")
+
+    # 3. 定义周期
+    # 将所有计算的结束日期定义为CSV文件中的最后一天
+    end_of_period_date = df_with_flows.index[-1]
+    print(f"所有周期的计算将截止到数据中的最新日期: {end_of_period_date.strftime('%Y-%m-%d')}\n")
+
+    periods = build_periods(df_with_flows.index)
+
     # 4. 循环计算
     results = []
     for name, (start_date, end_date) in periods.items():
@@ -250,9 +355,10 @@ def main():
     frontend_data = [{"period": r["Period"], "return": r["Return"], "profit": r["Market Gain"], "growth": r["Growth"]}
                      for r in results]
     try:
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(frontend_data, f, ensure_ascii=False, indent=2)
-        print(f"\n已成功生成前端数据文件: '{OUTPUT_FILE}'")
+        if write_json(OUTPUT_FILE, frontend_data):
+            print(f"\n已成功生成前端数据文件: '{OUTPUT_FILE}'")
+        else:
+            print(f"\n前端数据文件内容未变化，无需写入: '{OUTPUT_FILE}'")
     except Exception as e:
         print(f"\n错误：无法写入前端数据文件 '{OUTPUT_FILE}': {e}")
 
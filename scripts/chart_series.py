@@ -0,0 +1,122 @@
+"""
+价值图降采样序列
+仪表盘的历史价值堆叠图原先在主线程解析完整 CSV，并为每个资产的每一天绘制一个点，
+历史越长、资产越多，悬停时越卡顿。本脚本预先按多个分辨率 (最多 250/500/1000/2000 个点) 生成降采样序列:
+  - 用 LTTB (Largest-Triangle-Three-Buckets) 在总价值序列上选取保留形状的日期，
+    所有资产取相同的日期，保证各资产的堆叠面积相互对齐
+  - 写入 data/chart/value_<点数>.json，并在 data/chart/manifest.json 中列出各分辨率
+仪表盘按图表的像素宽度选择最接近的分辨率，绘制成本只与屏幕宽度有关，与历史长度无关。
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from history_store import load_history_arrays
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_DIR = os.path.join(DATA_DIR, 'chart')
+MANIFEST_NAME = 'manifest.json'
+RESOLUTIONS = [250, 500, 1000, 2000]
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回选中点的位置 (升序，总是包含第一个和最后一个点)。
+    首尾之外的点均分为 threshold - 2 个桶，每个桶选取与上一个选中点、下一个桶的平均点
+    构成三角形面积最大的点。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    edges = np.minimum(np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1, n - 1)
+    edges = np.append(edges, n - 1)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # 最后一个桶的 "下一个桶" 就是最后一个点
+        next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def build_value_series(arrays, points):
+    """
+    按总价值选取最多 points 个日期，返回该分辨率的图表数据 (资产值保留两位小数)
+    """
+    dates = arrays['dates']
+    total = arrays['total_value']
+    days = (dates - dates[0]).days.to_numpy(dtype=np.float64) if len(dates) else np.zeros(0)
+    positions = lttb_indices(days, total, points)
+    return {
+        'rows': len(dates),
+        'points': len(positions),
+        'dates': dates[positions].strftime('%Y-%m-%d').tolist(),
+        # + 0.0 把 -0.0 规范为 0.0
+        'total_value': (np.round(total[positions], 2) + 0.0).tolist(),
+        'assets': list(arrays['assets']),
+        'values': (np.round(arrays['values'][positions].T, 2) + 0.0).tolist(),
+    }
+
+
+def write_chart_series(history_file=HISTORY_FILE, output_dir=OUTPUT_DIR, resolutions=RESOLUTIONS):
+    """
+    生成各分辨率的序列文件和清单 (点数相同的分辨率只写一份)，删除不再引用的旧文件。返回清单。
+    """
+    arrays = load_history_arrays(history_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    levels = []
+    for resolution in sorted(resolutions):
+        series = build_value_series(arrays, resolution)
+        if levels and levels[-1]['points'] == series['points']:
+            continue
+        name = f"value_{resolution}.json"
+        write_json(os.path.join(output_dir, name), series)
+        levels.append({'points': series['points'], 'file': name})
+
+    manifest = {'rows': len(arrays['dates']), 'levels': levels}
+    write_json(os.path.join(output_dir, MANIFEST_NAME), manifest)
+
+    referenced = {MANIFEST_NAME} | {level['file'] for level in levels}
+    for name in os.listdir(output_dir):
+        if name.endswith('.json') and name not in referenced:
+            os.remove(os.path.join(output_dir, name))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成价值图的多分辨率降采样序列")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="输出目录")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.history):
+        print(f"错误: 历史文件 '{args.history}' 不存在。")
+        return
+
+    manifest = write_chart_series(args.history, args.output)
+    levels = ', '.join(str(level['points']) for level in manifest['levels'])
+    print(f"已由 {manifest['rows']} 行历史生成价值图序列 (点数: {levels})，输出目录 '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+拆股与分红调整
+历史文件只记录 '(价值|价格)'，calculate_inferred_cash_flows 用 昨日价值 / 昨日价格 推算持有数量，
+拆股当天价格骤降会被误判为巨额亏损 + 推断现金流入，分红除息也会低估收益率。
+
+本模块为每个持有的股票/ETF 维护本地缓存的拆股/分红表 (data/cache/corporate_actions.json)，
+首次运行下载覆盖整个历史区间的数据，之后只增量下载缓存尚未覆盖的日期，多个标的合并为一次批量请求。
+据此预先计算与历史日期索引对齐的累计调整因子矩阵，供收益与现金流计算向量化使用:
+  - 拆股: 除权日持有数量 × 拆股比例
+  - 分红: 除息日把每股分红计入当日收益 (总收益口径)，分红离开该持仓记为流出；
+          分红之后记入现金时产生的流入与之抵消
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from instruments import REGISTRY
+from output_writer import write_json
+from price_cache import _missing_ranges
+from sparse_history import entry_keys, lookup_sorted
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# {symbol: {'covered': [start, end], 'splits': {日期: 比例}, 'dividends': {日期: 每股金额}}}
+CORPORATE_ACTIONS_FILE = os.path.join(CACHE_DIR, 'corporate_actions.json')
+
+
+def is_equity_column(asset):
+    """
+    历史文件中的股票/ETF列 (排除现金和 TICKER_YYYY-MM-DD_STRIKE_TYPE 格式的期权列)
+    """
+    instrument = REGISTRY.get(asset)
+    return instrument is not None and instrument.is_stock
+
+
+def to_yfinance_symbol(asset):
+    # 如 BRK.B -> BRK-B
+    return REGISTRY[asset].yfinance
+
+
+# ==============================================================================
+# 1. 拆股/分红表缓存
+# ==============================================================================
+
+def load_actions_cache():
+    try:
+        with open(CORPORATE_ACTIONS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_actions_cache(cache):
+    write_json(CORPORATE_ACTIONS_FILE, cache)
+
+
+def _download_actions(symbols, start, end):
+    """
+    批量下载 [start, end] 区间的拆股与分红，返回 (拆股 DataFrame, 分红 DataFrame)，列为标的。
+    只有返回了行情的标的才会出现在列中 (用于区分 "区间内无事件" 和 "下载失败")。
+    """
+    print(f"  - [corporate-actions] 下载 {', '.join(symbols)} 的拆股/分红 ({start.date()} ~ {end.date()})...")
+    raw = yf.download(symbols, start=start.strftime('%Y-%m-%d'),
+                      end=(end + pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+                      actions=True, auto_adjust=False, progress=False, group_by='column')
+    if raw is None or raw.empty:
+        empty = pd.DataFrame(dtype='float64')
+        return empty, empty
+
+    frames = []
+    for field in ('Close', 'Stock Splits', 'Dividends'):
+        frame = raw[field] if field in raw.columns.get_level_values(0) else pd.DataFrame(index=raw.index)
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame(name=symbols[0])
+        if frame.index.tz is not None:
+            frame.index = frame.index.tz_localize(None)
+        frame.index = frame.index.normalize()
+        frames.append(frame)
+
+    closes, splits, dividends = frames
+    returned = [s for s in symbols if s in closes.columns and closes[s].notna().any()]
+    return splits.reindex(columns=returned).fillna(0.0), dividends.reindex(columns=returned).fillna(0.0)
+
+
+def refresh_corporate_actions(symbols, start, end, cache=None):
+    """
+    增量更新拆股/分红表: 只下载缓存尚未覆盖的区间，同一区间的标的合并为一次下载。
+    下载失败时保留已有缓存，下次运行重试。返回更新后的缓存字典。
+    """
+    cache = load_actions_cache() if cache is None else cache
+    start = pd.Timestamp(start).normalize()
+    # 今天的数据可能尚未确定，覆盖区间最多记录到昨天
+    end = min(pd.Timestamp(end).normalize(), pd.Timestamp.today().normalize() - pd.Timedelta(days=1))
+    if end < start:
+        return cache
+
+    groups = {}
+    for symbol in dict.fromkeys(symbols):
+        for missing in _missing_ranges(cache.get(symbol, {}).get('covered'), start, end):
+            groups.setdefault(missing, []).append(symbol)
+
+    changed = False
+    for (range_start, range_end), group_symbols in groups.items():
+        try:
+            splits, dividends = _download_actions(group_symbols, range_start, range_end)
+        except Exception as e:
+            print(f"  - [corporate-actions] 下载失败: {e}")
+            continue
+
+        for symbol in splits.columns:
+            entry = cache.setdefault(symbol, {'covered': None, 'splits': {}, 'dividends': {}})
+            for day, ratio in splits[symbol][splits[symbol] > 0].items():
+                entry['splits'][day.strftime('%Y-%m-%d')] = float(ratio)
+            for day, amount in dividends[symbol][dividends[symbol] > 0].items():
+                entry['dividends'][day.strftime('%Y-%m-%d')] = float(amount)
+
+            covered = entry['covered']
+            new_start = min(range_start, pd.Timestamp(covered[0])) if covered else range_start
+            new_end = max(range_end, pd.Timestamp(covered[1])) if covered else range_end
+            entry['covered'] = [new_start.strftime('%Y-%m-%d'), new_end.strftime('%Y-%m-%d')]
+            changed = True
+
+    if changed:
+        save_actions_cache(cache)
+    return cache
+
+
+# ==============================================================================
+# 2. 累计调整因子
+# ==============================================================================
+
+def action_events(dates, assets, actions):
+    """
+    把拆股/分红表映射到历史日期索引: 除权/除息日落在 (dates[t-1], dates[t]] 内的事件记在第 t 行。
+    返回 {'splits': (行, 列, 拆股比例), 'dividends': (行, 列, 每股分红)}，均为一维数组。
+    """
+    dates = pd.DatetimeIndex(dates)
+    events = {'splits': ([], [], []), 'dividends': ([], [], [])}
+    for j, asset in enumerate(assets):
+        entry = actions.get(to_yfinance_symbol(asset)) if is_equity_column(asset) else None
+        if not entry:
+            continue
+        for kind, target in events.items():
+            if not entry.get(kind):
+                continue
+            event_dates = pd.DatetimeIndex(list(entry[kind].keys()))
+            loc = dates.searchsorted(event_dates, side='left')
+            in_range = (loc >= 1) & (loc < len(dates))
+            target[0].extend(loc[in_range])
+            target[1].extend([j] * int(in_range.sum()))
+            target[2].extend(np.asarray(list(entry[kind].values()), dtype=np.float64)[in_range])
+    return {kind: (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64),
+                   np.asarray(amounts, dtype=np.float64))
+            for kind, (rows, cols, amounts) in events.items()}
+
+
+def actions_of_kind(actions, kind):
+    """
+    只保留一种公司行动 ('splits' 或 'dividends') 的拆股/分红表。
+    yfinance 的 Close 已按拆股调整，用它计算收益率时只能再乘以分红因子；历史文件记录的价格则需要完整的因子。
+    """
+    return {symbol: {kind: (entry or {}).get(kind) or {}} for symbol, entry in actions.items()}
+
+
+def build_adjustment_factors(dates, assets, prices, actions):
+    """
+    计算与历史日期索引对齐的累计调整因子矩阵 (天数 × 资产数)，第0行为1。
+    第 t 行的单日因子为 action_events 记在该行的事件之积:
+      拆股比例 × (1 + 每股分红 / 当日价格)
+    相邻两行累计因子之比即为该日的调整因子；没有事件的资产整列为1。
+    """
+    daily = np.ones(prices.shape, dtype=np.float64)
+    if len(dates) < 2:
+        return daily
+
+    events = action_events(dates, assets, actions)
+    rows, cols, factors = events['splits']
+    if len(rows):
+        np.multiply.at(daily, (rows, cols), factors)
+    rows, cols, amounts = events['dividends']
+    if len(rows):
+        per_share = np.zeros(prices.shape, dtype=np.float64)
+        np.add.at(per_share, (rows, cols), amounts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            yield_factor = np.where(prices > 0, 1.0 + per_share / prices, 1.0)
+        daily *= yield_factor
+
+    return np.cumprod(daily, axis=0)
+
+
+def cumulative_split_factors(entry, dates):
+    """
+    某个标的在每个日期的累计拆股因子 (除权日 <= 该日期的所有拆股比例之积)。
+    两个日期的累计因子之比即为期间内 1 股变成的股数。
+    """
+    dates = pd.DatetimeIndex(dates)
+    splits = (entry or {}).get('splits') or {}
+    if not splits:
+        return np.ones(len(dates), dtype=np.float64)
+    split_dates = pd.DatetimeIndex(list(splits.keys()))
+    order = np.argsort(split_dates.values)
+    ratios = np.concatenate([[1.0], np.cumprod(np.asarray(list(splits.values()), dtype=np.float64)[order])])
+    return ratios[split_dates[order].searchsorted(dates, side='right')]
+
+
+def split_basis_factors(dates, assets, actions):
+    """
+    把 yfinance 已按拆股调整 (到最新股数口径) 的收盘价换算回当日实际价格口径的倍数 (天数 × 资产数):
+    第 t 行为除权日晚于 dates[t] 的所有拆股比例之积 (包括 dates 范围之后的拆股)。
+    换算后的收盘价与历史文件记录的价格口径一致，可以直接乘以 build_adjustment_factors 的完整因子。
+    """
+    factors = np.ones((len(dates), len(assets)), dtype=np.float64)
+    for j, asset in enumerate(assets):
+        entry = actions.get(to_yfinance_symbol(asset)) if is_equity_column(asset) else None
+        splits = (entry or {}).get('splits') or {}
+        if splits:
+            total = float(np.prod(np.asarray(list(splits.values()), dtype=np.float64)))
+            factors[:, j] = total / cumulative_split_factors(entry, dates)
+    return factors
+
+
+def load_held_actions(dates, assets, held, refresh=True):
+    """
+    返回拆股/分红表缓存；refresh=True 时先增量更新 held 为真的股票/ETF列的记录，网络不可用时使用已有缓存
+    """
+    symbols = [to_yfinance_symbol(asset) for j, asset in enumerate(assets) if held[j] and is_equity_column(asset)]
+    cache = load_actions_cache()
+    if refresh and symbols:
+        cache = refresh_corporate_actions(symbols, dates[0], dates[-1], cache)
+    return cache
+
+
+def load_adjustment_factors(arrays, refresh=True):
+    """
+    为 history_store.load_history_arrays 的结果计算累计调整因子矩阵。
+    refresh=True 时先增量更新曾持有股票/ETF的拆股/分红表；网络不可用时使用已有缓存。
+    """
+    dates, assets = arrays['dates'], arrays['assets']
+    if len(dates) < 2:
+        return np.ones(arrays['prices'].shape, dtype=np.float64)
+
+    cache = load_held_actions(dates, assets, (arrays['values'] != 0).any(axis=0), refresh)
+    return build_adjustment_factors(dates, assets, arrays['prices'], cache)
+
+
+def adjustment_summary(arrays, adjustments):
+    """
+    列出历史区间内生效的拆股/分红调整: [(日期, 资产, 单日调整因子)]
+    """
+    daily = adjustments[1:] / adjustments[:-1]
+    rows, cols = np.nonzero(np.abs(daily - 1.0) > 1e-12)
+    return [(arrays['dates'][r + 1].strftime('%Y-%m-%d'), arrays['assets'][c], float(daily[r, c]))
+            for r, c in zip(rows, cols)]
+
+
+# ==============================================================================
+# 3. 稀疏持仓的调整因子
+# ==============================================================================
+
+def sparse_adjustment_factors(sparse, actions):
+    """
+    sparse_history 稀疏表示上的单日调整因子，只计算有事件的 (日期, 资产):
+    返回 (按升序排列的条目键 行 × 资产数 + 列, 对应的单日因子)，与 build_adjustment_factors 相邻两行之比一致。
+    """
+    dates, assets = sparse['dates'], sparse['assets']
+    if len(dates) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    width = len(assets)
+    events = action_events(dates, assets, actions)
+    split_rows, split_cols, ratios = events['splits']
+    dividend_rows, dividend_cols, amounts = events['dividends']
+
+    # 分红按除息日当天的价格换算为收益率，价格缺失的单元格不调整
+    dividend_keys = dividend_rows * width + dividend_cols
+    day_prices = lookup_sorted(entry_keys(sparse), sparse['prices'], dividend_keys)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yields = np.where(day_prices > 0, 1.0 + amounts / day_prices, 1.0)
+
+    keys = np.concatenate([split_rows * width + split_cols, dividend_keys])
+    factors = np.concatenate([ratios, yields])
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    combined = np.ones(len(unique_keys))
+    np.multiply.at(combined, inverse.reshape(-1), factors)
+    return unique_keys, combined
+
+
+def load_sparse_adjustments(sparse, refresh=True):
+    """
+    load_adjustment_factors 的稀疏版本: 只为曾持有的股票/ETF增量更新拆股/分红表，
+    返回 sparse_adjustment_factors 的 (条目键, 单日因子)
+    """
+    dates, assets = sparse['dates'], sparse['assets']
+    if len(dates) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    held = np.zeros(len(assets), dtype=bool)
+    held[sparse['cols'][sparse['values'] != 0]] = True
+    cache = load_held_actions(dates, assets, held, refresh)
+    return sparse_adjustment_factors(sparse, cache)
+
+
+def sparse_adjustment_summary(sparse, adjustments):
+    """
+    adjustment_summary 的稀疏版本: [(日期, 资产, 单日调整因子)]
+    """
+    keys, factors = adjustments
+    width = max(len(sparse['assets']), 1)
+    effective = np.abs(factors - 1.0) > 1e-12
+    return [(sparse['dates'][key // width].strftime('%Y-%m-%d'), sparse['assets'][key % width], float(factor))
+            for key, factor in zip(keys[effective], factors[effective])]
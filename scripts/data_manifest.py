@@ -0,0 +1,51 @@
+"""
+数据文件版本清单
+仪表盘原先对每个数据文件都附加 '?t=时间戳' 绕过缓存，每次打开页面都要重新下载所有文件。
+本脚本在工作流最后运行，为仪表盘读取的每个数据文件 (data/ 下的 CSV/JSON、data/history/ 分页文件和 data/chart/ 降采样序列)
+计算内容哈希，写入 data/data_manifest.json: {'files': {相对 data/ 的路径: 哈希前缀}}。
+仪表盘每次只重新获取这个清单，哈希与浏览器 IndexedDB 中缓存的版本一致时直接使用缓存。
+"""
+
+import glob
+import os
+
+from output_writer import file_digest, write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+MANIFEST_FILE = os.path.join(DATA_DIR, 'data_manifest.json')
+# 需要发布版本的数据文件 (相对 data/ 的通配符)
+PUBLISHED_PATTERNS = ['*.csv', '*.json', 'history/*.json', 'chart/*.json']
+# 哈希保留的十六进制位数，足以区分同一文件的不同版本
+DIGEST_LENGTH = 16
+
+
+def published_files(data_dir=DATA_DIR):
+    """
+    需要发布版本的数据文件，返回按路径排序的相对路径列表 (使用 '/' 分隔，与 URL 一致)
+    """
+    paths = set()
+    for pattern in PUBLISHED_PATTERNS:
+        paths.update(glob.glob(os.path.join(data_dir, pattern)))
+    relative = (os.path.relpath(path, data_dir).replace(os.sep, '/') for path in paths)
+    return sorted(path for path in relative if path != os.path.basename(MANIFEST_FILE))
+
+
+def build_data_manifest(data_dir=DATA_DIR):
+    return {'files': {path: file_digest(os.path.join(data_dir, path))[:DIGEST_LENGTH]
+                      for path in published_files(data_dir)}}
+
+
+def main():
+    manifest = build_data_manifest()
+    if write_json(MANIFEST_FILE, manifest):
+        print(f"已更新数据文件版本清单 ({len(manifest['files'])} 个文件): '{MANIFEST_FILE}'")
+    else:
+        print(f"数据文件均未变化，版本清单无需写入: '{MANIFEST_FILE}'")
+
+
+if __name__ == "__main__":
+    main()
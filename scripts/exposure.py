@@ -0,0 +1,130 @@
+"""
+持仓敞口报告 (离线)
+用历史文件的最新一行持仓和本地缓存的标的元数据 (ticker_metadata.py)，
+按资产类别、板块、行业和币种汇总持仓市值与权重，写入 data/portfolio_exposure.json。
+不发起任何网络请求；元数据缺失的标的归入 "未知"，会在下一次运行 main.py 获取报价时被补全。
+期权按其标的的板块/行业归类，资产类别为 "期权"。
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from history_store import read_latest_row
+from instruments import REGISTRY
+from output_writer import write_json
+from ticker_metadata import TICKER_METADATA
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_exposure.json')
+UNKNOWN = '未知'
+
+# yfinance quoteType -> 资产类别
+ASSET_CLASSES = {
+    'EQUITY': '股票',
+    'ETF': 'ETF',
+    'MUTUALFUND': '基金',
+    'INDEX': '指数',
+    'CRYPTOCURRENCY': '加密货币',
+}
+GROUPINGS = ['asset_class', 'sector', 'industry', 'currency']
+
+
+def classify_holding(asset):
+    """
+    根据缓存的元数据确定单个持仓的 (资产类别, 板块, 行业, 币种, 是否缺少元数据)
+    """
+    instrument = REGISTRY[asset]
+    if instrument.is_cash:
+        return '现金', '现金', '现金', 'USD', False
+
+    is_option = instrument.is_option
+    meta = TICKER_METADATA.get(instrument.underlying)
+    quote_type = meta.get('quoteType')
+
+    if is_option:
+        asset_class = '期权'
+    else:
+        asset_class = ASSET_CLASSES.get(quote_type, UNKNOWN)
+    if quote_type in ('ETF', 'MUTUALFUND'):
+        # 基金没有板块/行业，用基金分类 (如 Large Blend) 代替行业
+        sector, industry = '基金', meta.get('category') or UNKNOWN
+    else:
+        sector, industry = meta.get('sector') or UNKNOWN, meta.get('industry') or UNKNOWN
+    return asset_class, sector, industry, meta.get('currency') or UNKNOWN, not meta
+
+
+def build_holdings_frame(holdings):
+    """
+    由 read_latest_row 的持仓字典构建 DataFrame: 每个非零持仓一行，含市值和分类列
+    """
+    rows = [(asset, value) + classify_holding(asset) for asset, (value, _) in holdings.items() if value != 0]
+    return pd.DataFrame(rows, columns=['asset', 'value'] + GROUPINGS + ['missing_metadata']).set_index('asset')
+
+
+def aggregate_exposure(frame):
+    """
+    按各分类维度汇总市值、权重与持仓列表 (按市值绝对值降序)
+    """
+    total = frame['value'].sum()
+    report = {}
+    for grouping in GROUPINGS:
+        grouped = frame.groupby(grouping)['value']
+        summary = pd.DataFrame({'value': grouped.sum(), 'holdings': grouped.apply(lambda s: sorted(s.index))})
+        summary['weight'] = summary['value'] / total if total else np.nan
+        summary = summary.reindex(summary['value'].abs().sort_values(ascending=False).index)
+        report[grouping] = [
+            {'name': name, 'value': round(float(row['value']), 2),
+             'weight': round(float(row['weight']), 6) if np.isfinite(row['weight']) else None,
+             'holdings': row['holdings']}
+            for name, row in summary.iterrows()
+        ]
+    return report
+
+
+def main():
+    """
+    主执行函数
+    """
+    latest = read_latest_row(HISTORY_FILE)
+    if latest is None:
+        print(f"错误: 历史文件 '{HISTORY_FILE}' 不存在或为空。")
+        return
+
+    as_of, holdings, _ = latest
+    frame = build_holdings_frame(holdings)
+    total_value = float(frame['value'].sum())
+
+    report = {'as_of': as_of.strftime('%Y-%m-%d'), 'total_value': round(total_value, 2)}
+    report.update(aggregate_exposure(frame))
+    report['missing_metadata'] = sorted(frame.index[frame['missing_metadata']])
+
+    print("=" * 70)
+    print(f"持仓敞口报告 (截至 {report['as_of']}, 总市值 ${total_value:,.2f})")
+    print("=" * 70)
+    for grouping, title in zip(GROUPINGS, ['资产类别', '板块', '行业', '币种']):
+        print(f"\n按{title}:")
+        for item in report[grouping]:
+            weight = f"{item['weight']:.2%}" if item['weight'] is not None else '-'
+            print(f"  {item['name']:<32} ${item['value']:>14,.2f} {weight:>8}")
+    if report['missing_metadata']:
+        print(f"\n提示: 以下持仓缺少元数据，已归入 '{UNKNOWN}': {', '.join(report['missing_metadata'])}")
+
+    try:
+        if write_json(OUTPUT_FILE, report):
+            print(f"\n已成功生成持仓敞口文件: '{OUTPUT_FILE}'")
+        else:
+            print(f"\n持仓敞口文件内容未变化，无需写入: '{OUTPUT_FILE}'")
+    except Exception as e:
+        print(f"\n错误：无法写入持仓敞口文件 '{OUTPUT_FILE}': {e}")
+
+
+if __name__ == "__main__":
+    main()
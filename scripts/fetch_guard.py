@@ -0,0 +1,181 @@
+"""
+失败请求的负缓存与熔断器
+- 负缓存: 持久化记录获取失败的标的 (如已退市股票、已过期期权) 和 (标的, 日期) 组合，
+  保存失败次数与下次重试时间，重试间隔按失败次数指数退避，避免每次运行都重复请求已知无效的历史价格。
+  仍在配置中持有的标的不按退避期跳过 (否则会把真实持仓记为0)，失败次数只用于减少重试。
+- 熔断器: 按数据源统计连续失败次数，超过阈值后在冷却时间内直接跳过该数据源的请求。
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+NEGATIVE_CACHE_FILE = os.path.join(CACHE_DIR, 'negative_cache.json')
+
+# --- 退避参数 ---
+# 第一次失败后12小时内不再重试（工作流每天运行一次，即下一次运行会再试一次），之后每次失败间隔翻倍
+BASE_BACKOFF = timedelta(hours=12)
+MAX_BACKOFF = timedelta(days=30)
+
+# --- 熔断参数 ---
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN_SECONDS = 300
+# 计入熔断的 HTTP 状态码: 限流和服务器错误 (5xx)
+RATE_LIMIT_STATUS = 429
+
+
+def history_key(symbol, date):
+    """
+    (标的, 日期) 组合在负缓存中的键
+    """
+    return f"{symbol}@{date}"
+
+
+# ==============================================================================
+# 1. 负缓存
+# ==============================================================================
+
+class NegativeCache:
+    """
+    持久化的失败记录表 {键: {'failures': 失败次数, 'next_retry': ISO时间}}。
+    在下次重试时间之前 is_blocked 返回 True；获取成功后记录被删除。
+    """
+
+    def __init__(self, path=NEGATIVE_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+
+    def failures(self, key):
+        with self._lock:
+            return self._entries.get(key, {}).get('failures', 0)
+
+    def is_blocked(self, key, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and datetime.fromisoformat(entry['next_retry']) > now
+
+    def record_failure(self, key, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            failures = self._entries.get(key, {}).get('failures', 0) + 1
+            backoff = min(BASE_BACKOFF * 2 ** (failures - 1), MAX_BACKOFF)
+            self._entries[key] = {
+                'failures': failures,
+                'next_retry': (now + backoff).isoformat(timespec='seconds'),
+            }
+            self._dirty = True
+        return failures
+
+    def record_success(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        """
+        有改动时写回文件
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            write_json(self.path, self._entries)
+            self._dirty = False
+
+
+# ==============================================================================
+# 2. 熔断器
+# ==============================================================================
+
+class CircuitBreaker:
+    """
+    单个数据源的熔断器。
+    连续失败达到阈值后进入打开状态，冷却时间内 allow 返回 False；
+    冷却结束后放行一次试探请求，成功则恢复，失败则重新打开。
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                # 半开状态: 放行一次试探请求
+                self._opened_at = None
+                self._consecutive_failures = self.failure_threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                print(f"  - [circuit-breaker] 数据源 {self.name} 连续失败 {self._consecutive_failures} 次，"
+                      f"暂停请求 {self.cooldown} 秒")
+
+
+def is_provider_failure(exc):
+    """
+    判断异常是否属于数据源本身的问题: 网络/传输错误 (requests、curl_cffi 的异常都是 OSError)、
+    HTTP 429 和 5xx、限流。只有这类失败计入熔断器；
+    404、空数据、解析失败、已退市等标的本身的问题返回 False，由负缓存按标的退避。
+    """
+    if 'RateLimit' in type(exc).__name__:
+        return True
+    status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(exc, 'status_code', None)
+    if isinstance(status, int):
+        return status == RATE_LIMIT_STATUS or status >= 500
+    return isinstance(exc, OSError)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """
+    按数据源名称获取（必要时创建）共享的熔断器
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+NEGATIVE_CACHE = NegativeCache()
@@ -1,13 +1,16 @@
-import pandas as pd
 import yfinance as yf
 from datetime import datetime, timedelta
 import numpy as np
-import json
 import warnings
 import requests
 import time
 import os
 
+from history_store import read_latest_row
+from instruments import REGISTRY
+from option_lifecycle import is_expired_key, settled_price
+from output_writer import write_json
+
 warnings.filterwarnings('ignore')
 
 # <<< 新增: 动态构建路径 >>>
@@ -22,37 +25,29 @@ class PortfolioAnalyzer:
         初始化投资组合分析器
         """
         self.csv_file = csv_file_path
-        self.data = None
+        self.latest_date = None
         self.latest_holdings = {}
         self.results = {}
 
     def load_data(self):
         """
-        加载CSV数据并解析最新持仓
+        加载最新持仓。历史文件按日期降序存储，只需读取表头和第一条数据行
         """
         try:
-            self.data = pd.read_csv(self.csv_file)
-            self.data['date'] = pd.to_datetime(self.data['date'])
-            self.data = self.data.sort_values('date', ascending=False)
-
-            # 获取最新一天的数据
-            latest_row = self.data.iloc[0]
-
-            # 解析持仓数据（除了date和total_value列）
-            for column in self.data.columns:
-                if column not in ['date', 'total_value']:
-                    value_str = latest_row[column]
-                    if pd.notna(value_str) and value_str != '(0.00|0.00)':
-                        # 解析格式如 "(45957.60|353.52)"
-                        if '|' in str(value_str):
-                            parts = str(value_str).strip('()').split('|')
-                            if len(parts) == 2:
-                                total_value = float(parts[0])
-                                if total_value > 0:  # 只保留有价值的持仓
-                                    self.latest_holdings[column] = {
-                                        'total_value': total_value,
-                                        'price': float(parts[1])
-                                    }
+            latest = read_latest_row(self.csv_file)
+            if latest is None:
+                print("数据加载失败: 历史文件为空")
+                return False
+
+            self.latest_date, holdings, _ = latest
+
+            # 解析持仓数据，只保留有价值的持仓
+            for column, (total_value, price) in holdings.items():
+                if total_value > 0:
+                    self.latest_holdings[column] = {
+                        'total_value': total_value,
+                        'price': price
+                    }
 
             print(f"成功加载数据，最新持仓包含 {len(self.latest_holdings)} 个标的")
             return True
@@ -63,9 +58,10 @@ class PortfolioAnalyzer:
 
     def is_cash_symbol(self, symbol):
         """
-        判断是否为现金类资产
+        判断是否为现金类资产；无法解析的代码不是现金
         """
-        return symbol.upper() in ['CASH', 'USD', 'MONEY', 'CASH_USD']
+        instrument = REGISTRY.get(symbol)
+        return instrument is not None and instrument.is_cash
 
     def find_nearest_trading_day(self, target_date, symbol=None, max_days_back=10):
         """
@@ -182,62 +178,34 @@ class PortfolioAnalyzer:
         """
         判断是否为期权代码
         """
-        return '_' in symbol and ('PUT' in symbol.upper() or 'CALL' in symbol.upper())
+        instrument = REGISTRY.get(symbol)
+        return instrument is not None and instrument.is_option
 
     def parse_option_symbol(self, symbol):
         """
         解析期权代码，提取基础信息
         格式: TICKER_YYYY-MM-DD_STRIKE_TYPE
         """
-        try:
-            parts = symbol.split('_')
-            if len(parts) != 4:
-                return None
-
-            ticker = parts[0]
-            expiry = parts[1]
-            strike = float(parts[2])
-            option_type = parts[3].upper()
-
-            return {
-                'ticker': ticker,
-                'expiry': expiry,
-                'strike': strike,
-                'type': option_type
-            }
-        except Exception as e:
-            print(f"解析期权代码失败 {symbol}: {e}")
+        instrument = REGISTRY.get(symbol)
+        if instrument is None or not instrument.is_option:
+            print(f"解析期权代码失败 {symbol}")
             return None
+        return {
+            'ticker': instrument.underlying,
+            'expiry': instrument.expiry,
+            'strike': instrument.strike,
+            'type': instrument.option_type
+        }
 
     def convert_option_to_yfinance_format(self, symbol):
         """
-        将自定义期权格式转换为yfinance标准格式
-        基于您之前代码的转换逻辑
+        将自定义期权格式转换为yfinance标准格式 (OCC 代码)
         """
-        try:
-            parts = symbol.split('_')
-            underlying = parts[0]
-            date_parts = parts[1].split('-')
-            strike = parts[2]
-            option_type = parts[3][0].upper()  # 'PUT' -> 'P', 'CALL' -> 'C'
-
-            # 格式化日期: 2026-01-16 -> 260116
-            yy = date_parts[0][2:]
-            mm = date_parts[1]
-            dd = date_parts[2]
-
-            # 格式化执行价: 130 -> 00130000 (8位，补零，包含3位小数)
-            strike_price_formatted = f"{float(strike):.3f}".replace('.', '')
-            strike_price_padded = strike_price_formatted.zfill(8)
-
-            # 拼接成yfinance官方格式
-            yf_symbol = f"{underlying}{yy}{mm}{dd}{option_type}{strike_price_padded}"
-
-            return yf_symbol
-
-        except Exception as e:
-            print(f"转换期权代码失败 {symbol}: {e}")
+        instrument = REGISTRY.get(symbol)
+        if instrument is None or not instrument.is_option:
+            print(f"转换期权代码失败 {symbol}")
             return None
+        return instrument.occ
 
     def get_option_current_price(self, symbol):
         """
@@ -247,6 +215,9 @@ class PortfolioAnalyzer:
         option_info = self.parse_option_symbol(symbol)
         if not option_info:
             return None
+        if is_expired_key(symbol):
+            print(f"  - 期权 {symbol} 已到期，不再获取当前价格")
+            return None
 
         try:
             print(f"  - 获取期权当前价格: {symbol}")
@@ -291,6 +262,9 @@ class PortfolioAnalyzer:
         yf_symbol = self.convert_option_to_yfinance_format(symbol)
         if not yf_symbol:
             return None
+        if is_expired_key(symbol):
+            # 已到期合约不再请求，结算日使用结算价
+            return settled_price(symbol, target_date.strftime('%Y-%m-%d'))
 
         try:
             print(f"    -> 获取期权历史价格: {symbol} -> {yf_symbol}")
@@ -355,16 +329,11 @@ class PortfolioAnalyzer:
         """
         修复股票代码格式，基于Yahoo Finance要求
         """
-        # 如果是期权，返回None，使用专门的期权处理逻辑
-        if self.is_option_symbol(symbol):
+        # 期权和现金返回None，使用专门的处理逻辑；股票返回预先计算的yfinance代码 (如 BRK.B -> BRK-B)
+        instrument = REGISTRY.get(symbol)
+        if instrument is None or not instrument.is_stock:
             return None
-
-        # 如果是现金，返回None，使用专门的现金处理逻辑
-        if self.is_cash_symbol(symbol):
-            return None
-
-        # 修复Berkshire Hathaway代码格式
-        return symbol.replace('.', '-')
+        return instrument.yfinance
 
     def get_trading_dates(self, reference_date):
         """
@@ -506,8 +475,9 @@ class PortfolioAnalyzer:
                     returns[period] = None
                     print(f"    -> {period}: 无历史数据")
 
-                # 添加延迟避免过于频繁的请求
-                time.sleep(0.5)
+                # 添加延迟避免过于频繁的请求 (已到期合约不发起请求，无需等待)
+                if not is_expired_key(symbol):
+                    time.sleep(0.5)
 
             except Exception as e:
                 print(f"    -> 计算 {period} 收益率时出错: {e}")
@@ -535,7 +505,7 @@ class PortfolioAnalyzer:
             return False
 
         # 获取最新日期
-        latest_date = self.data.iloc[0]['date']
+        latest_date = self.latest_date
         dates = self.get_trading_dates(latest_date)
 
         print(f"分析基准日期: {latest_date.date()}")
@@ -578,9 +548,9 @@ class PortfolioAnalyzer:
         保存结果到JSON文件
         """
         output_path = os.path.join(DATA_DIR, output_file)
-        # 准备输出数据
+        # 准备输出数据 (分析日期取历史数据的最新日期，而不是运行时间，内容不变时文件也不变)
         output_data = {
-            'analysis_date': datetime.now().isoformat(),
+            'analysis_date': self.latest_date.strftime('%Y-%m-%d'),
             'portfolio_returns': {}
         }
 
@@ -599,11 +569,11 @@ class PortfolioAnalyzer:
                 }
             }
 
-        # 保存到文件
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-
-        print(f"结果已保存到: {output_path}")
+        # 保存到文件 (内容未变化时不写入)
+        if write_json(output_path, output_data):
+            print(f"结果已保存到: {output_path}")
+        else:
+            print(f"结果未变化，无需写入: {output_path}")
         return output_path
 
     def print_summary(self):
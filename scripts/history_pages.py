@@ -0,0 +1,127 @@
+"""
+历史表格分页数据
+仪表盘的 "历史数据" 表格原先下载整个 CSV，再为每一行每一列拼接 HTML 并逐个单元格格式化，历史较长时浏览器会卡死。
+本脚本把历史文件切分为固定行数、已格式化好的分页 JSON 文件，并生成:
+  - manifest.json: 行数、每页行数、列名、各页文件及其日期范围、排序索引文件
+  - index_<列名>.json: 每一列 (总价值和各资产) 按数值升序的行号排列，以及该列非零 (持有中) 的行号
+仪表盘按需只获取可见区域所在的页面，排序和 "只显示持有中的行" 筛选都直接使用预先计算的索引。
+
+行号按日期升序编号 (第0行为最早的一天)，每天新增的数据只会改变最后一页，
+配合 output_writer 的 "内容不变则不写入"，日常运行只有最后一页、清单和索引文件会变化。
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from history_store import load_history_arrays
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_DIR = os.path.join(DATA_DIR, 'history')
+MANIFEST_NAME = 'manifest.json'
+PAGE_ROWS = 200
+
+
+def page_file_name(page):
+    return f"page_{page:05d}.json"
+
+
+def index_file_name(column):
+    return f"index_{column}.json"
+
+
+def format_display_rows(arrays):
+    """
+    把历史数组格式化为表格显示用的字符串行 (按日期升序): [日期, 总价值, 各资产 '(价值|价格)']，
+    金额带千位分隔符
+    """
+    dates = arrays['dates'].strftime('%Y-%m-%d')
+    total = [f"{v:,.2f}" for v in arrays['total_value']]
+    cells = [[f"({v:,.2f}|{p:,.2f})" for v, p in zip(arrays['values'][:, j], arrays['prices'][:, j])]
+             for j in range(len(arrays['assets']))]
+    return [[date, total[i]] + [column[i] for column in cells] for i, date in enumerate(dates)]
+
+
+def build_sort_indexes(arrays):
+    """
+    每个数值列的排序索引: {列名: {'order': 按数值升序的行号 (数值相同时按日期), 'nonzero': 数值非零的行号}}
+    """
+    columns = ['total_value'] + list(arrays['assets'])
+    matrix = np.column_stack([arrays['total_value'], arrays['values']]) if len(arrays['dates']) else \
+        np.zeros((0, len(columns)))
+    order = np.argsort(matrix, axis=0, kind='stable')
+    nonzero = matrix != 0
+    return {
+        column: {'order': order[:, j].tolist(), 'nonzero': np.flatnonzero(nonzero[:, j]).tolist()}
+        for j, column in enumerate(columns)
+    }
+
+
+def write_history_pages(history_file=HISTORY_FILE, output_dir=OUTPUT_DIR, page_rows=PAGE_ROWS):
+    """
+    生成分页文件、排序索引和清单，并删除不再被清单引用的旧文件。返回 (清单, 实际写入的文件数)。
+    """
+    arrays = load_history_arrays(history_file)
+    rows = format_display_rows(arrays)
+    columns = ['date', 'total_value'] + list(arrays['assets'])
+    os.makedirs(output_dir, exist_ok=True)
+
+    written = 0
+    pages = []
+    for page, start in enumerate(range(0, len(rows), page_rows)):
+        page_data = rows[start:start + page_rows]
+        name = page_file_name(page)
+        written += write_json(os.path.join(output_dir, name), {'start_row': start, 'rows': page_data})
+        pages.append({'file': name, 'start': page_data[0][0], 'end': page_data[-1][0], 'rows': len(page_data)})
+
+    indexes = {}
+    for column, index in build_sort_indexes(arrays).items():
+        name = index_file_name(column)
+        written += write_json(os.path.join(output_dir, name), dict(index, column=column))
+        indexes[column] = name
+
+    latest = arrays['values'][-1] if len(rows) else np.zeros(len(arrays['assets']))
+    manifest = {
+        'source': os.path.basename(history_file),
+        'rows': len(rows),
+        'page_rows': page_rows,
+        'columns': columns,
+        'held': [asset for asset, value in zip(arrays['assets'], latest) if value != 0],
+        'pages': pages,
+        'indexes': indexes,
+    }
+    written += write_json(os.path.join(output_dir, MANIFEST_NAME), manifest)
+
+    referenced = {MANIFEST_NAME} | {page['file'] for page in pages} | set(indexes.values())
+    for name in os.listdir(output_dir):
+        if name.endswith('.json') and name not in referenced:
+            os.remove(os.path.join(output_dir, name))
+            print(f"  - 删除过期的分页文件: {name}")
+    return manifest, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成历史表格的分页数据与排序索引")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="输出目录")
+    parser.add_argument('--page-rows', type=int, default=PAGE_ROWS, help=f"每页行数 (默认 {PAGE_ROWS})")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.history):
+        print(f"错误: 历史文件 '{args.history}' 不存在。")
+        return
+
+    manifest, written = write_history_pages(args.history, args.output, args.page_rows)
+    print(f"已生成 {manifest['rows']} 行、{len(manifest['pages'])} 页、{len(manifest['indexes'])} 个排序索引 "
+          f"('{args.output}')，其中 {written} 个文件有变化。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+历史文件流式读写
+portfolio_details_history.csv 按日期降序存储，每个资产单元格为 '(总价值|单价)' 字符串。
+本模块按固定行数分块读取并解析为 float32/float64 数组，避免把整个文件读成 object 字符串表；
+同时提供只读取表头和第一条数据行的"最新一行"快速路径，以及分块写回的原子写入。
+
+历史按年分区: 已结束的年份在 validate_and_repair_history 校验后不再变化，
+由 compact_history 移入 history_archive/<历史文件名>/<年份>.csv (并在该目录的 manifest.json 中记录内容摘要)，
+历史文件本身只保留当前年份，作为唯一会被日常写入的 "热分区"。
+归档分区只有两种例外的改写: 结算日落在已归档年份的期权结算登记，以及 main.py --repair-year 的手动修复；
+两者改写后都通过 refresh_partition_digests 更新清单中的摘要。
+  - 写入 (save_history、修复、期权结算登记) 只读写单个分区文件: iter_history_chunks / write_history_chunks
+  - 读取 (iter_history_blocks / load_history_arrays) 按日期区间只打开与之重叠的分区，并合并各分区的资产列
+"""
+
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from output_writer import file_digest, write_json, write_streamed
+
+# 每块读取的行数，内存占用只与块大小和列数有关
+DEFAULT_CHUNK_ROWS = 512
+ZERO_CELL = "(0.00|0.00)"
+# 已归档年度分区的目录 (与历史文件同级) 和分区清单文件名
+ARCHIVE_DIR_NAME = 'history_archive'
+PARTITION_MANIFEST = 'manifest.json'
+
+
+# ==============================================================================
+# 1. 单元格解析
+# ==============================================================================
+
+def parse_history_matrix(df, columns):
+    """
+    向量化解析多列 '(价值|价格)' 单元格。
+    返回 (价值矩阵, 价格矩阵)，形状均为 (行数, 列数) 的 float64 数组。
+    纯数值单元格的价格视为1.0，无法解析的单元格记为 (0, 0)，与 parse_cell 保持一致。
+    """
+    if not columns:
+        empty = np.zeros((len(df), 0))
+        return empty, empty
+
+    cells = pd.Series(df[columns].to_numpy(dtype=str).ravel()).str.strip()
+    is_tuple = cells.str.startswith('(') & cells.str.endswith(')') & (cells.str.count(r'\|') == 1)
+    parts = cells.str.slice(1, -1).str.split('|', expand=True).reindex(columns=[0, 1])
+
+    plain_values = pd.to_numeric(cells, errors='coerce')
+    values = pd.to_numeric(parts[0], errors='coerce').where(is_tuple, plain_values)
+    # 纯数值单元格（如CASH或旧格式）的价格设为1.0
+    plain_prices = pd.Series(1.0, index=cells.index).where(plain_values.notna())
+    prices = pd.to_numeric(parts[1], errors='coerce').where(is_tuple, plain_prices)
+
+    # 任一部分解析失败时，整个单元格按 (0, 0) 处理
+    invalid = values.isna() | prices.isna()
+    values = values.mask(invalid, 0.0)
+    prices = prices.mask(invalid, 0.0)
+
+    shape = (len(df), len(columns))
+    return (values.to_numpy(dtype=np.float64).reshape(shape),
+            prices.to_numpy(dtype=np.float64).reshape(shape))
+
+
+def format_history_cells(values, prices):
+    """
+    parse_history_matrix 的逆操作：把价值/价格矩阵向量化格式化为 '(价值|价格)' 字符串矩阵
+    """
+    values = np.char.mod('%.2f', np.asarray(values, dtype=np.float64))
+    prices = np.char.mod('%.2f', np.asarray(prices, dtype=np.float64))
+    return np.char.add(np.char.add(np.char.add('(', values), np.char.add('|', prices)), ')')
+
+
+# ==============================================================================
+# 2. 流式读取
+# ==============================================================================
+
+def read_header(history_file):
+    """
+    只读取表头，返回列名列表（包含 'date'）；文件不存在或为空时返回空列表
+    """
+    if not os.path.exists(history_file) or os.path.getsize(history_file) == 0:
+        return []
+    with open(history_file, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def iter_history_chunks(history_file, chunksize=DEFAULT_CHUNK_ROWS):
+    """
+    按文件顺序（日期降序）分块读取单个分区文件的原始字符串数据，每块为以 'date' 为索引的 DataFrame
+    """
+    if not read_header(history_file):
+        return
+    try:
+        reader = pd.read_csv(history_file, index_col='date', dtype=str, chunksize=chunksize)
+        for chunk in reader:
+            yield chunk
+    except pd.errors.EmptyDataError:
+        return
+
+
+def _parse_chunk(chunk, dtype):
+    assets = [col for col in chunk.columns if col != 'total_value']
+    values, prices = parse_history_matrix(chunk, assets)
+    if 'total_value' in chunk.columns:
+        total_value = pd.to_numeric(chunk['total_value'], errors='coerce').fillna(0.0).to_numpy()
+    else:
+        total_value = values.sum(axis=1)
+    return {
+        'dates': pd.to_datetime(chunk.index),
+        'assets': assets,
+        'values': values.astype(dtype, copy=False),
+        'prices': prices.astype(dtype, copy=False),
+        'total_value': total_value.astype(dtype, copy=False),
+    }
+
+
+def iter_partition_blocks(partition_file, chunksize=DEFAULT_CHUNK_ROWS, dtype=np.float64):
+    """
+    分块读取并解析单个分区文件，每块产出一个字典:
+      - dates: DatetimeIndex
+      - assets: 资产列名列表（不含 total_value）
+      - values / prices: (行数 × 资产数) 的数值矩阵
+      - total_value: 文件中记录的总价值
+    """
+    for chunk in iter_history_chunks(partition_file, chunksize):
+        yield _parse_chunk(chunk, dtype)
+
+
+def iter_history_blocks(history_file, chunksize=DEFAULT_CHUNK_ROWS, dtype=np.float64, start=None, end=None):
+    """
+    按日期从新到旧分块读取热分区和与 [start, end] 重叠的已归档分区，块结构同 iter_partition_blocks。
+    不同分区的资产列可能不同；同一日期出现在多个分区时 (归档中途中断) 只保留热分区中的行。
+    """
+    start, end = _date_key(start), _date_key(end)
+    seen = set()
+    for path in history_partitions(history_file, start, end):
+        for chunk in iter_history_chunks(path, chunksize):
+            keep = ~chunk.index.isin(seen)
+            if start is not None:
+                keep &= chunk.index >= start
+            if end is not None:
+                keep &= chunk.index <= end
+            if not keep.all():
+                chunk = chunk[keep]
+            if chunk.empty:
+                continue
+            seen.update(chunk.index)
+            yield _parse_chunk(chunk, dtype)
+
+
+def _align_assets(block, assets):
+    """
+    把块的数值矩阵按资产列表重新排列，块中不存在的资产记为 0
+    """
+    if block['assets'] == assets:
+        return block['values'], block['prices']
+    positions = {asset: j for j, asset in enumerate(assets)}
+    columns = [positions[asset] for asset in block['assets']]
+    values = np.zeros((len(block['dates']), len(assets)), dtype=block['values'].dtype)
+    prices = np.zeros_like(values)
+    values[:, columns] = block['values']
+    prices[:, columns] = block['prices']
+    return values, prices
+
+
+def load_history_arrays(history_file, dtype=np.float64, chunksize=DEFAULT_CHUNK_ROWS, start=None, end=None):
+    """
+    分块读取历史 (只打开与 [start, end] 重叠的分区) 并拼接为按日期升序排列的数值数组，
+    结构同 iter_history_blocks 的单块；资产列为各分区资产列的并集。
+    文件不存在时抛出 FileNotFoundError。
+    """
+    if not os.path.exists(history_file):
+        raise FileNotFoundError(history_file)
+
+    blocks = list(iter_history_blocks(history_file, chunksize, dtype, start, end))
+    if not blocks:
+        assets = [col for col in read_header(history_file)[1:] if col != 'total_value']
+        empty = np.zeros((0, len(assets)), dtype=dtype)
+        return {'dates': pd.DatetimeIndex([]), 'assets': assets, 'values': empty, 'prices': empty,
+                'total_value': np.zeros(0, dtype=dtype)}
+
+    assets = blocks[0]['assets']
+    if any(block['assets'] != assets for block in blocks[1:]):
+        assets = sorted(set().union(*(block['assets'] for block in blocks)))
+    aligned = [_align_assets(block, assets) for block in blocks]
+
+    dates = blocks[0]['dates'].append([b['dates'] for b in blocks[1:]])
+    order = np.argsort(dates.values, kind='stable')
+    return {
+        'dates': dates[order],
+        'assets': assets,
+        'values': np.concatenate([values for values, _ in aligned])[order],
+        'prices': np.concatenate([prices for _, prices in aligned])[order],
+        'total_value': np.concatenate([b['total_value'] for b in blocks])[order],
+    }
+
+
+def read_latest_row(history_file):
+    """
+    最新一行快速路径：文件按日期降序存储，只需读取表头和第一条数据行。
+    返回 (日期, {资产: (价值, 价格)}, 总价值)；文件为空时返回 None。
+    若前两行不是降序（文件被手工改动过），退回到完整的分块扫描。
+    """
+    header = read_header(history_file)
+    if not header:
+        return None
+
+    with open(history_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        first = next(reader, None)
+        second = next(reader, None)
+
+    if first is None:
+        return None
+    if second is not None and second[0] > first[0]:
+        arrays = load_history_arrays(history_file)
+        assets = arrays['assets']
+        holdings = {asset: (float(arrays['values'][-1, j]), float(arrays['prices'][-1, j]))
+                    for j, asset in enumerate(assets)}
+        return arrays['dates'][-1], holdings, float(arrays['total_value'][-1])
+
+    row = pd.DataFrame([first[1:]], columns=header[1:], dtype=str)
+    assets = [col for col in row.columns if col != 'total_value']
+    values, prices = parse_history_matrix(row, assets)
+    holdings = {asset: (float(values[0, j]), float(prices[0, j])) for j, asset in enumerate(assets)}
+    total_value = pd.to_numeric(row['total_value'], errors='coerce').fillna(0.0).iloc[0] \
+        if 'total_value' in row.columns else float(values.sum())
+    return pd.Timestamp(first[0]), holdings, float(total_value)
+
+
+# ==============================================================================
+# 3. 分块写回
+# ==============================================================================
+
+def write_history_chunks(history_file, chunks, index_label='date'):
+    """
+    把若干字符串 DataFrame 块依次写入临时文件，内容有变化时原子替换目标文件。
+    第一块的列即为表头，后续块须具有相同的列。返回是否发生了写入。
+    """
+    def write_chunks(f):
+        header_written = False
+        for chunk in chunks:
+            chunk.to_csv(f, header=not header_written, index=True, index_label=index_label)
+            header_written = True
+
+    return write_streamed(history_file, write_chunks)
+
+
+# ==============================================================================
+# 4. 年度分区
+# ==============================================================================
+
+def _date_key(day):
+    """
+    把日期统一为 'YYYY-MM-DD' 字符串 (与历史文件的 date 列直接比较)；None 保持不变
+    """
+    return None if day is None else pd.Timestamp(day).strftime('%Y-%m-%d')
+
+
+def partition_dir(history_file):
+    """
+    历史文件的已归档分区目录: <历史文件所在目录>/history_archive/<历史文件名去掉扩展名>
+    """
+    directory, name = os.path.split(os.path.abspath(history_file))
+    return os.path.join(directory, ARCHIVE_DIR_NAME, os.path.splitext(name)[0])
+
+
+def partition_file(history_file, year):
+    return os.path.join(partition_dir(history_file), f"{int(year)}.csv")
+
+
+def partition_manifest_file(history_file):
+    return os.path.join(partition_dir(history_file), PARTITION_MANIFEST)
+
+
+def load_partition_manifest(history_file):
+    """
+    读取分区清单: {'hot': 历史文件名, 'partitions': [{'year', 'file', 'start', 'end', 'rows', 'digest'}, ...] (年份升序)}。
+    尚未归档过任何年份时返回空清单。
+    """
+    path = partition_manifest_file(history_file)
+    if not os.path.exists(path):
+        return {'hot': os.path.basename(history_file), 'partitions': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def history_partitions(history_file, start=None, end=None):
+    """
+    返回与 [start, end] 重叠的分区文件路径，按日期从新到旧排列: 热分区在前，其后为已归档年份 (降序)。
+    热分区只包含最后一个归档年份之后的数据，区间在此之前结束时不会打开热分区。
+    """
+    start, end = _date_key(start), _date_key(end)
+    partitions = load_partition_manifest(history_file)['partitions']
+    directory = partition_dir(history_file)
+
+    paths = []
+    hot_start = f"{partitions[-1]['year'] + 1}-01-01" if partitions else None
+    if os.path.exists(history_file) and (end is None or hot_start is None or end >= hot_start):
+        paths.append(history_file)
+    for entry in reversed(partitions):
+        if (start is None or entry['end'] >= start) and (end is None or entry['start'] <= end):
+            paths.append(os.path.join(directory, entry['file']))
+    return paths
+
+
+def _normalize_partition(frame):
+    """
+    整理一个分区的字符串数据: 列为 total_value + 按字母排序的资产列，删除在该分区内价值始终为0的资产列，按日期降序
+    """
+    assets = sorted(set(frame.columns) - {'total_value'})
+    frame = frame.reindex(columns=['total_value'] + assets)
+    frame['total_value'] = frame['total_value'].fillna("0.00")
+    frame = frame.fillna(ZERO_CELL)
+    values, _ = parse_history_matrix(frame, assets)
+    sold_out = [asset for asset, total in zip(assets, values.sum(axis=0)) if total == 0]
+    return frame.drop(columns=sold_out).sort_index(ascending=False)
+
+
+def compact_history(history_file, chunksize=DEFAULT_CHUNK_ROWS):
+    """
+    把热分区中早于最新数据行所在年份的行移入对应年份的归档分区 (与已有归档合并，同一日期以新移入的行为准)，
+    并更新分区清单。每个年份分区单独整理和写入，热分区只保留最新年份。
+    写入顺序为 归档分区 → 清单 → 热分区，中途中断时同一日期可能短暂同时存在于两个分区，读取时以热分区为准。
+    返回本次归档的年份列表。
+    """
+    latest = read_latest_row(history_file)
+    if latest is None:
+        return []
+    hot_start = f"{latest[0].year}-01-01"
+
+    kept, closed = [], {}
+    for chunk in iter_history_chunks(history_file, chunksize):
+        older = chunk.index < hot_start
+        kept.append(chunk[~older])
+        for year, rows in chunk[older].groupby(chunk.index[older].str[:4]):
+            closed.setdefault(int(year), []).append(rows)
+    if not closed:
+        return []
+
+    manifest = load_partition_manifest(history_file)
+    entries = {entry['year']: entry for entry in manifest['partitions']}
+    os.makedirs(partition_dir(history_file), exist_ok=True)
+    for year, frames in sorted(closed.items()):
+        path = partition_file(history_file, year)
+        merged = pd.concat(frames + list(iter_history_chunks(path, chunksize)))
+        merged = _normalize_partition(merged[~merged.index.duplicated(keep='first')])
+        write_history_chunks(path, [merged])
+        entries[year] = {'year': year, 'file': os.path.basename(path),
+                         'start': merged.index[-1], 'end': merged.index[0], 'rows': len(merged),
+                         'digest': file_digest(path)}
+
+    manifest = {'hot': os.path.basename(history_file), 'partitions': [entries[year] for year in sorted(entries)]}
+    write_json(partition_manifest_file(history_file), manifest)
+    write_history_chunks(history_file, [chunk for chunk in kept if not chunk.empty])
+    return sorted(closed)
+
+
+def refresh_partition_digests(history_file, paths):
+    """
+    归档分区被例外地改写后，更新分区清单中对应条目的内容摘要；paths 中的热分区和其他文件被忽略。
+    返回摘要发生变化的年份列表。
+    """
+    directory = partition_dir(history_file)
+    names = {os.path.basename(path) for path in paths if os.path.dirname(os.path.abspath(path)) == directory}
+    manifest = load_partition_manifest(history_file)
+    refreshed = []
+    for entry in manifest['partitions']:
+        if entry['file'] not in names:
+            continue
+        digest = file_digest(os.path.join(directory, entry['file']))
+        if entry.get('digest') != digest:
+            entry['digest'] = digest
+            refreshed.append(entry['year'])
+    if refreshed:
+        write_json(partition_manifest_file(history_file), manifest)
+    return refreshed
@@ -0,0 +1,124 @@
+"""
+标的注册表
+配置和历史文件中的资产名称 (如 SPY、BRK.B、CASH、META_2025-10-31_700_PUT) 在各脚本中需要反复判断类型、
+转换为各数据源的代码。本模块对每个名称只解析一次，预先计算:
+  - asset_type: 'stock' (股票/ETF) / 'option' / 'cash'
+  - yfinance: yfinance 代码 (BRK.B -> BRK-B，期权为 OCC 代码如 META251031P00700000)
+  - alphavantage: Alpha Vantage 代码 (BRK-B -> BRK.B，期权与现金为 None)
+  - occ: 期权的 OCC 代码
+  - underlying / expiry / strike / option_type: 期权的标的、到期日、行权价和类型
+  - multiplier: 合约乘数 (期权为100)
+之后通过 REGISTRY[名称] 以 O(1) 的字典查找获取；未注册的名称在第一次查找时解析并缓存。
+"""
+
+import threading
+from datetime import date
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+CASH_SYMBOLS = ('CASH', 'USD', 'MONEY', 'CASH_USD')
+OPTION_MULTIPLIER = 100
+
+
+class Instrument(NamedTuple):
+    key: str
+    asset_type: str
+    yfinance: Optional[str]
+    alphavantage: Optional[str]
+    occ: Optional[str] = None
+    underlying: Optional[str] = None
+    expiry: Optional[str] = None
+    strike: Optional[float] = None
+    option_type: Optional[str] = None
+    multiplier: int = 1
+
+    @property
+    def is_cash(self):
+        return self.asset_type == 'cash'
+
+    @property
+    def is_option(self):
+        return self.asset_type == 'option'
+
+    @property
+    def is_stock(self):
+        return self.asset_type == 'stock'
+
+
+def occ_symbol(underlying, expiry, option_type, strike):
+    """
+    OCC 期权代码: 标的 + YYMMDD + C/P + 8位行权价 (含3位小数)，如 META251031P00700000
+    """
+    return f"{underlying.replace('.', '-')}{expiry[2:4]}{expiry[5:7]}{expiry[8:10]}{option_type[0]}" \
+           f"{int(round(strike * 1000)):08d}"
+
+
+def parse_instrument(name):
+    """
+    解析单个资产名称。期权格式: UnderlyingTicker_YYYY-MM-DD_StrikePrice_Type
+    """
+    key = name.strip().upper()
+    if key in CASH_SYMBOLS:
+        return Instrument(key, 'cash', None, None)
+
+    if key.endswith(('_CALL', '_PUT')):
+        try:
+            underlying, expiry, strike, option_type = key.rsplit('_', 3)
+            expiry = date.fromisoformat(expiry).isoformat()
+            strike = float(strike)
+        except ValueError:
+            raise ValueError(f"无法解析期权代码 '{name}'")
+        occ = occ_symbol(underlying, expiry, option_type, strike)
+        return Instrument(key, 'option', occ, None, occ=occ, underlying=underlying, expiry=expiry,
+                          strike=strike, option_type=option_type, multiplier=OPTION_MULTIPLIER)
+
+    return Instrument(key, 'stock', key.replace('.', '-'), key.replace('-', '.'), underlying=key)
+
+
+class InstrumentRegistry:
+    """
+    资产名称 -> Instrument 的缓存表，按名称 O(1) 查找 (名称不区分大小写)。
+    多个线程可以同时查找；无法解析的期权代码抛出 ValueError。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._instruments = {}
+
+    def __getitem__(self, name):
+        instrument = self._instruments.get(name)
+        if instrument is None:
+            instrument = parse_instrument(name)
+            with self._lock:
+                self._instruments[name] = instrument
+                self._instruments[instrument.key] = instrument
+        return instrument
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except ValueError:
+            return default
+
+    def register(self, names):
+        """
+        预先注册一批名称 (配置中的持仓、历史文件的列)，跳过无法解析的名称，返回成功注册的 Instrument 列表
+        """
+        instruments = [self.get(name) for name in names if name != 'total_value']
+        return [instrument for instrument in instruments if instrument is not None]
+
+    def multipliers(self, names):
+        """
+        一组资产的合约乘数向量 (无法解析的名称按1处理)
+        """
+        return np.array([getattr(self.get(name), 'multiplier', 1) for name in names], dtype=np.float64)
+
+    def mask(self, names, asset_type):
+        """
+        一组资产中属于某一类型的布尔向量
+        """
+        return np.array([self[name].asset_type == asset_type for name in names], dtype=bool)
+
+
+REGISTRY = InstrumentRegistry()
@@ -0,0 +1,391 @@
+"""
+盘中快照模式 (高频轮询)
+main.py 每天只记录一次快照；本脚本在盘前 / 盘中 / 盘后 (PRE / REGULAR / POST) 时段内
+每隔 N 秒轮询一次报价，复用 main.select_market_price 的市场状态判断逻辑，
+只对报价发生变化的标的重新获取详细报价，并把组合估值写入独立的按时间索引的盘中存储。
+
+盘中存储是固定容量的环形缓冲区：数组在启动时一次性分配，写满后覆盖最旧的记录，
+写盘时只输出缓冲区内的行，因此整个交易日内的 CPU 和内存占用保持平稳。
+
+用法:
+  python scripts/intraday.py                     # 使用 yfinance 实时报价
+  python scripts/intraday.py --fake --polls 50   # 使用本地模拟报价源测试 (不指定 --polls 时轮询100次后模拟收盘)
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from history_store import format_history_cells, parse_history_matrix, read_latest_row, write_history_chunks
+from instruments import REGISTRY
+from main import (
+    ACTIVE_MARKET_STATES, DATA_DIR, DEFAULT_PORTFOLIO_NAME, ET_TIMEZONE, PORTFOLIOS,
+    get_et_datetime_string, get_option_price_yfinance, select_market_price, with_suffix,
+)
+from market_calendar import market_state as calendar_market_state
+from option_lifecycle import partition_options
+
+INTRADAY_DIR = os.path.join(DATA_DIR, 'intraday')
+INTRADAY_FILE = os.path.join(INTRADAY_DIR, 'portfolio_intraday.csv')
+
+# --- 默认参数 ---
+DEFAULT_INTERVAL_SECONDS = 60
+# 盘前 04:00 到盘后 20:00 共16小时，按默认间隔每分钟一行
+DEFAULT_CAPACITY = 16 * 60
+# 每隔多少次轮询写一次盘
+DEFAULT_FLUSH_EVERY = 5
+# 期权没有轻量的变化探测接口，每隔多少次轮询刷新一次期权链价格
+DEFAULT_OPTION_REFRESH_POLLS = 10
+# 组合中没有股票时，用这个标的的 info 获取市场状态
+MARKET_STATE_SYMBOL = 'SPY'
+# 模拟报价源在轮询多少次之后收盘 (未指定 --polls 时)
+DEFAULT_FAKE_CLOSE_AFTER = 100
+
+MARKET_STATE_CODES = {state: code for code, state in enumerate(ACTIVE_MARKET_STATES + ('CLOSED',))}
+MARKET_STATE_NAMES = np.array(list(MARKET_STATE_CODES.keys()))
+
+
+# ==============================================================================
+# 1. 报价源
+# ==============================================================================
+
+class YFinanceQuoteFeed:
+    """
+    yfinance 报价源。
+    changed() 用一次批量的1分钟K线下载探测哪些标的出现了新成交，
+    只有这些标的才会通过 quote() 获取完整的 info 报价。
+    """
+
+    def __init__(self):
+        self._last_bar = {}
+
+    def changed(self, symbols):
+        if not symbols:
+            return []
+        yf_symbols = [REGISTRY[symbol].yfinance for symbol in symbols]
+        raw = yf.download(yf_symbols, period='1d', interval='1m', prepost=True,
+                          auto_adjust=False, progress=False, group_by='column')
+        if raw is None or raw.empty:
+            return []
+
+        closes = raw['Close']
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(name=yf_symbols[0])
+
+        changed = []
+        for symbol, yf_symbol in zip(symbols, yf_symbols):
+            if yf_symbol not in closes.columns:
+                continue
+            last_bar = closes[yf_symbol].last_valid_index()
+            if last_bar is not None and last_bar != self._last_bar.get(symbol):
+                self._last_bar[symbol] = last_bar
+                changed.append(symbol)
+        return changed
+
+    def quote(self, symbol):
+        return yf.Ticker(REGISTRY[symbol].yfinance).info
+
+    def market_state(self):
+        return select_market_price(yf.Ticker(MARKET_STATE_SYMBOL).info)[3]
+
+    def option_quote(self, opt):
+        result = get_option_price_yfinance(opt['ticker'], opt['expiry'], opt['strike'], opt['type'])
+        return result[0] if result and np.isfinite(result[0]) else None
+
+
+class FakeQuoteFeed:
+    """
+    本地模拟报价源，用于离线测试轮询循环。
+    每次 changed() 以固定概率让部分标的的价格随机游走一步，
+    quote() 返回与 yfinance info 结构相同的字典；
+    轮询 close_after 次之后市场状态变为 CLOSED。
+    """
+
+    def __init__(self, base_prices, seed=0, change_probability=0.3, volatility=0.001,
+                 market_state='REGULAR', close_after=None):
+        self._prices = {symbol: float(price) if price > 0 else 100.0 for symbol, price in base_prices.items()}
+        self._rng = np.random.default_rng(seed)
+        self._change_probability = change_probability
+        self._volatility = volatility
+        self._market_state = market_state
+        self._close_after = close_after
+        self._polls = 0
+
+    def _step(self, symbol):
+        price = self._prices.get(symbol, 100.0)
+        self._prices[symbol] = round(price * float(np.exp(self._rng.normal(0.0, self._volatility))), 4)
+
+    def changed(self, symbols):
+        self._polls += 1
+        if self._close_after is not None and self._polls > self._close_after:
+            self._market_state = 'CLOSED'
+            return []
+
+        moved = self._rng.random(len(symbols)) < self._change_probability
+        changed = [symbol for symbol, flag in zip(symbols, moved) if flag]
+        for symbol in changed:
+            self._step(symbol)
+        return changed
+
+    def quote(self, symbol):
+        now = int(time.time())
+        price = self._prices.setdefault(symbol, 100.0)
+        return {
+            'marketState': self._market_state,
+            'preMarketPrice': price,
+            'preMarketTime': now,
+            'regularMarketPrice': price,
+            'regularMarketTime': now,
+        }
+
+    def market_state(self):
+        return self._market_state
+
+    def option_quote(self, opt):
+        self._step(opt['key'])
+        return self._prices[opt['key']]
+
+
+# ==============================================================================
+# 2. 环形缓冲区存储
+# ==============================================================================
+
+class IntradayStore:
+    """
+    固定容量的盘中快照存储。
+    所有数组在构造时一次性分配，append 为 O(1)，写满后覆盖最旧的记录。
+    文件格式与历史文件一致: 资产单元格为 '(总价值|单价)'，索引列为美东时间戳。
+    """
+
+    def __init__(self, path, assets, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.assets = list(assets)
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype='datetime64[s]')
+        self.states = np.zeros(capacity, dtype=np.int8)
+        self.totals = np.zeros(capacity)
+        self.values = np.zeros((capacity, len(self.assets)))
+        self.prices = np.zeros((capacity, len(self.assets)))
+        self._head = 0
+        self.size = 0
+
+    def append(self, timestamp, market_state, total_value, values, prices):
+        i = self._head
+        self.timestamps[i] = np.datetime64(timestamp.replace(tzinfo=None), 's')
+        self.states[i] = MARKET_STATE_CODES.get(market_state, MARKET_STATE_CODES['CLOSED'])
+        self.totals[i] = total_value
+        self.values[i] = values
+        self.prices[i] = prices
+        self._head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _order(self):
+        """
+        缓冲区内各行按时间先后的位置
+        """
+        return (np.arange(self._head - self.size, self._head)) % self.capacity
+
+    def load(self):
+        """
+        读取已有的盘中文件，只保留最近 capacity 行；文件中没有的资产列记为0
+        """
+        if not os.path.exists(self.path):
+            return
+        df = pd.read_csv(self.path, index_col='timestamp', dtype=str).tail(self.capacity)
+        if df.empty:
+            return
+
+        df = df.reindex(columns=['market_state', 'total_value'] + self.assets)
+        values, prices = parse_history_matrix(df.fillna('(0.00|0.00)'), self.assets)
+        n = len(df)
+        self.timestamps[:n] = pd.to_datetime(df.index).values.astype('datetime64[s]')
+        self.states[:n] = df['market_state'].map(MARKET_STATE_CODES).fillna(MARKET_STATE_CODES['CLOSED']).to_numpy()
+        self.totals[:n] = pd.to_numeric(df['total_value'], errors='coerce').fillna(0.0).to_numpy()
+        self.values[:n] = values
+        self.prices[:n] = prices
+        self.size = n
+        self._head = n % self.capacity
+
+    def to_frame(self):
+        order = self._order()
+        df = pd.DataFrame(format_history_cells(self.values[order], self.prices[order]),
+                          columns=self.assets,
+                          index=pd.DatetimeIndex(self.timestamps[order]).strftime('%Y-%m-%d %H:%M:%S'))
+        df.insert(0, 'total_value', np.char.mod('%.2f', self.totals[order]))
+        df.insert(0, 'market_state', MARKET_STATE_NAMES[self.states[order]])
+        return df
+
+    def flush(self):
+        """
+        按时间顺序写出缓冲区 (临时文件 + 原子替换)
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_history_chunks(self.path, [self.to_frame()], index_label='timestamp')
+
+
+# ==============================================================================
+# 3. 轮询循环
+# ==============================================================================
+
+def resolve_market_state(feed):
+    """
+    不依赖组合内股票报价的市场状态: 优先使用报价源，失败时按交易日历推算
+    """
+    try:
+        state = feed.market_state()
+    except Exception as e:
+        print(f"  - [intraday] 从报价源获取市场状态失败: {e}，改用交易日历推算")
+        state = None
+    return state or calendar_market_state()
+
+
+def build_positions(spec):
+    """
+    把投资组合配置展开为向量: (标的列表, 数量×合约乘数, 期权列表)，已到期的期权不参与轮询
+    """
+    tickers = [ticker for ticker, _ in spec['portfolio']]
+    options, _ = partition_options(spec['options_portfolio'])
+    symbols = tickers + [opt['key'] for opt in options]
+    units = np.array([quantity for _, quantity in spec['portfolio']] +
+                     [opt['quantity'] for opt in options], dtype=np.float64) * REGISTRY.multipliers(symbols)
+    return symbols, units, options
+
+
+def run_intraday(feed, spec, store, interval=DEFAULT_INTERVAL_SECONDS, polls=None,
+                 flush_every=DEFAULT_FLUSH_EVERY, option_refresh_polls=DEFAULT_OPTION_REFRESH_POLLS,
+                 sleep=time.sleep):
+    """
+    在市场活跃时段内循环轮询报价并记录组合估值，直到市场收盘或达到 polls 次。
+    每次轮询只对发生变化的标的获取详细报价，价格向量原地更新，估值为一次向量点积。
+    市场状态取自本次成功的股票报价；报价全部失败时沿用上一次的状态，
+    没有股票 (或尚无已知状态) 时由 resolve_market_state 从报价源或交易日历获取。
+    """
+    symbols, units, options = build_positions(spec)
+    tickers = symbols[:len(symbols) - len(options)]
+    position = {symbol: i for i, symbol in enumerate(symbols)}
+    prices = np.zeros(len(symbols))
+    cash = spec['cash']
+    market_state = None
+
+    poll = 0
+    while polls is None or poll < polls:
+        started = time.monotonic()
+        updated = False
+
+        # ===== 股票: 只获取有新成交的标的 =====
+        try:
+            changed = feed.changed(tickers)
+        except Exception as e:
+            print(f"  - [intraday] 探测报价变化失败: {e}")
+            changed = []
+        if poll == 0:
+            # 第一次轮询获取全部标的的报价，建立初始价格向量
+            changed = list(tickers)
+
+        # 没有任何变化时，用第一个标的刷新一次市场状态，以便及时发现收盘
+        quoted_state = None
+        for symbol in changed or tickers[:1]:
+            try:
+                price, _, _, quoted_state = select_market_price(feed.quote(symbol))
+            except Exception as e:
+                print(f"  - [intraday] 获取 {symbol} 报价失败: {e}")
+                continue
+            if price is not None and price != prices[position[symbol]]:
+                prices[position[symbol]] = price
+                updated = True
+
+        if quoted_state is not None:
+            market_state = quoted_state
+        elif not tickers or market_state is None:
+            market_state = resolve_market_state(feed)
+
+        if market_state not in ACTIVE_MARKET_STATES:
+            print(f"\n[intraday] 市场状态为 {market_state}，结束盘中轮询。")
+            break
+
+        # ===== 期权: 按较低频率刷新 =====
+        if options and poll % option_refresh_polls == 0:
+            for opt in options:
+                try:
+                    price = feed.option_quote(opt)
+                except Exception as e:
+                    print(f"  - [intraday] 获取期权 {opt['key']} 报价失败: {e}")
+                    continue
+                if price is not None and price != prices[position[opt['key']]]:
+                    prices[position[opt['key']]] = price
+                    updated = True
+
+        # ===== 估值并写入环形缓冲区 =====
+        if updated:
+            values = prices * units
+            total_value = float(values.sum()) + cash
+            store.append(datetime.now(ET_TIMEZONE), market_state, total_value,
+                         np.append(values, cash), np.append(prices, 1.0))
+            print(f"[intraday] {get_et_datetime_string()} {market_state} "
+                  f"更新 {len(changed)} 个标的，总价值 ${total_value:,.2f}")
+
+        poll += 1
+        if poll % flush_every == 0:
+            store.flush()
+
+        remaining = interval - (time.monotonic() - started)
+        if remaining > 0 and (polls is None or poll < polls):
+            sleep(remaining)
+
+    store.flush()
+    return store
+
+
+# ==============================================================================
+# 4. 主执行逻辑
+# ==============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="盘中快照模式: 在盘前/盘中/盘后时段高频轮询报价")
+    parser.add_argument('--portfolio', default=DEFAULT_PORTFOLIO_NAME, choices=list(PORTFOLIOS.keys()),
+                        help="要轮询的投资组合名称")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL_SECONDS, help="轮询间隔 (秒)")
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help="环形缓冲区保留的最大行数")
+    parser.add_argument('--polls', type=int, default=None, help="最多轮询次数 (默认直到收盘)")
+    parser.add_argument('--fake', action='store_true', help="使用本地模拟报价源")
+    parser.add_argument('--seed', type=int, default=0, help="模拟报价源的随机种子")
+    args = parser.parse_args()
+
+    spec = PORTFOLIOS[args.portfolio]
+    symbols, _, _ = build_positions(spec)
+    output_file = INTRADAY_FILE if args.portfolio == DEFAULT_PORTFOLIO_NAME \
+        else with_suffix(INTRADAY_FILE, args.portfolio)
+
+    if args.fake:
+        # 以历史文件中最新的单价作为模拟的起始价格
+        latest = read_latest_row(spec['history_file'])
+        holdings = latest[1] if latest else {}
+        # 模拟报价源不会等待，必须在有限次轮询后收盘，否则循环会不停地空转并重写盘中文件
+        feed = FakeQuoteFeed({symbol: holdings.get(symbol, (0.0, 100.0))[1] for symbol in symbols}, seed=args.seed,
+                             close_after=args.polls or DEFAULT_FAKE_CLOSE_AFTER)
+
+        def sleep(seconds):
+            pass
+    else:
+        feed = YFinanceQuoteFeed()
+        sleep = time.sleep
+
+    store = IntradayStore(output_file, symbols + ['CASH'], args.capacity)
+    store.load()
+
+    print("\n" + "=" * 70)
+    print(f"盘中快照模式 [{args.portfolio}] (美东时间: {get_et_datetime_string()})")
+    print(f"报价源: {'模拟' if args.fake else 'yfinance'}，间隔 {args.interval:g} 秒，保留最近 {args.capacity} 行")
+    print("=" * 70 + "\n")
+
+    run_intraday(feed, spec, store, interval=args.interval, polls=args.polls, sleep=sleep)
+    print(f"\n盘中数据已保存到: {output_file} (共 {store.size} 行)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+交易流水与历史重建
+可选的交易流水文件 (默认 data/transactions.csv，可在 config.ini 的 [General] ledger_file 中修改) 记录买入、卖出、
+入金、出金和分红等交易。本模块据此一次性 (向量化) 重建任意日期区间内每个交易日的
+portfolio_details_history.csv 数据行，新用户可以在几秒内回填多年的历史，而不必让每日任务运行多年。
+
+流水格式 (amount 和 fee 可留空):
+  date,action,symbol,quantity,price,amount,fee
+  2020-01-02,DEPOSIT,,,,100000,
+  2020-01-02,BUY,SPY,100,324.87,,1.00
+  2021-03-15,DIVIDEND,SPY,,,152.30,
+  2021-06-01,SELL,META_2021-07-16_300_PUT,1,4.20,,0.65
+
+  - BUY / SELL: 持仓数量增加 / 减少 quantity，现金减少 / 增加 成交金额 (amount，留空时为 数量 × 价格 × 合约乘数) 与 fee
+  - DEPOSIT / WITHDRAW: 现金增加 / 减少 amount
+  - DIVIDEND / INTEREST: 现金增加 amount
+  - FEE: 现金减少 amount
+期权代码使用与 [OptionsPortfolio] 相同的 TICKER_YYYY-MM-DD_STRIKE_TYPE 格式 (每张合约100股)。
+
+所有标的的收盘价通过 price_cache 一次批量获取；yfinance 的收盘价已按拆股复权，
+流水中的数量按 corporate_actions 的累计拆股因子换算，保证拆股前后的价值与实际一致。
+到期时仍持有的期权通过 option_lifecycle 按内在价值结算: 结算日按结算价估值，之后持仓清零、结算金额计入现金。
+
+用法:
+  python scripts/ledger.py [--start 2020-01-01] [--end 2024-12-31] [--ledger 文件] [--output 文件] [--dry-run]
+重建区间内已有的历史行会被替换，区间外的行保持不变。
+"""
+
+import argparse
+import configparser
+import os
+
+import numpy as np
+import pandas as pd
+
+from corporate_actions import cumulative_split_factors, is_equity_column, refresh_corporate_actions
+from history_store import ZERO_CELL, compact_history, format_history_cells, iter_history_chunks, write_history_chunks
+from instruments import REGISTRY
+from market_calendar import current_session, default_history_file, is_trading_day, previous_trading_day
+from option_lifecycle import is_expired_key, parse_option_key, settle_expired_options
+from price_cache import get_close_panel
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+LEDGER_COLUMNS = ['date', 'action', 'symbol', 'quantity', 'price', 'amount', 'fee']
+# 各交易类型的 (持仓数量方向, 现金方向)
+ACTION_SIGNS = {
+    'BUY': (1, -1),
+    'SELL': (-1, 1),
+    'DEPOSIT': (0, 1),
+    'WITHDRAW': (0, -1),
+    'DIVIDEND': (0, 1),
+    'INTEREST': (0, 1),
+    'FEE': (0, -1),
+}
+# 价格回看天数: 区间第一天不是交易日或缺少收盘价时，用之前最近的收盘价
+PRICE_LOOKBACK_DAYS = 10
+# 缺失的收盘价最多沿用之前 FILL_LIMIT 个交易日的价格，更久的缺失 (如退市、已到期) 按缺少收盘价处理
+FILL_LIMIT = 5
+
+
+def default_ledger_file():
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    config.read(os.path.join(ROOT_DIR, 'config.ini'), encoding='utf-8')
+    return os.path.join(DATA_DIR, config.get('General', 'ledger_file', fallback='transactions.csv'))
+
+
+# ==============================================================================
+# 1. 读取交易流水
+# ==============================================================================
+
+def load_ledger(ledger_file):
+    """
+    读取并校验交易流水，返回按日期排序的 DataFrame，并附加:
+      - units: 持仓数量变化 (带符号)
+      - cash: 现金变化 (带符号，已扣除手续费)
+    """
+    ledger = pd.read_csv(ledger_file, dtype={'symbol': str, 'action': str}, skipinitialspace=True)
+    missing = [col for col in ('date', 'action') if col not in ledger.columns]
+    if missing:
+        raise ValueError(f"交易流水缺少必要的列: {', '.join(missing)}")
+    ledger = ledger.reindex(columns=LEDGER_COLUMNS)
+
+    ledger['date'] = pd.to_datetime(ledger['date'], errors='coerce')
+    ledger['action'] = ledger['action'].str.strip().str.upper()
+    ledger['symbol'] = ledger['symbol'].fillna('').str.strip().str.upper()
+    for col in ('quantity', 'price', 'amount', 'fee'):
+        ledger[col] = pd.to_numeric(ledger[col], errors='coerce')
+
+    invalid = ledger['date'].isna() | ~ledger['action'].isin(list(ACTION_SIGNS))
+    is_trade = ledger['action'].isin(['BUY', 'SELL'])
+    invalid |= is_trade & ((ledger['symbol'] == '') | ledger['quantity'].isna() |
+                           (ledger['price'].isna() & ledger['amount'].isna()))
+    invalid |= ~is_trade & ledger['amount'].isna()
+    invalid |= is_trade & ledger['symbol'].map(lambda symbol: REGISTRY.get(symbol) is None)
+    if invalid.any():
+        rows = ', '.join(str(i + 2) for i in np.flatnonzero(invalid.to_numpy()))
+        raise ValueError(f"交易流水中有无法解析的行 (文件行号): {rows}")
+
+    position_sign = ledger['action'].map(lambda a: ACTION_SIGNS[a][0]).to_numpy(dtype=np.float64)
+    cash_sign = ledger['action'].map(lambda a: ACTION_SIGNS[a][1]).to_numpy(dtype=np.float64)
+    multiplier = REGISTRY.multipliers(ledger['symbol'])
+    gross = ledger['amount'].fillna(ledger['quantity'].abs() * ledger['price'] * multiplier).fillna(0.0).abs()
+
+    ledger['units'] = position_sign * ledger['quantity'].abs().fillna(0.0)
+    ledger['cash'] = cash_sign * gross - ledger['fee'].fillna(0.0)
+    return ledger.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+# ==============================================================================
+# 2. 向量化重建
+# ==============================================================================
+
+def trading_days(start, end):
+    days = pd.bdate_range(start, end)
+    return pd.DatetimeIndex([d for d in days if is_trading_day(d.date())])
+
+
+def last_completed_session():
+    in_progress, session_day = current_session()
+    return previous_trading_day(session_day) if in_progress else session_day
+
+
+def reconstruct_history(ledger, days, closes, split_entries):
+    """
+    由交易流水一次性重建每个交易日的持仓价值矩阵。
+    ledger: load_ledger 的结果；days: 交易日索引 (升序)
+    closes: 以日期为索引、列为资产的收盘价面板 (已按拆股复权)
+    split_entries: {资产: corporate_actions 缓存条目}
+    返回 (资产列表, 价值矩阵, 价格矩阵, 现金数组)，矩阵形状为 (天数 × 资产数)。
+    区间开始之前的交易计入第一天的期初持仓；非交易日的交易计入下一个交易日。
+    """
+    n = len(days)
+    end = days[-1]
+    ledger = ledger[ledger['date'] <= end]
+    # 每笔交易所在的行: 区间之前的交易 -> 第0行
+    rows = days.searchsorted(ledger['date'].to_numpy(), side='left')
+
+    cash_delta = np.zeros(n)
+    np.add.at(cash_delta, rows, ledger['cash'].to_numpy())
+    cash = np.cumsum(cash_delta)
+
+    trades = ledger['units'].to_numpy() != 0
+    assets = sorted(ledger.loc[trades, 'symbol'].unique())
+    column_of = {asset: j for j, asset in enumerate(assets)}
+    trade_cols = np.array([column_of[s] for s in ledger.loc[trades, 'symbol']], dtype=np.int64)
+
+    # 数量换算为"当前股数" (与复权价格的基准一致): 交易数量 × (今天的累计拆股因子 / 交易日累计拆股因子)
+    trade_dates = pd.DatetimeIndex(ledger.loc[trades, 'date'])
+    today = pd.DatetimeIndex([pd.Timestamp.today().normalize()])
+    units = ledger.loc[trades, 'units'].to_numpy(dtype=np.float64).copy()
+    day_splits = np.ones((n, len(assets)))
+    for asset, j in column_of.items():
+        entry = split_entries.get(asset)
+        if not entry:
+            continue
+        factors = cumulative_split_factors(entry, trade_dates.append(today))
+        mask = trade_cols == j
+        units[mask] *= factors[-1] / factors[:-1][mask]
+        day_splits[:, j] = cumulative_split_factors(entry, days) / factors[-1]
+
+    unit_delta = np.zeros((n, len(assets)))
+    np.add.at(unit_delta, (rows[trades], trade_cols), units)
+    holdings = np.cumsum(unit_delta, axis=0)
+    holdings[np.abs(holdings) < 1e-9] = 0.0
+
+    adjusted = closes.reindex(columns=assets).to_numpy(dtype=np.float64) if assets else np.zeros((n, 0))
+    multiplier = REGISTRY.multipliers(assets)
+    values = holdings * np.nan_to_num(adjusted) * multiplier
+    # 单元格记录当时的实际价格: 复权价格 ÷ 之后发生的拆股比例
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prices = np.where(holdings != 0, np.nan_to_num(adjusted / day_splits), 0.0)
+
+    unpriced = (holdings != 0) & np.isnan(adjusted)
+    for j in np.flatnonzero(unpriced.any(axis=0)):
+        print(f"警告: {assets[j]} 有 {int(unpriced[:, j].sum())} 个交易日缺少收盘价，这些日期的价值记为0。")
+
+    return assets, values, prices, cash
+
+
+def settle_expired_holdings(ledger, days, closes):
+    """
+    按 option_lifecycle 结算区间内到期的期权持仓: 结算日按内在价值 (结算价) 估值，
+    下一个交易日持仓清零、结算金额计入现金 (流水中已在结算日当天或之前平仓的合约不受影响)。
+    标的收盘价缺失、暂时无法结算的合约只打印警告。返回 (追加了结算交易的流水, 收盘价面板)。
+    区间开始之前已到期的持仓在第一天之前结算，不会以缺少收盘价的形式留在持仓中。
+    """
+    held = ledger[ledger['units'] != 0]
+    expired = [parse_option_key(key) for key in held['symbol'].unique() if is_expired_key(key)]
+    if not expired:
+        return ledger, closes
+
+    settlements = settle_expired_options(expired)
+    closes = closes.copy()
+    rows = []
+    for opt in expired:
+        entry = settlements.get(opt['key'])
+        if entry is None:
+            print(f"警告: 期权 {opt['key']} 已到期但尚未结算，到期之后的价值按缺少收盘价处理。")
+            continue
+        day = pd.Timestamp(entry['settlement_date'])
+        price = entry['settlement_price']
+        if day in closes.index:
+            closes.loc[day, opt['key']] = price
+        quantity = held.loc[(held['symbol'] == opt['key']) & (held['date'] <= day), 'units'].sum()
+        if abs(quantity) < 1e-9:
+            continue
+        # 结算日之后的第一天: 非交易日的交易计入下一个交易日
+        rows.append({'date': day + pd.Timedelta(days=1), 'action': 'SETTLE', 'symbol': opt['key'],
+                     'units': -quantity, 'cash': quantity * price * REGISTRY[opt['key']].multiplier})
+    if not rows:
+        return ledger, closes
+    ledger = pd.concat([ledger, pd.DataFrame(rows)], ignore_index=True)
+    return ledger.sort_values('date', kind='stable').reset_index(drop=True), closes
+
+
+def build_history_frame(days, assets, values, prices, cash):
+    """
+    转换为历史文件格式的字符串 DataFrame (日期降序，total_value + 按字母排序的资产列)
+    """
+    assets = list(assets) + ['CASH']
+    values = np.column_stack([values, cash])
+    prices = np.column_stack([prices, np.ones(len(days))])
+    order = np.argsort(assets)
+
+    cells = format_history_cells(values[:, order], prices[:, order])
+    frame = pd.DataFrame(cells, columns=[assets[j] for j in order],
+                         index=pd.Index(days.strftime('%Y-%m-%d'), name='date'))
+    frame.insert(0, 'total_value', np.char.mod('%.2f', values.sum(axis=1)))
+    return frame.iloc[::-1]
+
+
+def merge_into_history(history_file, frame, start, end):
+    """
+    用重建结果替换历史文件中 [start, end] 区间的行，区间外的已有行保持不变。返回是否发生了写入。
+    重建区间跨越已归档的年份时，这些年份的行随后由 compact_history 合并进对应的归档分区。
+    """
+    start, end = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    kept = [chunk[(chunk.index < start) | (chunk.index > end)] for chunk in iter_history_chunks(history_file)]
+    merged = pd.concat([frame] + kept) if kept else frame
+
+    asset_columns = sorted(set(merged.columns) - {'total_value'})
+    merged = merged.reindex(columns=['total_value'] + asset_columns)
+    merged['total_value'] = merged['total_value'].fillna("0.00")
+    merged = merged.fillna(ZERO_CELL).sort_index(ascending=False)
+    written = write_history_chunks(history_file, [merged])
+    compact_history(history_file)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由交易流水重建投资组合历史")
+    parser.add_argument('--ledger', default=None, help="交易流水CSV文件 (默认读取 config.ini 中的 ledger_file)")
+    parser.add_argument('--start', default=None, help="重建开始日期 (默认为流水中的第一天)")
+    parser.add_argument('--end', default=None, help="重建结束日期 (默认为最近一个已完成的交易日)")
+    parser.add_argument('--output', default=None, help="写入的历史文件 (默认为 config.ini 中的 history_file)")
+    parser.add_argument('--dry-run', action='store_true', help="只打印重建结果，不写入文件")
+    args = parser.parse_args()
+
+    ledger_file = args.ledger or default_ledger_file()
+    if not os.path.exists(ledger_file):
+        print(f"错误: 找不到交易流水文件 '{ledger_file}'。")
+        return
+
+    try:
+        ledger = load_ledger(ledger_file)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+    if ledger.empty:
+        print("交易流水为空，无需重建。")
+        return
+
+    start = pd.Timestamp(args.start) if args.start else ledger['date'].iloc[0]
+    end = pd.Timestamp(args.end) if args.end else pd.Timestamp(last_completed_session())
+    days = trading_days(start, end)
+    if days.empty:
+        print(f"错误: {start.date()} ~ {end.date()} 之间没有交易日。")
+        return
+    print(f"由 {len(ledger)} 条交易流水重建 {days[0].date()} ~ {days[-1].date()} 共 {len(days)} 个交易日的历史...")
+
+    symbols = sorted(ledger.loc[ledger['units'] != 0, 'symbol'].unique())
+    # 历史文件中的资产列名 -> yfinance 代码 (期权为 OCC 格式，如 META251031P00700000)
+    price_symbols = {asset: REGISTRY[asset].yfinance for asset in symbols}
+    panel = get_close_panel(list(price_symbols.values()), days[0] - pd.Timedelta(days=PRICE_LOOKBACK_DAYS), days[-1])
+    closes = panel.reindex(panel.index.union(days)).ffill(limit=FILL_LIMIT).reindex(days)
+    closes = closes.rename(columns={v: k for k, v in price_symbols.items()})
+    ledger, closes = settle_expired_holdings(ledger, days, closes)
+
+    equities = [asset for asset in symbols if is_equity_column(asset)]
+    actions = refresh_corporate_actions([price_symbols[a] for a in equities], ledger['date'].iloc[0],
+                                        pd.Timestamp.today()) if equities else {}
+    split_entries = {asset: actions.get(price_symbols[asset]) for asset in equities}
+
+    assets, values, prices, cash = reconstruct_history(ledger, days, closes, split_entries)
+    frame = build_history_frame(days, assets, values, prices, cash)
+    print(frame.head().to_string())
+
+    if args.dry_run:
+        return
+    history_file = args.output or default_history_file()
+    if merge_into_history(history_file, frame, days[0], days[-1]):
+        print(f"\n历史记录已重建并写入: {history_file}")
+    else:
+        print(f"\n历史记录内容未变化，无需写入: {history_file}")
+
+
+if __name__ == "__main__":
+    main()
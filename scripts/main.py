@@ -1,3 +1,4 @@
+import argparse
 import requests
 import time
 import os
@@ -12,6 +13,39 @@ import yfinance as yf
 import urllib3
 from datetime import datetime
 import pytz
+from concurrent.futures import ThreadPoolExecutor
+
+from fetch_guard import NEGATIVE_CACHE, get_breaker, history_key, is_provider_failure
+from market_calendar import check_market_closed, record_snapshot
+from option_pricing import (
+    build_greeks_report,
+    extract_chain_data,
+    load_chain_cache,
+    price_options_book,
+    save_chain_cache,
+    save_greeks_report,
+)
+from option_lifecycle import (
+    is_expired_key,
+    partition_options,
+    record_settlements_in_history,
+    settle_expired_options,
+    settled_price,
+)
+from instruments import REGISTRY
+from output_writer import write_figure
+from ticker_metadata import TICKER_METADATA
+from history_store import (
+    ZERO_CELL,
+    compact_history,
+    iter_history_chunks,
+    iter_partition_blocks,
+    load_history_arrays,
+    partition_file,
+    read_header,
+    refresh_partition_digests,
+    write_history_chunks,
+)
 
 # <<< 新增: 动态构建路径 >>>
 # 获取当前脚本所在的目录
@@ -51,6 +85,65 @@ def get_et_datetime_string():
 # 1. 配置加载模块
 # ==============================================================================
 
+# 多账户配置: 除默认的 [Portfolio] / [OptionsPortfolio] / [Cash] 外，
+# 可以用 [Portfolio:账户名] / [OptionsPortfolio:账户名] / [Cash:账户名] 定义更多命名投资组合
+DEFAULT_PORTFOLIO_NAME = 'default'
+HOUSEHOLD_SUFFIX = 'household'
+
+
+def with_suffix(file_path, suffix):
+    """
+    在文件名（扩展名之前）追加后缀: a/b.csv -> a/b_suffix.csv
+    """
+    base, ext = os.path.splitext(file_path)
+    return f"{base}_{suffix}{ext}"
+
+
+def parse_options_section(items):
+    """
+    解析期权配置项: UnderlyingTicker_YYYY-MM-DD_StrikePrice_Type = Quantity
+    """
+    options_portfolio = []
+    for key, quantity_str in items:
+        try:
+            instrument = REGISTRY[key]
+            if not instrument.is_option:
+                continue
+            option_details = {
+                'key': instrument.key,
+                'ticker': instrument.underlying,
+                'expiry': instrument.expiry,
+                'strike': instrument.strike,
+                'type': instrument.option_type,
+                'quantity': float(quantity_str)
+            }
+            options_portfolio.append(option_details)
+        except Exception:
+            print(f"警告: 无法解析期权 '{key}'。")
+    return options_portfolio
+
+
+def load_portfolio_sections(config, suffix=''):
+    """
+    读取一组 [Portfolio{suffix}] / [OptionsPortfolio{suffix}] / [Cash{suffix}] 配置
+    """
+    # [Portfolio] - 股票
+    portfolio = []
+    if config.has_section(f'Portfolio{suffix}'):
+        for ticker, quantity in config.items(f'Portfolio{suffix}'):
+            portfolio.append((ticker.upper(), float(quantity)))
+
+    # [OptionsPortfolio] - 期权
+    options_portfolio = []
+    if config.has_section(f'OptionsPortfolio{suffix}'):
+        options_portfolio = parse_options_section(config.items(f'OptionsPortfolio{suffix}'))
+
+    # [Cash]
+    cash_amount = config.getfloat(f'Cash{suffix}', 'amount', fallback=0.0)
+
+    return {'portfolio': portfolio, 'options_portfolio': options_portfolio, 'cash': cash_amount}
+
+
 def load_config():
     """
     从 config.ini 文件加载所有配置。
@@ -77,43 +170,26 @@ def load_config():
             print("错误: data_source 设置为 1 (Alpha Vantage)，但未提供有效的 api_key。")
             sys.exit()
 
-        # [Portfolio] - 股票
-        portfolio = []
-        for ticker, quantity in config.items('Portfolio'):
-            portfolio.append((ticker.upper(), float(quantity)))
+        # 命名投资组合: 从带 ':账户名' 后缀的持仓小节中收集账户名
+        named = []
+        for section in config.sections():
+            prefix, sep, name = section.partition(':')
+            if sep and prefix in ('Portfolio', 'OptionsPortfolio', 'Cash') and name and name not in named:
+                named.append(name)
 
-        # [OptionsPortfolio] - 期权
-        options_portfolio = []
-        if config.has_section('OptionsPortfolio'):
-            for key, quantity_str in config.items('OptionsPortfolio'):
-                try:
-                    parts = key.upper().rsplit('_', 2)
-                    if len(parts) != 3:
-                        continue
-                    base, strike_str, opt_type = parts
-                    date_parts = base.rsplit('_', 1)
-                    if len(date_parts) != 2:
-                        continue
-                    ticker, date_str = date_parts
-                    if opt_type not in ['CALL', 'PUT']:
-                        continue
-                    option_details = {
-                        'key': key.upper(),
-                        'ticker': ticker,
-                        'expiry': date_str,
-                        'strike': float(strike_str),
-                        'type': opt_type,
-                        'quantity': float(quantity_str)
-                    }
-                    options_portfolio.append(option_details)
-                except Exception:
-                    print(f"警告: 无法解析期权 '{key}'。")
-
-        # [Cash]
-        cash_amount = config.getfloat('Cash', 'amount', fallback=0.0)
+        if not named and not config.has_section('Portfolio'):
+            raise configparser.NoSectionError('Portfolio')
+
+        portfolios = {}
+        if config.has_section('Portfolio'):
+            portfolios[DEFAULT_PORTFOLIO_NAME] = load_portfolio_sections(config)
+            portfolios[DEFAULT_PORTFOLIO_NAME]['history_file'] = history_file
+        for name in named:
+            portfolios[name] = load_portfolio_sections(config, f':{name}')
+            portfolios[name]['history_file'] = with_suffix(history_file, name)
 
         return (data_source, api_key, history_file, plot_file, pie_chart_file,
-                max_retries, retry_delay, portfolio, options_portfolio, cash_amount)
+                max_retries, retry_delay, portfolios)
 
     except (configparser.NoSectionError, configparser.NoOptionError, ValueError) as e:
         print(f"错误: 配置文件 'config.ini' 格式不正确或缺少必要项: {e}")
@@ -122,7 +198,13 @@ def load_config():
 
 # 在程序开始时加载所有配置
 (DATA_SOURCE, API_KEY, HISTORY_FILE, PLOT_FILE, PIE_CHART_FILE, MAX_RETRIES,
- RETRY_DELAY, portfolio, options_portfolio, CASH_AMOUNT) = load_config()
+ RETRY_DELAY, PORTFOLIOS) = load_config()
+
+# 默认投资组合 (未命名的 [Portfolio] 等小节)
+_default_portfolio = PORTFOLIOS.get(DEFAULT_PORTFOLIO_NAME, {'portfolio': [], 'options_portfolio': [], 'cash': 0.0})
+portfolio = _default_portfolio['portfolio']
+options_portfolio = _default_portfolio['options_portfolio']
+CASH_AMOUNT = _default_portfolio['cash']
 
 
 # ==============================================================================
@@ -133,13 +215,19 @@ def get_stock_price_alphavantage(ticker):
     """
     使用 Alpha Vantage API 获取股票价格
     """
-    av_ticker = ticker.replace('-', '.')
+    av_ticker = REGISTRY[ticker].alphavantage
+    breaker = get_breaker('alphavantage')
+    if not breaker.allow():
+        print(f"  - [AlphaVantage] 数据源已熔断，跳过 {av_ticker}")
+        return None
+
     print(f"  - [AlphaVantage] 正在获取 {av_ticker}...")
     url = f'https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={av_ticker}&apikey={API_KEY}'
     try:
         response = requests.get(url)
         response.raise_for_status()
         data = response.json()
+        breaker.record_success()
         global_quote = data.get('Global Quote')
         if global_quote and '05. price' in global_quote and '07. latest trading day' in global_quote:
             time.sleep(1)
@@ -151,88 +239,120 @@ def get_stock_price_alphavantage(ticker):
             time.sleep(1)
             return None
     except Exception as e:
+        if is_provider_failure(e):
+            breaker.record_failure()
         print(f"  - 错误: 请求 '{av_ticker}' 时发生网络错误: {e}")
         return None
 
 
-def get_stock_price_yfinance(ticker):
+# 会产生实时报价的市场状态 (盘前 / 盘中 / 盘后)
+ACTIVE_MARKET_STATES = ('PRE', 'REGULAR', 'POST')
+
+
+def select_market_price(info):
     """
-    获取股票价格的改进版本，智能判断市场状态。
-    支持盘前、盘中、盘后价格，所有时间基于美东时区。
+    根据 yfinance info 中的市场状态选择合适的价格和对应的美东交易日。
+    返回 (价格, 交易日, 价格类型, 市场状态)；info 中没有任何可用价格时价格为 None。
     """
-    yf_ticker = ticker.replace('.', '-')
+    market_state = info.get('marketState', 'CLOSED')  # 可能值: PRE, REGULAR, POST, CLOSED
     price_type = "未知"
     price = None
     trading_day = None
 
-    # ===== 第一步：尝试从 info 获取实时价格 =====
-    try:
-        print(f"  - [yfinance-info] 正在获取 {yf_ticker} 的实时报价...")
-        stock = yf.Ticker(yf_ticker)
-        info = stock.info
-
-        # 获取市场状态
-        market_state = info.get('marketState', 'CLOSED')  # 可能值: PRE, REGULAR, POST, CLOSED
-        print(f"    -> 市场状态: {market_state}")
-
-        # 根据市场状态智能选择价格
-        if market_state == 'PRE':
-            # 盘前时段：优先使用盘前价格
-            price = info.get('preMarketPrice')
-            price_type = "盘前价"
-            # 使用盘前时间对应的交易日
-            pre_market_time = info.get('preMarketTime')
-            if pre_market_time:
-                trading_day = datetime.fromtimestamp(pre_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
-
-        elif market_state == 'REGULAR':
-            # 盘中时段：使用常规市价
-            price = info.get('regularMarketPrice') or info.get('currentPrice')
-            price_type = "盘中价"
-            regular_market_time = info.get('regularMarketTime')
-            if regular_market_time:
-                trading_day = datetime.fromtimestamp(regular_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
-
-        elif market_state == 'POST':
-            # 盘后时段：优先使用盘后价格
-            price = info.get('regularMarketPrice') or info.get('currentPrice')  # 改为读取 regularMarketPrice
-            price_type = "收盘价"  # 修改标签为"收盘价"
-            regular_market_time = info.get('regularMarketTime')  # 使用 regularMarketTime 而不是 postMarketTime
-            if regular_market_time:
-                trading_day = datetime.fromtimestamp(regular_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
-
-        # 兜底逻辑：如果上述都没获取到价格
-        if price is None:
-            price = (info.get('regularMarketPrice') or
-                     info.get('previousClose') or
-                     info.get('currentPrice'))
-            price_type = "最近价格"
-            # 使用 regularMarketTime 或当前美东日期
-            regular_market_time = info.get('regularMarketTime')
-            if regular_market_time:
-                trading_day = datetime.fromtimestamp(regular_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
-            else:
-                trading_day = get_et_date_string()
-
-        if price is not None and trading_day is None:
-            # 最后的保险：如果有价格但没日期
+    # 根据市场状态智能选择价格
+    if market_state == 'PRE':
+        # 盘前时段：优先使用盘前价格
+        price = info.get('preMarketPrice')
+        price_type = "盘前价"
+        # 使用盘前时间对应的交易日
+        pre_market_time = info.get('preMarketTime')
+        if pre_market_time:
+            trading_day = datetime.fromtimestamp(pre_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
+
+    elif market_state == 'REGULAR':
+        # 盘中时段：使用常规市价
+        price = info.get('regularMarketPrice') or info.get('currentPrice')
+        price_type = "盘中价"
+        regular_market_time = info.get('regularMarketTime')
+        if regular_market_time:
+            trading_day = datetime.fromtimestamp(regular_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
+
+    elif market_state == 'POST':
+        # 盘后时段：优先使用盘后价格
+        price = info.get('regularMarketPrice') or info.get('currentPrice')  # 改为读取 regularMarketPrice
+        price_type = "收盘价"  # 修改标签为"收盘价"
+        regular_market_time = info.get('regularMarketTime')  # 使用 regularMarketTime 而不是 postMarketTime
+        if regular_market_time:
+            trading_day = datetime.fromtimestamp(regular_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
+
+    # 兜底逻辑：如果上述都没获取到价格
+    if price is None:
+        price = (info.get('regularMarketPrice') or
+                 info.get('previousClose') or
+                 info.get('currentPrice'))
+        price_type = "最近价格"
+        # 使用 regularMarketTime 或当前美东日期
+        regular_market_time = info.get('regularMarketTime')
+        if regular_market_time:
+            trading_day = datetime.fromtimestamp(regular_market_time, ET_TIMEZONE).strftime('%Y-%m-%d')
+        else:
             trading_day = get_et_date_string()
 
-        if price is not None:
-            print(f"  - [yfinance-info] 成功获取 {yf_ticker} ({price_type}, 市场状态: {market_state})")
-            return price, trading_day
+    if price is not None and trading_day is None:
+        # 最后的保险：如果有价格但没日期
+        trading_day = get_et_date_string()
 
-    except Exception as e:
-        print(f"  - [yfinance-info] 获取实时报价失败: {e}。将尝试备用方案。")
+    return price, trading_day, price_type, market_state
+
+
+def get_stock_price_yfinance(ticker):
+    """
+    获取股票价格的改进版本，智能判断市场状态。
+    支持盘前、盘中、盘后价格，所有时间基于美东时区。
+    """
+    yf_ticker = REGISTRY[ticker].yfinance
+
+    # ===== 第一步：尝试从 info 获取实时价格 =====
+    info_breaker = get_breaker('yfinance-info')
+    if info_breaker.allow():
+        try:
+            print(f"  - [yfinance-info] 正在获取 {yf_ticker} 的实时报价...")
+            stock = yf.Ticker(yf_ticker)
+            info = stock.info
+            price, trading_day, price_type, market_state = select_market_price(info)
+            info_breaker.record_success()
+            # 顺带缓存板块、行业等慢变字段，有效期内不会重复写入
+            TICKER_METADATA.update_from_info(ticker, info)
+            print(f"    -> 市场状态: {market_state}")
+
+            if price is not None:
+                print(f"  - [yfinance-info] 成功获取 {yf_ticker} ({price_type}, 市场状态: {market_state})")
+                return price, trading_day
+
+        except Exception as e:
+            # 404、无效代码等标的本身的问题不计入熔断，由负缓存按标的退避
+            if is_provider_failure(e):
+                info_breaker.record_failure()
+            print(f"  - [yfinance-info] 获取实时报价失败: {e}。将尝试备用方案。")
+    else:
+        print(f"  - [yfinance-info] 数据源已熔断，直接使用备用方案。")
 
     # ===== 第二步：备用方案 - 使用 history 获取最近收盘价 =====
+    history_breaker = get_breaker('yfinance-history')
+    if not history_breaker.allow():
+        print(f"  - [yfinance-history] 数据源已熔断，跳过 {yf_ticker}")
+        return None
+
     print(f"  - [yfinance-history] 正在获取 {yf_ticker} 的最近收盘价...")
     try:
         stock = yf.Ticker(yf_ticker)
         hist = stock.history(period='5d', auto_adjust=True)
+        history_breaker.record_success()
 
         if hist.empty:
-            raise ConnectionError(f"备用方案也返回了空数据 (可能是无效代码: {yf_ticker})")
+            # 数据源正常但没有数据，属于标的本身的问题，不计入熔断
+            print(f"  - [yfinance-history] 失败: 备用方案也返回了空数据 (可能是无效代码: {yf_ticker})")
+            return None
 
         last_trade = hist.iloc[-1]
         price = float(last_trade['Close'])
@@ -249,42 +369,88 @@ def get_stock_price_yfinance(ticker):
         return price, trading_day
 
     except Exception as e_fallback:
+        if is_provider_failure(e_fallback):
+            history_breaker.record_failure()
         print(f"  - [yfinance-history] 失败: {e_fallback}")
         return None
 
 
+# 本次运行从期权链中提取的定价数据 {(标的, 到期日, 行权价, 类型): extract_chain_data 的结果}
+OPTION_CHAIN_DATA = {}
+# 本次运行中使用 Black-Scholes 理论价格代替市场报价的期权
+MODEL_PRICED_OPTIONS = set()
+# 本次运行中 lastPrice 已过期的期权 {(标的, 到期日, 行权价, 类型)}；能用模型定价时优先使用理论价格
+STALE_OPTION_QUOTES = set()
+# 本次运行中无法用模型定价、沿用过期 lastPrice 的期权
+STALE_PRICED_OPTIONS = set()
+# 本次运行中已到期的期权 {期权key: 结算记录 (尚未结算时为 None)}
+EXPIRED_OPTIONS = {}
+
+
 def get_option_price_yfinance(ticker, expiry, strike_price, option_type):
     """
     使用 yfinance 获取期权价格
     所有时间基于美东时区
+    合约存在但 lastPrice 缺失时返回 (NaN, 交易日)；lastPrice 过期时仍返回该价格，并记入 STALE_OPTION_QUOTES。
+    两种情况都由 Black-Scholes 备用定价优先补齐 (无法定价时沿用过期的 lastPrice)，不再重试。
     """
     option_name = f"{ticker} {expiry} {strike_price} {option_type}"
+    breaker = get_breaker('yfinance-option')
+    if not breaker.allow():
+        print(f"  - [yfinance-option] 数据源已熔断，跳过期权 {option_name}")
+        return None
 
     try:
         print(f"  - [yfinance-option] 正在获取期权 {option_name}...")
         stock = yf.Ticker(ticker)
         chain = stock.option_chain(expiry)
+        breaker.record_success()
         df = chain.calls if option_type == 'CALL' else chain.puts
 
-        if df.empty:
+        if df is None or df.empty:
             raise ValueError(f"未找到 {expiry} 的 {option_type} 期权链")
 
+        # 记录隐含波动率等定价数据，供 Black-Scholes 备用定价使用
+        chain_data = extract_chain_data(df, strike_price, chain.underlying)
+        OPTION_CHAIN_DATA[(ticker, expiry, strike_price, option_type)] = chain_data
+
         contract = df[df['strike'] == strike_price]
         if contract.empty:
             raise ValueError(f"未找到行权价为 {strike_price} 的合约")
 
-        price = float(contract.iloc[0]['lastPrice'])
         # 期权价格使用当前美东日期
         trading_day = get_et_date_string()
+        price = float(pd.to_numeric(contract.iloc[0]['lastPrice'], errors='coerce'))
+        if chain_data['stale']:
+            if not np.isfinite(price) or price <= 0:
+                print(f"  - [yfinance-option] 期权 {option_name} 的 lastPrice 缺失，将使用理论价格")
+                return float('nan'), trading_day
+            STALE_OPTION_QUOTES.add((ticker, expiry, strike_price, option_type))
+            print(f"  - [yfinance-option] 期权 {option_name} 的 lastPrice ${price:.2f} 已过期，优先使用理论价格")
+            return price, trading_day
 
         print(f"  - [yfinance-option] 成功获取期权 {option_name}")
         return price, trading_day
 
+    except ValueError as e:
+        # 到期日或行权价不存在（如期权已过期），属于合约本身的问题，不计入熔断
+        print(f"  - [yfinance-option] 失败: {e}")
+        return None
     except Exception as e:
+        if is_provider_failure(e):
+            breaker.record_failure()
         print(f"  - [yfinance-option] 失败: {e}")
         return None
 
 
+# 各价格获取函数依赖的数据源（熔断器名称）
+FETCH_PROVIDERS = {
+    get_stock_price_alphavantage: ('alphavantage',),
+    get_stock_price_yfinance: ('yfinance-info', 'yfinance-history'),
+    get_option_price_yfinance: ('yfinance-option',),
+}
+
+
 # ==============================================================================
 # 3. 获取历史价格函数 (基于美东时区)
 # ==============================================================================
@@ -295,36 +461,18 @@ def get_historical_stock_price(ticker, target_date):
     智能处理股票和期权两种代码。
     所有日期基于美东时区。
     """
-    api_ticker = ticker.replace('.', '-')
-
-    # --- 智能识别并转换期权代码 ---
-    if '_' in ticker:
-        print(f"    -> 检测到期权代码 '{ticker}'，正在转换为yfinance格式...")
-        try:
-            parts = ticker.split('_')
-            underlying = parts[0]
-            date_parts = parts[1].split('-')
-            strike = parts[2]
-            option_type = parts[3][0].upper()  # 'PUT' -> 'P', 'CALL' -> 'C'
-
-            # 格式化日期: 2026-01-16 -> 260116
-            yy = date_parts[0][2:]
-            mm = date_parts[1]
-            dd = date_parts[2]
-
-            # 格式化执行价: 130 -> 00130000 (8位，补零，包含3位小数)
-            strike_price_formatted = f"{float(strike):.3f}".replace('.', '')
-            strike_price_padded = strike_price_formatted.zfill(8)
-
-            # 拼接成yfinance官方格式
-            api_ticker = f"{underlying}{yy}{mm}{dd}{option_type}{strike_price_padded}"
-            print(f"    -> 转换成功: '{api_ticker}'")
-
-        except Exception as e:
-            print(f"    -> 错误: 转换期权代码 '{ticker}' 失败: {e}")
-            return None
+    instrument = REGISTRY.get(ticker)
+    if instrument is None:
+        print(f"    -> 错误: 无法解析期权代码 '{ticker}'")
+        return None
+    api_ticker = instrument.yfinance
 
     # --- 获取历史数据 ---
+    breaker = get_breaker('yfinance-history')
+    if not breaker.allow():
+        print(f"    -> [yfinance-history] 数据源已熔断，跳过 {api_ticker}")
+        return None
+
     try:
         stock = yf.Ticker(api_ticker)
 
@@ -333,6 +481,7 @@ def get_historical_stock_price(ticker, target_date):
 
         # 获取从目标日期开始的历史数据
         hist = stock.history(start=target_date, end=end_date, auto_adjust=False)
+        breaker.record_success()
 
         if not hist.empty:
             # 优先使用 'Close'，如果不存在，则使用 'close'
@@ -347,7 +496,7 @@ def get_historical_stock_price(ticker, target_date):
             print(f"    -> 警告: yfinance未能返回 {api_ticker} 在 {target_date} 的任何数据。")
 
             # 尝试获取期权的info，对于某些情况可能有效
-            if '_' in ticker:
+            if instrument.is_option:
                 info = stock.info
                 if 'lastPrice' in info and info['lastPrice'] is not None:
                     print("    -> 备用方案: 从info中成功获取 'lastPrice'。")
@@ -356,100 +505,356 @@ def get_historical_stock_price(ticker, target_date):
             return None
 
     except Exception as e:
+        # 只有网络错误、限流和服务器错误计入熔断；已退市等标的本身的问题由 fetch_historical_price 记入负缓存
+        if is_provider_failure(e):
+            breaker.record_failure()
         print(f"    -> 错误: 获取历史价格失败: {e}")
         print(f"    -> {api_ticker} 可能已退市或数据不可用")
         return None
 
 
+def fetch_historical_price(ticker, target_date):
+    """
+    带负缓存的历史价格获取: 已知无法获取的 (资产, 日期) 在退避期内直接跳过，不发起请求
+    """
+    if is_expired_key(ticker):
+        # 已到期合约不再请求: 结算日使用结算价，其他日期无法获取
+        price = settled_price(ticker, target_date)
+        print(f"    -> 跳过: 期权 {ticker} 已到期" + (f"，使用结算价 ${price:.2f}" if price is not None else ""))
+        return price
+
+    key = history_key(ticker, target_date)
+    if NEGATIVE_CACHE.is_blocked(key):
+        print(f"    -> 跳过: {ticker} 在 {target_date} 的历史价格此前获取失败 "
+              f"{NEGATIVE_CACHE.failures(key)} 次，尚未到重试时间")
+        return None
+
+    historical_price = get_historical_stock_price(ticker, target_date)
+    time.sleep(1)
+
+    if historical_price is not None:
+        NEGATIVE_CACHE.record_success(key)
+    elif not get_breaker('yfinance-history').is_open:
+        # 数据源熔断导致的失败不记为该组合本身的失败
+        NEGATIVE_CACHE.record_failure(key)
+    return historical_price
+
+
 # ==============================================================================
 # 4. 计算总价值并收集价格 (基于美东时区)
 # ==============================================================================
 
-def calculate_portfolio_value():
+def fetch_with_retries(label, fetch_func, *args):
+    """
+    调用价格获取函数，失败时最多重试 MAX_RETRIES 次；全部失败返回 None。
+    这里获取的都是配置中仍持有的标的，即使处于负缓存的退避期也总会请求一次 (跳过会把真实持仓记为0)；
+    负缓存只用于减少重试: 此前失败过的标的只尝试一次。
+    所用数据源全部熔断时立即停止重试，且不把这次失败记到标的上。
+    """
+    providers = FETCH_PROVIDERS.get(fetch_func, ())
+    attempts = 1 if NEGATIVE_CACHE.failures(label) else MAX_RETRIES
+    for attempt in range(attempts):
+        result = fetch_func(*args)
+        if result:
+            NEGATIVE_CACHE.record_success(label)
+            return result
+
+        if providers and all(get_breaker(name).is_open for name in providers):
+            print(f"  - 获取 {label} 失败: 数据源已熔断，停止重试。")
+            return None
+
+        if attempt < attempts - 1:
+            print(f"  - 获取 {label} 失败。将在 {RETRY_DELAY} 秒后重试...")
+            time.sleep(RETRY_DELAY)
+
+    failures = NEGATIVE_CACHE.record_failure(label)
+    print(f"  - {label} 已累计失败 {failures} 次，将按退避时间延后重试。")
+    return None
+
+
+def refresh_underlying_metadata(options):
+    """
+    只出现在期权组合中的底层标的不会经过股票报价流程，其板块、国家等元数据不会被顺带缓存。
+    对元数据缺失或过期的底层标的用一个 yf.Tickers 批量对象获取 info 并写入元数据缓存。
+    """
+    underlyings = TICKER_METADATA.stale(REGISTRY[opt['key']].underlying for opt in options)
+    if not underlyings:
+        return
+
+    print(f"\n正在使用 [yfinance-info] 获取 {len(underlyings)} 个期权底层标的的元数据...")
+    breaker = get_breaker('yfinance-info')
+    batch = yf.Tickers(' '.join(REGISTRY[symbol].yfinance for symbol in underlyings))
+    for symbol in underlyings:
+        if not breaker.allow():
+            print(f"  - [yfinance-info] 数据源已熔断，跳过剩余的底层标的元数据")
+            break
+        try:
+            info = batch.tickers[REGISTRY[symbol].yfinance.upper()].info
+            breaker.record_success()
+        except Exception as e:
+            if is_provider_failure(e):
+                breaker.record_failure()
+            print(f"  - [yfinance-info] 获取 {symbol} 的元数据失败: {e}")
+            continue
+        TICKER_METADATA.update_from_info(symbol, info)
+
+
+def collect_symbols(portfolios):
+    """
+    汇总所有投资组合的股票代码和期权合约（去重，保持配置中的顺序）
+    """
+    tickers, options = [], {}
+    for spec in portfolios.values():
+        for ticker, _ in spec['portfolio']:
+            if ticker not in tickers:
+                tickers.append(ticker)
+        for opt in spec['options_portfolio']:
+            options.setdefault(opt['key'], opt)
+    # 预先解析所有代码，之后各数据源代码、资产类型和合约乘数都是字典查找
+    REGISTRY.register(tickers)
+    return tickers, list(options.values())
+
+
+def fetch_quotes(tickers, options):
     """
-    计算总价值，并同时收集每个资产的 (总价值, 单价) 元组。
+    对去重后的股票代码和期权合约各获取一次价格。
+    返回 (报价字典 {代码: (单价, 交易日) 或 None}, 投资组合日期)。
     所有日期基于美东时区。
     """
-    total_value = 0.0
-    asset_details = {}  # 将存储 (总价值, 单价) 的元组
+    quotes = {}
     portfolio_date = None
     source_name = "yfinance" if DATA_SOURCE == 0 else "Alpha Vantage"
 
     print(f"\n{'=' * 70}")
-    print(f"开始计算投资组合价值")
+    print(f"开始获取资产价格")
     print(f"当前美东时间: {get_et_datetime_string()}")
     print(f"{'=' * 70}\n")
-    print(f"正在使用 [{source_name}] 获取您的股票价值...\n")
+    print(f"正在使用 [{source_name}] 获取 {len(tickers)} 个股票的价格...\n")
 
     # ===== 处理股票 =====
-    for ticker, quantity in portfolio:
-        price, fetched_date = 0.0, None
-        result = None
+    get_price_func = get_stock_price_yfinance if DATA_SOURCE == 0 else get_stock_price_alphavantage
+    for ticker in tickers:
+        quotes[ticker] = fetch_with_retries(ticker, get_price_func, ticker)
+        if quotes[ticker] and portfolio_date is None:
+            portfolio_date = quotes[ticker][1]
 
-        for attempt in range(MAX_RETRIES):
-            get_price_func = get_stock_price_yfinance if DATA_SOURCE == 0 else get_stock_price_alphavantage
-            result = get_price_func(ticker)
+    # ===== 处理期权 (已到期合约不再请求报价) =====
+    live_options, expired_options = partition_options(options, get_et_now())
+    if DATA_SOURCE == 0 and live_options:
+        print(f"\n正在使用 [yfinance] 获取 {len(live_options)} 个期权的价格...\n")
 
-            if result:
-                price, fetched_date = result
-                if portfolio_date is None:
-                    portfolio_date = fetched_date
-                break
+        for opt in live_options:
+            quotes[opt['key']] = fetch_with_retries(
+                opt['key'], get_option_price_yfinance, opt['ticker'], opt['expiry'], opt['strike'], opt['type'])
+            if quotes[opt['key']] and portfolio_date is None:
+                portfolio_date = quotes[opt['key']][1]
+
+        apply_model_prices(live_options, quotes, portfolio_date or get_et_date_string())
+        refresh_underlying_metadata(live_options)
 
-            if attempt < MAX_RETRIES - 1:
-                print(f"  - 获取 {ticker} 失败。将在 {RETRY_DELAY} 秒后重试...")
-                time.sleep(RETRY_DELAY)
+    NEGATIVE_CACHE.save()
+    TICKER_METADATA.save()
+
+    # 如果没有获取到任何日期，使用当前美东日期
+    if portfolio_date is None:
+        portfolio_date = get_et_date_string()
+        print(f"\n提示: 未能从API获取交易日期，使用当前美东日期: {portfolio_date}")
+
+    if DATA_SOURCE == 0 and expired_options:
+        apply_settlements(expired_options, quotes, portfolio_date)
+
+    return quotes, portfolio_date
+
+
+def apply_settlements(expired_options, quotes, portfolio_date):
+    """
+    已到期期权按内在价值结算: 结算日就是本次数据日期时以结算价计入本次数据行，
+    否则不再计入 (结算价会被写入历史文件中结算日那一行)
+    """
+    print(f"\n{len(expired_options)} 个期权已到期，不再获取报价:\n")
+    settlements = settle_expired_options(expired_options)
+    for opt in expired_options:
+        entry = settlements.get(opt['key'])
+        EXPIRED_OPTIONS[opt['key']] = entry
+        if entry is not None and entry['settlement_date'] == portfolio_date:
+            quotes[opt['key']] = (entry['settlement_price'], portfolio_date)
+    print(f"\n提示: 已到期的期权可以从 config.ini 的 [OptionsPortfolio] 中删除: {', '.join(EXPIRED_OPTIONS)}")
+
+
+def record_option_settlements(history_file, options_portfolio, data_date):
+    """
+    把已到期期权的结算价写入历史文件 (每个合约在每个历史文件中只写一次)
+    """
+    quantities = {}
+    for opt in options_portfolio:
+        if opt['key'] in EXPIRED_OPTIONS:
+            quantities[opt['key']] = quantities.get(opt['key'], 0.0) + opt['quantity']
+    if quantities:
+        record_settlements_in_history(history_file, quantities, data_date)
+
+
+def update_chain_cache(options):
+    """
+    把本次获取到的期权链数据合并进本地缓存，返回 {期权key: 定价数据}。
+    期权链获取失败的合约沿用上次缓存的隐含波动率和标的价格。
+    """
+    chain_cache = load_chain_cache()
+    today = get_et_date_string()
+    for opt in options:
+        fresh = OPTION_CHAIN_DATA.get((opt['ticker'], opt['expiry'], opt['strike'], opt['type']))
+        if not fresh:
+            continue
+        entry = chain_cache.get(opt['key'], {})
+        for field in ('implied_volatility', 'underlying_price'):
+            if fresh[field] is not None:
+                entry[field] = fresh[field]
+        entry['updated'] = today
+        chain_cache[opt['key']] = entry
+
+    # 只保留仍在持仓中的合约
+    keys = {opt['key'] for opt in options}
+    chain_cache = {key: entry for key, entry in chain_cache.items() if key in keys}
+    save_chain_cache(chain_cache)
+    return chain_cache
+
+
+def spot_prices_from_quotes(quotes):
+    return {symbol: result[0] for symbol, result in quotes.items()
+            if not REGISTRY[symbol].is_option and result and np.isfinite(result[0])}
+
+
+def apply_model_prices(options, quotes, portfolio_date):
+    """
+    对报价缺失或过期的期权，用 Black-Scholes 一次性向量化计算理论价格并写回 quotes。
+    无法定价 (缺少标的价格或隐含波动率) 时，过期报价沿用其 lastPrice，而不是记为缺失 (否则会以0写入历史)。
+    """
+    chain_cache = update_chain_cache(options)
+    missing = [opt for opt in options
+               if quotes.get(opt['key']) is None or not np.isfinite(quotes[opt['key']][0])
+               or (opt['ticker'], opt['expiry'], opt['strike'], opt['type']) in STALE_OPTION_QUOTES]
+    if not missing:
+        return chain_cache
+
+    print(f"\n正在使用 Black-Scholes 模型为 {len(missing)} 个缺少有效报价的期权定价...\n")
+    book = price_options_book(missing, spot_prices_from_quotes(quotes), chain_cache, get_et_now())
+    for key, row in book.iterrows():
+        if np.isfinite(row['model_price']):
+            quotes[key] = (float(row['model_price']), portfolio_date)
+            MODEL_PRICED_OPTIONS.add(key)
+            print(f"  - [black-scholes] {key}: 标的 ${row['spot']:.2f}, 隐含波动率 {row['implied_volatility']:.1%}, "
+                  f"理论价格 ${row['model_price']:.2f}")
+        elif quotes.get(key) is not None and np.isfinite(quotes[key][0]):
+            STALE_PRICED_OPTIONS.add(key)
+            print(f"  - [black-scholes] {key}: 缺少标的价格或隐含波动率，沿用过期的 lastPrice ${quotes[key][0]:.2f}")
+        else:
+            quotes[key] = None
+            print(f"  - [black-scholes] {key}: 缺少标的价格或隐含波动率，无法定价")
+    return chain_cache
+
+
+def option_price_source(key):
+    if key in MODEL_PRICED_OPTIONS:
+        return 'model'
+    return 'stale' if key in STALE_PRICED_OPTIONS else 'market'
+
+
+def calculate_options_greeks(portfolios, quotes, data_date):
+    """
+    计算所有期权合约的希腊值及各投资组合的汇总敞口，并保存到 JSON
+    """
+    _, options = collect_symbols(portfolios)
+    # 已到期合约不再计算希腊值
+    options = [opt for opt in options if opt['key'] not in EXPIRED_OPTIONS]
+    if DATA_SOURCE != 0:
+        # Alpha Vantage 模式下不获取期权价格
+        options = []
+
+    book = price_options_book(options, spot_prices_from_quotes(quotes), load_chain_cache(), get_et_now())
+    book['market_price'] = [quotes[key][0] if quotes.get(key) else np.nan for key in book.index]
+    price_sources = {key: option_price_source(key) if quotes.get(key) else None for key in book.index}
+    portfolio_quantities = {name: {opt['key']: opt['quantity'] for opt in spec['options_portfolio']
+                                   if opt['key'] not in EXPIRED_OPTIONS}
+                            for name, spec in portfolios.items()}
+    report = build_greeks_report(book, portfolio_quantities, price_sources, data_date)
+    save_greeks_report(report)
+    return report
+
+
+def value_portfolio(name, spec, quotes):
+    """
+    使用共享的报价计算单个投资组合的总价值，并收集每个资产的 (总价值, 单价) 元组。
+    输出先收集再一次性打印，避免并行计算时日志交错。
+    """
+    total_value = 0.0
+    asset_details = {}  # 将存储 (总价值, 单价) 的元组
+    lines = [f"\n[{name}] 投资组合估值:"]
+
+    # ===== 处理股票 =====
+    for ticker, quantity in spec['portfolio']:
+        result = quotes.get(ticker)
+        price = result[0] if result else 0.0
 
         stock_value = price * quantity
         asset_details[ticker] = (stock_value, price)
         total_value += stock_value
 
         if result:
-            print(f"  -> ✓ 成功: {ticker} {quantity:g} 股 @ ${price:.2f} = ${stock_value:,.2f}")
+            lines.append(f"  -> ✓ 成功: {ticker} {quantity:g} 股 @ ${price:.2f} = ${stock_value:,.2f}")
         else:
-            print(f"  -> ✗ 错误: 经过 {MAX_RETRIES} 次尝试后，仍无法获取 {ticker} 的价格。价值记为0。")
+            lines.append(f"  -> ✗ 错误: 经过 {MAX_RETRIES} 次尝试后，仍无法获取 {ticker} 的价格。价值记为0。")
 
     # ===== 处理期权 =====
-    if DATA_SOURCE == 0 and options_portfolio:
-        print("\n正在使用 [yfinance] 获取您的期权价值...\n")
-
-        for opt in options_portfolio:
-            price, fetched_date = 0.0, None
-            result = None
-
-            for attempt in range(MAX_RETRIES):
-                result = get_option_price_yfinance(opt['ticker'], opt['expiry'], opt['strike'], opt['type'])
-
-                if result:
-                    price, fetched_date = result
-                    if portfolio_date is None:
-                        portfolio_date = fetched_date
-                    break
-
-                if attempt < MAX_RETRIES - 1:
-                    print(f"  - 获取 {opt['key']} 失败。将在 {RETRY_DELAY} 秒后重试...")
-                    time.sleep(RETRY_DELAY)
+    if DATA_SOURCE == 0:
+        for opt in spec['options_portfolio']:
+            result = quotes.get(opt['key'])
+            if opt['key'] in EXPIRED_OPTIONS and not result:
+                # 已到期且结算日早于本次数据日期: 合约已不存在，不再计入
+                lines.append(f"  -> 已到期: {opt['key']} 已结算，不再计入")
+                continue
+            price = result[0] if result else 0.0
 
-            option_value = price * opt['quantity'] * 100
+            option_value = price * opt['quantity'] * REGISTRY[opt['key']].multiplier
             asset_details[opt['key']] = (option_value, price)
             total_value += option_value
 
             if result:
-                print(f"  -> ✓ 成功: {opt['key']} {opt['quantity']:g} 张 @ ${price:.2f} = ${option_value:,.2f}")
+                lines.append(f"  -> ✓ 成功: {opt['key']} {opt['quantity']:g} 张 @ ${price:.2f} = ${option_value:,.2f}")
             else:
-                print(f"  -> ✗ 错误: 经过 {MAX_RETRIES} 次尝试后，仍无法获取 {opt['key']} 的价格。价值记为0。")
+                lines.append(f"  -> ✗ 错误: 经过 {MAX_RETRIES} 次尝试后，仍无法获取 {opt['key']} 的价格。价值记为0。")
 
     # ===== 处理现金 =====
-    asset_details['CASH'] = (CASH_AMOUNT, 1.0)
-    total_value += CASH_AMOUNT
+    asset_details['CASH'] = (spec['cash'], 1.0)
+    total_value += spec['cash']
 
-    if CASH_AMOUNT > 0:
-        print(f"\n计入现金余额: ${CASH_AMOUNT:,.2f}")
+    if spec['cash'] > 0:
+        lines.append(f"  计入现金余额: ${spec['cash']:,.2f}")
 
-    # 如果没有获取到任何日期，使用当前美东日期
-    if portfolio_date is None:
-        portfolio_date = get_et_date_string()
-        print(f"\n提示: 未能从API获取交易日期，使用当前美东日期: {portfolio_date}")
+    print("\n".join(lines))
+    return total_value, asset_details
+
+
+def aggregate_household(results):
+    """
+    将所有投资组合的估值合并为家庭总览: 同一资产的价值相加，单价取共享报价
+    """
+    total_value = 0.0
+    asset_details = {}
+    for portfolio_total, details in results.values():
+        total_value += portfolio_total
+        for asset, (val, price) in details.items():
+            prev_val, _ = asset_details.get(asset, (0.0, price))
+            asset_details[asset] = (prev_val + val, price)
+    return total_value, asset_details
+
+
+def calculate_portfolio_value():
+    """
+    计算默认投资组合的总价值，并同时收集每个资产的 (总价值, 单价) 元组。
+    所有日期基于美东时区。
+    """
+    spec = {'portfolio': portfolio, 'options_portfolio': options_portfolio, 'cash': CASH_AMOUNT}
+    quotes, portfolio_date = fetch_quotes(*collect_symbols({DEFAULT_PORTFOLIO_NAME: spec}))
+    total_value, asset_details = value_portfolio(DEFAULT_PORTFOLIO_NAME, spec, quotes)
 
     print("\n" + "=" * 70)
     print(f"投资组合总价值 (截至 {portfolio_date}): ${total_value:,.2f}")
@@ -458,16 +863,31 @@ def calculate_portfolio_value():
     return total_value, asset_details, portfolio_date
 
 
+def process_portfolio(name, spec, quotes, data_date):
+    """
+    单个投资组合的完整流程: 估值、保存历史、校验修复历史、归档已结束的年份。
+    各投资组合写入各自的历史文件，可以并行执行。
+    """
+    total_value, asset_details = value_portfolio(name, spec, quotes)
+    save_history(data_date, total_value, asset_details, spec['history_file'])
+    record_option_settlements(spec['history_file'], spec['options_portfolio'], data_date)
+    validate_and_repair_history(spec['history_file'])
+    archive_closed_years(spec['history_file'])
+    return total_value, asset_details
+
+
 # ==============================================================================
 # 5. 保存历史数据 (基于美东时区)
 # ==============================================================================
 
-def save_history(date_to_save, value_to_save, asset_details):
+def save_history(date_to_save, value_to_save, asset_details, history_file=None):
     """
     将当日的投资组合详情追加或更新到历史记录CSV文件中。
     每个资产单元格存储格式: '(总价值|单价)'
     所有日期基于美东时区。
     """
+    history_file = history_file or HISTORY_FILE
+
     # 1. 准备当日的新数据行
     new_row_data = {'total_value': f"{value_to_save:.2f}"}
     for asset, (val, price) in asset_details.items():
@@ -475,43 +895,46 @@ def save_history(date_to_save, value_to_save, asset_details):
 
     new_row = pd.Series(new_row_data, name=date_to_save)
 
-    # 2. 读取现有数据
-    if os.path.exists(HISTORY_FILE) and os.path.getsize(HISTORY_FILE) > 0:
-        try:
-            df = pd.read_csv(HISTORY_FILE, index_col='date', dtype=str)
-        except (pd.errors.EmptyDataError, IndexError):
-            df = pd.DataFrame()
-    else:
-        df = pd.DataFrame()
+    # 2. 只读取表头，确定合并后的列：total_value + 按字母排序的资产列
+    existing_columns = read_header(history_file)[1:]
+    asset_columns = sorted((set(existing_columns) | set(asset_details)) - {'total_value'})
+    final_cols = ['total_value'] + asset_columns
+
+    def align(df):
+        # 用代表0的元组字符串填充新出现的NaN值，total_value列的NaN用 '0.00' 填充
+        df = df.reindex(columns=final_cols)
+        df['total_value'] = df['total_value'].fillna("0.00")
+        return df.fillna(ZERO_CELL)
+
+    new_row_df = align(new_row.to_frame().T)
+
+    def merged_chunks():
+        # 文件按日期降序存储：逐块复制旧数据，覆盖当天数据，并把新行插入到正确位置
+        replaced, inserted = False, False
+        for chunk in iter_history_chunks(history_file):
+            if date_to_save in chunk.index:
+                chunk = chunk.drop(index=date_to_save)
+                replaced = True
+            chunk = align(chunk)
+            if not inserted:
+                older = chunk.index < date_to_save
+                if older.any():
+                    pos = int(np.argmax(older))
+                    chunk = pd.concat([chunk.iloc[:pos], new_row_df, chunk.iloc[pos:]])
+                    inserted = True
+            yield chunk
+        if not inserted:
+            yield new_row_df
+        if replaced:
+            print(f"\n提示: 日期 {date_to_save} 的旧数据已找到，将进行覆盖更新。")
+        else:
+            print(f"\n成功: 已将 {date_to_save} 的新数据添加到历史记录。")
 
-    # 3. 覆盖当天数据
-    if date_to_save in df.index:
-        df = df.drop(index=date_to_save)
-        print(f"\n提示: 日期 {date_to_save} 的旧数据已找到，将进行覆盖更新。")
+    # 3. 分块写入临时文件，内容有变化时才原子替换
+    if write_history_chunks(history_file, merged_chunks()):
+        print(f"历史记录已成功更新到: {history_file}")
     else:
-        print(f"\n成功: 已将 {date_to_save} 的新数据添加到历史记录。")
-
-    # 4. 添加新行并对齐
-    df = pd.concat([df, new_row.to_frame().T])
-
-    # 5. 用代表0的元组字符串填充新出现的NaN值
-    df.fillna("(0.00|0.00)", inplace=True)
-
-    # total_value列的NaN用 '0.00' 填充
-    if 'total_value' in df.columns:
-        df['total_value'].replace("(0.00|0.00)", "0.00", inplace=True)
-
-    # 6. 重新排序列
-    if 'total_value' in df.columns:
-        cols = [c for c in df.columns if c != 'total_value']
-        cols.sort()
-        final_cols = ['total_value'] + cols
-        df = df[final_cols]
-
-    # 7. 保存（按日期降序排列）
-    df.sort_index(ascending=False, inplace=True)
-    df.to_csv(HISTORY_FILE, index=True, index_label='date')
-    print(f"历史记录已成功更新到: {HISTORY_FILE}")
+        print(f"历史记录内容未变化，无需写入: {history_file}")
 
 
 # ==============================================================================
@@ -539,22 +962,21 @@ def parse_value_from_cell(cell):
 # 7. 绘制历史价值图表
 # ==============================================================================
 
-def plot_history_graph(output_filename):
+def plot_history_graph(output_filename, history_file=None):
     """
     绘制投资组合历史价值堆叠图
     """
-    if not os.path.exists(HISTORY_FILE):
+    history_file = history_file or HISTORY_FILE
+    if not os.path.exists(history_file):
         print("找不到历史数据文件，无法绘制图表。")
         return
 
     print(f"\n正在生成历史趋势图...")
 
-    # 读取原始数据
-    df_raw = pd.read_csv(HISTORY_FILE, index_col='date', parse_dates=True)
-    df_raw.sort_index(inplace=True)
-
-    # 创建用于绘图的数值DataFrame
-    df_plot = df_raw.map(parse_value_from_cell)
+    # 分块读取并解析为数值，创建用于绘图的DataFrame（按日期升序）
+    arrays = load_history_arrays(history_file, dtype=np.float32)
+    df_plot = pd.DataFrame(arrays['values'], index=arrays['dates'], columns=arrays['assets'])
+    df_plot.insert(0, 'total_value', arrays['total_value'])
 
     if len(df_plot) < 1:
         print("历史数据不足，无法生成图表。")
@@ -606,8 +1028,10 @@ def plot_history_graph(output_filename):
     plt.tight_layout()
 
     try:
-        plt.savefig(output_filename, dpi=300, bbox_inches='tight')
-        print(f"✓ 成功: 历史趋势图已保存到 '{output_filename}'")
+        if write_figure(output_filename, fig, dpi=300, bbox_inches='tight'):
+            print(f"✓ 成功: 历史趋势图已保存到 '{output_filename}'")
+        else:
+            print(f"✓ 历史趋势图内容未变化，无需写入: '{output_filename}'")
     except Exception as e:
         print(f"✗ 错误: 保存历史趋势图时出错: {e}")
     finally:
@@ -664,8 +1088,10 @@ def plot_pie_chart(asset_details, output_filename):
                 path_effects=text_effect, fontweight='bold')
 
     try:
-        plt.savefig(output_filename, dpi=300, bbox_inches='tight')
-        print(f"✓ 成功: 当日仓位饼图已保存到 '{output_filename}'")
+        if write_figure(output_filename, fig, dpi=300, bbox_inches='tight'):
+            print(f"✓ 成功: 当日仓位饼图已保存到 '{output_filename}'")
+        else:
+            print(f"✓ 当日仓位饼图内容未变化，无需写入: '{output_filename}'")
     except Exception as e:
         print(f"✗ 错误: 保存仓位饼图时出错: {e}")
     finally:
@@ -676,35 +1102,26 @@ def plot_pie_chart(asset_details, output_filename):
 # 9. 历史数据校验与修复模块 (基于美东时区)
 # ==============================================================================
 
-def validate_and_repair_history():
+def repair_history_chunk(df):
     """
-    校验并修复历史数据，并清理已售罄的资产列。
-    所有日期操作基于美东时区。
+    校验并修复一块历史数据（日期为索引的字符串DataFrame）。
+    返回 (修复后的DataFrame, 是否有改动)。
     """
-    if not os.path.exists(HISTORY_FILE):
-        return
-
-    print("\n" + "=" * 70)
-    print("开始执行历史数据完整性校验...")
-    print("=" * 70)
-
-    try:
-        df = pd.read_csv(HISTORY_FILE, index_col='date', dtype=str)
-    except Exception as e:
-        print(f"错误: 读取历史文件 '{HISTORY_FILE}' 失败: {e}")
-        return
-
     df_repaired = df.copy()
     changes_made = False
+    # 每列的资产类型只解析一次
+    instruments = {ticker: REGISTRY.get(ticker) for ticker in df.columns if ticker != 'total_value'}
+    asset_types = {ticker: instrument.asset_type for ticker, instrument in instruments.items() if instrument}
 
     # 数据修复循环
     for date, row in df.iterrows():
         for ticker, cell_value in row.items():
             if ticker == 'total_value' or pd.isna(cell_value):
                 continue
+            asset_type = asset_types.get(ticker)
 
             # -------------------- 1. 现金 (CASH) 处理逻辑 --------------------
-            if ticker == 'CASH':
+            if asset_type == 'cash':
                 try:
                     is_tuple_format = isinstance(cell_value, str) and cell_value.strip().startswith('(')
                     cash_amount = 0.0
@@ -732,7 +1149,7 @@ def validate_and_repair_history():
                 continue
 
             # -------------------- 2. 期权 (Options) 处理逻辑 --------------------
-            elif '_' in ticker:
+            elif asset_type == 'option':
                 total_val, price = 0.0, 0.0
                 try:
                     if isinstance(cell_value, str) and cell_value.strip().startswith('('):
@@ -755,8 +1172,7 @@ def validate_and_repair_history():
                 elif total_val > 0 and price <= 0:
                     print(f"  - 发现不一致期权数据: {ticker} {date} [价值: {total_val:.2f}, 价格缺失]")
                     print(f"    -> 正在尝试获取 {date} 的历史价格...")
-                    historical_price = get_historical_stock_price(ticker, date)
-                    time.sleep(1)
+                    historical_price = fetch_historical_price(ticker, date)
 
                     if historical_price is not None:
                         new_cell_value = f"({total_val:.2f}|{historical_price:.2f})"
@@ -783,8 +1199,7 @@ def validate_and_repair_history():
                 if total_val > 0 and price <= 0:
                     print(f"  - 发现不一致股票数据: {ticker} {date} [价值: {total_val:.2f}, 价格缺失]")
                     print(f"    -> 正在尝试获取 {date} 的历史价格...")
-                    historical_price = get_historical_stock_price(ticker, date)
-                    time.sleep(1)
+                    historical_price = fetch_historical_price(ticker, date)
 
                     if historical_price is not None:
                         new_cell_value = f"({total_val:.2f}|{historical_price:.2f})"
@@ -794,60 +1209,169 @@ def validate_and_repair_history():
                     else:
                         print(f"    -> ✗ 修复失败: 未能获取到股票 {ticker} 在 {date} 的历史价格")
 
-    # 清理已清仓资产列
-    columns_to_drop = []
-    asset_columns = [col for col in df_repaired.columns if col != 'total_value']
+    return df_repaired, changes_made
 
-    for col in asset_columns:
-        try:
-            total_asset_value = df_repaired[col].apply(parse_value_from_cell).sum()
-            if total_asset_value == 0:
-                columns_to_drop.append(col)
-        except Exception:
-            continue
+
+def find_sold_out_columns(partition):
+    """
+    分块统计各资产列在该分区中的价值之和，返回总和为0（已售罄）的资产列
+    """
+    column_sums = {}
+    for block in iter_partition_blocks(partition):
+        for asset, total in zip(block['assets'], block['values'].sum(axis=0)):
+            column_sums[asset] = column_sums.get(asset, 0.0) + total
+    return [col for col, total in column_sums.items() if total == 0]
+
+
+def validate_and_repair_history(history_file=None, year=None):
+    """
+    校验并修复一个历史分区，并清理在该分区中已售罄的资产列。
+    默认处理热分区 (历史文件本身)；指定 year 时处理该年份的归档分区。
+    所有日期操作基于美东时区。
+    分区文件分块流式处理，修复结果先写入临时文件，有改动时才替换原文件。
+    """
+    base_history_file = history_file = history_file or HISTORY_FILE
+    if year is not None:
+        history_file = partition_file(history_file, year)
+    if not os.path.exists(history_file):
+        if year is not None:
+            print(f"错误: 归档分区 '{history_file}' 不存在。")
+        return
+
+    print("\n" + "=" * 70)
+    print("开始执行历史数据完整性校验...")
+    print("=" * 70)
+
+    # 第一遍：找出已清仓资产列
+    try:
+        columns_to_drop = find_sold_out_columns(history_file)
+    except Exception as e:
+        print(f"错误: 读取历史文件 '{history_file}' 失败: {e}")
+        return
+
+    changes_made = bool(columns_to_drop)
+
+    # 第二遍：逐块修复数据并清理已清仓资产列
+    def repaired_chunks():
+        nonlocal changes_made
+        for df in iter_history_chunks(history_file):
+            df_repaired, chunk_changed = repair_history_chunk(df)
+            changes_made = changes_made or chunk_changed
+            yield df_repaired.drop(columns=columns_to_drop)
+
+    repaired_file = f"{history_file}.repaired"
+    try:
+        write_history_chunks(repaired_file, repaired_chunks())
+    except Exception as e:
+        print(f"✗ 错误: 校验历史文件失败: {e}")
+        if os.path.exists(repaired_file):
+            os.remove(repaired_file)
+        return
+
+    NEGATIVE_CACHE.save()
 
     if columns_to_drop:
-        df_repaired.drop(columns=columns_to_drop, inplace=True)
-        changes_made = True
         print(f"\n信息: 检测到并清除了已售罄的资产列: {', '.join(columns_to_drop)}")
 
     # 保存修复后的数据
     if changes_made:
         print("\n校验完成。发现并修复/清理了数据，正在保存更新后的历史文件...")
         try:
-            df_repaired.to_csv(HISTORY_FILE, index=True, index_label='date')
-            print(f"✓ 成功: 已将更新后的历史数据保存到 '{HISTORY_FILE}'")
+            os.replace(repaired_file, history_file)
+            # 修复归档分区后同步更新分区清单中的摘要
+            refresh_partition_digests(base_history_file, [history_file])
+            print(f"✓ 成功: 已将更新后的历史数据保存到 '{history_file}'")
         except Exception as e:
             print(f"✗ 错误: 保存更新后的历史文件失败: {e}")
     else:
+        os.remove(repaired_file)
         print("\n校验完成。未发现需要修复或清理的数据。")
 
     print("=" * 70)
 
 
+def archive_closed_years(history_file):
+    """
+    把热分区中已结束 (且已校验过) 的年份移入归档分区
+    """
+    try:
+        years = compact_history(history_file)
+    except Exception as e:
+        print(f"✗ 错误: 归档历史文件 '{history_file}' 的已结束年份失败: {e}")
+        return
+    if years:
+        print(f"✓ 已将 {', '.join(map(str, years))} 年的历史数据移入归档分区: '{history_file}'")
+
+
 # ==============================================================================
 # 10. 主执行逻辑
 # ==============================================================================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="投资组合追踪系统")
+    parser.add_argument('--force', action='store_true', help="即使休市且已有最新快照，也重新获取行情并生成图表")
+    parser.add_argument('--repair-year', type=int, default=None,
+                        help="只校验并修复各投资组合该年份的归档分区，然后退出")
+    args = parser.parse_args()
+
+    if args.repair_year is not None:
+        for spec in PORTFOLIOS.values():
+            validate_and_repair_history(spec['history_file'], year=args.repair_year)
+        sys.exit(0)
+
     print("\n" + "=" * 70)
     print("投资组合追踪系统 (Portfolio Tracker)")
     print("所有时间基于美东时区 (America/New_York)")
     print("=" * 70)
 
-    # 计算投资组合价值
-    final_total_value, all_asset_details, data_date = calculate_portfolio_value()
+    # 休市快速路径: 历史记录已覆盖最近已完成的交易日时，不获取行情也不重新绘图
+    primary_history_file = next(iter(PORTFOLIOS.values()))['history_file']
+    skip, reason = check_market_closed(primary_history_file, force=args.force)
+    if skip:
+        print(f"\n✓ 休市快速路径: {reason}，跳过本次运行 (使用 --force 强制运行)。")
+        sys.exit(0)
+    print(f"\n{reason}，开始获取行情。")
+
+    # 对所有投资组合的标的去重后统一获取一次价格
+    quotes, data_date = fetch_quotes(*collect_symbols(PORTFOLIOS))
 
     if data_date is not None:
-        # 保存历史数据
-        save_history(data_date, final_total_value, all_asset_details)
+        # 各投资组合并行估值，保存并校验各自的历史数据
+        with ThreadPoolExecutor(max_workers=len(PORTFOLIOS)) as executor:
+            futures = {name: executor.submit(process_portfolio, name, spec, quotes, data_date)
+                       for name, spec in PORTFOLIOS.items()}
+            results = {name: future.result() for name, future in futures.items()}
 
-        # 校验和修复历史数据
-        validate_and_repair_history()
+        record_snapshot(data_date)
 
-        # 生成图表
-        plot_history_graph(PLOT_FILE)
-        plot_pie_chart(all_asset_details, PIE_CHART_FILE)
+        print("\n" + "=" * 70)
+        for name, (total_value, _) in results.items():
+            print(f"[{name}] 投资组合总价值 (截至 {data_date}): ${total_value:,.2f}")
+        print("=" * 70)
+
+        # 期权组合希腊值 (报价缺失的合约已使用理论价格)
+        calculate_options_greeks(PORTFOLIOS, quotes, data_date)
+
+        # 生成图表 (matplotlib 不是线程安全的，在主线程中依次绘制)
+        if DEFAULT_PORTFOLIO_NAME in results:
+            plot_history_graph(PLOT_FILE)
+            plot_pie_chart(results[DEFAULT_PORTFOLIO_NAME][1], PIE_CHART_FILE)
+        else:
+            print(f"\n注意: 未配置默认的 [Portfolio] 组合，后续分析脚本 (收益率、基准、风险、归因等) "
+                  f"只读取 '{HISTORY_FILE}'，不会为命名组合生成结果。")
+
+        # 多个投资组合时，额外生成合并后的家庭总览
+        if len(results) > 1:
+            household_total, household_details = aggregate_household(results)
+            household_history_file = with_suffix(HISTORY_FILE, HOUSEHOLD_SUFFIX)
+            print(f"\n[{HOUSEHOLD_SUFFIX}] 家庭总览总价值 (截至 {data_date}): ${household_total:,.2f}")
+            save_history(data_date, household_total, household_details, household_history_file)
+            record_option_settlements(household_history_file,
+                                      [opt for spec in PORTFOLIOS.values() for opt in spec['options_portfolio']],
+                                      data_date)
+            archive_closed_years(household_history_file)
+            plot_history_graph(with_suffix(PLOT_FILE, HOUSEHOLD_SUFFIX), household_history_file)
+            plot_pie_chart(household_details, with_suffix(PIE_CHART_FILE, HOUSEHOLD_SUFFIX))
 
         print("\n" + "=" * 70)
         print(f"✓ 所有任务完成! (美东时间: {get_et_datetime_string()})")
@@ -0,0 +1,300 @@
+"""
+交易所日历与休市快速路径
+按规则生成纽约证券交易所 (NYSE) 每年的休市日和提前收盘日，缓存到 data/cache/market_calendar.json
+（可手工在缓存中补充临时休市日）。据此判断当前所处的交易时段：
+如果没有正在进行的交易时段，且历史文件的最新一行已经覆盖上一个已完成的交易日，
+则本次运行无需获取任何行情、也无需重新生成图表。
+
+本模块只依赖标准库，作为脚本运行时在1秒内完成判断:
+  python scripts/market_calendar.py [--force]
+在 GitHub Actions 中会把 skip=true/false 写入 $GITHUB_OUTPUT，供后续步骤判断是否执行。
+"""
+
+import argparse
+import configparser
+import csv
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+
+CALENDAR_CACHE_FILE = os.path.join(CACHE_DIR, 'market_calendar.json')
+# 记录最近一次快照对应的交易日，以及写入时该交易日是否已收盘
+SNAPSHOT_STATE_FILE = os.path.join(CACHE_DIR, 'snapshot_state.json')
+
+ET_ZONE = ZoneInfo('America/New_York')
+PRE_MARKET_OPEN = time(4, 0)
+REGULAR_OPEN = time(9, 30)
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+# 盘后交易在常规收盘后持续的时间 (正常交易日到 20:00，提前收盘日到 17:00)
+POST_MARKET_DURATION = timedelta(hours=4)
+
+# 无法按规则推算的临时休市日 (如国葬日)
+SPECIAL_CLOSURES = ['2018-12-05', '2025-01-09']
+
+
+# ==============================================================================
+# 1. 休市日规则
+# ==============================================================================
+
+def _easter(year):
+    """
+    公历复活节日期 (匿名格里高利算法)
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year, month, weekday):
+    last = (date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    """
+    周六的节日在周五休市，周日的节日在周一休市
+    """
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def build_year_calendar(year):
+    """
+    按 NYSE 规则计算某一年的休市日和提前收盘 (13:00) 日
+    """
+    holidays = []
+    new_year = date(year, 1, 1)
+    # 元旦落在周六时，NYSE 不在前一年的12月31日补休
+    if new_year.weekday() != 5:
+        holidays.append(_observed(new_year))
+    holidays += [
+        _nth_weekday(year, 1, 0, 3),            # 马丁·路德·金纪念日
+        _nth_weekday(year, 2, 0, 3),            # 总统日
+        _easter(year) - timedelta(days=2),      # 耶稣受难日
+        _last_weekday(year, 5, 0),              # 阵亡将士纪念日
+        _observed(date(year, 7, 4)),            # 独立日
+        _nth_weekday(year, 9, 0, 1),            # 劳动节
+        _nth_weekday(year, 11, 3, 4),           # 感恩节
+        _observed(date(year, 12, 25)),          # 圣诞节
+    ]
+    if year >= 2022:
+        holidays.append(_observed(date(year, 6, 19)))  # 六月节
+    holidays += [date.fromisoformat(d) for d in SPECIAL_CLOSURES if d.startswith(str(year))]
+
+    early_closes = [
+        date(year, 7, 3),                                   # 独立日前一天
+        _nth_weekday(year, 11, 3, 4) + timedelta(days=1),   # 感恩节次日
+        date(year, 12, 24),                                 # 平安夜
+    ]
+    early_closes = [d for d in early_closes if d.weekday() < 5 and d not in holidays]
+
+    return {
+        'holidays': sorted(d.isoformat() for d in set(holidays)),
+        'early_closes': sorted(d.isoformat() for d in early_closes),
+    }
+
+
+# ==============================================================================
+# 2. 日历缓存与查询
+# ==============================================================================
+
+@lru_cache(maxsize=None)
+def _year_calendar(year):
+    """
+    读取某一年的日历：优先使用缓存文件，缺失时按规则计算并写回缓存
+    """
+    try:
+        with open(CALENDAR_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    entry = cache.get(str(year))
+    if entry is None:
+        entry = build_year_calendar(year)
+        cache[str(year)] = entry
+        try:
+            write_json(CALENDAR_CACHE_FILE, cache)
+        except OSError:
+            pass
+    return frozenset(entry['holidays']), frozenset(entry['early_closes'])
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day.isoformat() not in _year_calendar(day.year)[0]
+
+
+def session_close(day):
+    """
+    某个交易日的常规收盘时间
+    """
+    return EARLY_CLOSE if day.isoformat() in _year_calendar(day.year)[1] else REGULAR_CLOSE
+
+
+def previous_trading_day(day):
+    day -= timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def trading_days_between(start, end):
+    """
+    [start, end] 区间内的所有交易日 (升序的 date 列表)
+    """
+    days, day = [], start
+    while day <= end:
+        if is_trading_day(day):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def current_session(now=None):
+    """
+    判断当前所处的交易时段，返回 (是否有正在进行的时段, 交易日)。
+    交易日当天盘前 04:00 到收盘之间为进行中的时段 (返回当天)；
+    其余时间返回最近一个已完成的交易日。
+    """
+    now = (now or datetime.now(ET_ZONE)).astimezone(ET_ZONE)
+    today = now.date()
+    if is_trading_day(today):
+        if now.time() < PRE_MARKET_OPEN:
+            return False, previous_trading_day(today)
+        if now.time() < session_close(today):
+            return True, today
+        return False, today
+    return False, previous_trading_day(today)
+
+
+def market_state(now=None):
+    """
+    按交易日历推算当前的市场状态，取值与 yfinance info 的 marketState 一致: PRE / REGULAR / POST / CLOSED
+    """
+    now = (now or datetime.now(ET_ZONE)).astimezone(ET_ZONE)
+    today = now.date()
+    if not is_trading_day(today):
+        return 'CLOSED'
+    close = session_close(today)
+    post_close = (datetime.combine(today, close) + POST_MARKET_DURATION).time()
+    current = now.time()
+    if current < PRE_MARKET_OPEN or current >= post_close:
+        return 'CLOSED'
+    if current < REGULAR_OPEN:
+        return 'PRE'
+    return 'REGULAR' if current < close else 'POST'
+
+
+# ==============================================================================
+# 3. 快照状态与快速路径判断
+# ==============================================================================
+
+def read_latest_history_date(history_file):
+    """
+    只读取历史文件的前两条数据行，返回最新的日期字符串；文件为空时返回 None
+    """
+    try:
+        with open(history_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            dates = [row[0] for row in (next(reader, None), next(reader, None)) if row]
+    except FileNotFoundError:
+        return None
+    return max(dates) if dates else None
+
+
+def load_snapshot_state():
+    try:
+        with open(SNAPSHOT_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_snapshot(session_date, now=None):
+    """
+    记录本次写入的快照对应的交易日，以及写入时该交易日是否已经收盘
+    """
+    now = (now or datetime.now(ET_ZONE)).astimezone(ET_ZONE)
+    session_day = date.fromisoformat(session_date)
+    complete = now.date() > session_day or (now.date() == session_day and now.time() >= session_close(session_day))
+    write_json(SNAPSHOT_STATE_FILE, {'session': session_date, 'complete': complete,
+                                     'written_at': now.isoformat(timespec='seconds')})
+
+
+def check_market_closed(history_file, force=False, now=None):
+    """
+    休市快速路径判断，返回 (是否跳过本次运行, 原因)。
+    当没有正在进行的交易时段，且历史文件最新一行已覆盖上一个已完成的交易日时跳过；
+    若该行是在交易时段内写入的 (快照状态记录为未收盘)，则不跳过，以便用收盘价覆盖。
+    """
+    if force:
+        return False, "使用了 --force，强制运行"
+
+    in_progress, session_day = current_session(now)
+    if in_progress:
+        return False, f"交易日 {session_day} 的交易时段正在进行中"
+
+    latest = read_latest_history_date(history_file)
+    if latest is None or latest < session_day.isoformat():
+        return False, f"历史记录尚未包含最近已完成的交易日 {session_day}"
+
+    state = load_snapshot_state()
+    if state.get('session') == latest and not state.get('complete', True):
+        return False, f"{latest} 的快照写入于收盘前，需要用收盘价更新"
+
+    return True, f"历史记录已包含最近已完成的交易日 {session_day} (最新一行: {latest})"
+
+
+def default_history_file():
+    """
+    不导入 main.py (避免加载 pandas/matplotlib)，直接从 config.ini 读取历史文件名
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    config.read(os.path.join(ROOT_DIR, 'config.ini'), encoding='utf-8')
+    name = config.get('General', 'history_file', fallback='portfolio_details_history.csv')
+    return os.path.join(DATA_DIR, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="判断本次运行是否可以走休市快速路径")
+    parser.add_argument('--force', action='store_true', help="忽略休市判断，强制运行")
+    args = parser.parse_args()
+
+    skip, reason = check_market_closed(default_history_file(), force=args.force)
+    print(f"{'休市快速路径: 跳过本次运行' if skip else '需要运行'} ({reason})")
+
+    github_output = os.environ.get('GITHUB_OUTPUT')
+    if github_output:
+        with open(github_output, 'a', encoding='utf-8') as f:
+            f.write(f"skip={'true' if skip else 'false'}\n")
+
+
+if __name__ == "__main__":
+    main()
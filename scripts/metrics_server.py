@@ -0,0 +1,354 @@
+"""
+本地只读指标 API (可选)
+docs/ 中的仪表盘只能读取静态文件，每次查看都要下载并解析完整的原始数据。
+本脚本用标准库 http.server 在本地提供 JSON 接口：启动时把历史文件 (连同每日现金流/收益率与资产归因矩阵)
+和恐惧贪婪指数数据一次性加载到内存 (只读本地文件，拆股/分红调整只使用已有的本地缓存，不发起任何网络请求)，
+之后的请求都在内存中计算，相同请求的响应保存在 LRU 缓存中。
+每次请求前检查数据文件的修改时间和大小，文件变化 (例如工作流或 main.py 写入了新数据) 时
+重新加载数据并清空响应缓存。
+
+用法:
+  python scripts/metrics_server.py                       # 监听 127.0.0.1:8765
+  python scripts/metrics_server.py --port 9000 --cache-size 512
+
+接口 (日期格式 YYYY-MM-DD，start/end 省略时为数据的第一天/最后一天):
+  GET /api/summary                          最新日期、总市值、各持仓、上一交易日收益和恐惧贪婪指数
+  GET /api/series?start=&end=&points=500    总市值与每日收益率序列，超过 points 个点时等间隔降采样
+  GET /api/returns                          各标准周期 (与 portfolio_return.json 相同) 的组合收益
+  GET /api/returns?start=&end=              任意区间的组合收益率 (TWRR)、收益与增值
+  GET /api/assets?start=&end=               各资产在区间内的收益率、贡献和收益金额
+  GET /api/fear-greed                       恐惧贪婪指数 (fear_greed_index.json)
+"""
+
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from asset_attribution import build_attribution_matrices, period_attribution
+from calculate_return import build_flows_frame, build_periods, calculate_period_return
+from corporate_actions import CORPORATE_ACTIONS_FILE, load_adjustment_factors
+from history_store import load_history_arrays, partition_manifest_file
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+FEAR_GREED_FILE = os.path.join(DATA_DIR, 'fear_greed_index.json')
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_SERIES_POINTS = 500
+MAX_SERIES_POINTS = 10000
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _number(x, digits=6):
+    if x is None or not np.isfinite(x):
+        return None
+    return round(float(x), digits)
+
+
+def _parse_date(query, name, default):
+    value = query.get(name)
+    if not value:
+        return default
+    try:
+        return pd.Timestamp(value)
+    except ValueError:
+        raise BadRequest(f"参数 {name} 不是有效日期: '{value}'")
+
+
+def _load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def downsample_positions(n, points):
+    """
+    从 n 个点中等间隔选取不超过 points 个位置 (总是包含第一个和最后一个点)
+    """
+    if n <= points:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, points).round().astype(np.int64))
+
+
+# ==============================================================================
+# 1. 内存中的数据快照
+# ==============================================================================
+
+class MetricsSnapshot:
+    """
+    一次加载的全部数据: 组合每日现金流/收益率 DataFrame、资产价值/价格矩阵与归因矩阵、恐惧贪婪指数
+    """
+
+    def __init__(self, history_file=HISTORY_FILE):
+        arrays = load_history_arrays(history_file)
+        if len(arrays['dates']) == 0:
+            raise ValueError(f"历史文件 '{history_file}' 为空")
+        arrays['adjustments'] = load_adjustment_factors(arrays, refresh=False)
+
+        self.flows = build_flows_frame(arrays)
+        self.index = self.flows.index
+        self.assets = arrays['assets']
+        self.values = arrays['values']
+        self.prices = arrays['prices']
+        self.matrices = build_attribution_matrices(self.values, self.prices, adjustments=arrays['adjustments'])
+        self.fear_greed = _load_json(FEAR_GREED_FILE)
+
+    def locate(self, start, end):
+        """
+        [start, end] 区间在日期索引中的 (开始位置, 结束位置)；区间内没有数据时抛出 BadRequest
+        """
+        start_loc = self.index.searchsorted(start, side='left')
+        end_loc = self.index.searchsorted(end, side='right') - 1
+        if end_loc < 0 or start_loc >= len(self.index) or end_loc < start_loc:
+            raise BadRequest(f"{start.date()} ~ {end.date()} 之间没有数据")
+        return start_loc, end_loc
+
+    def date_range(self, query):
+        start = _parse_date(query, 'start', self.index[0])
+        end = _parse_date(query, 'end', self.index[-1])
+        return start, end
+
+    def summary(self, query):
+        latest = self.values[-1]
+        holdings = {asset: {'value': _number(latest[j], 2), 'price': _number(self.prices[-1, j], 4)}
+                    for j, asset in enumerate(self.assets) if latest[j] != 0}
+        fear_greed = (self.fear_greed or {}).get('fear_and_greed')
+        return {
+            'as_of': self.index[-1].strftime('%Y-%m-%d'),
+            'total_value': _number(self.flows['total_value'].iloc[-1], 2),
+            'daily_return': _number(self.flows['daily_return'].iloc[-1]) if len(self.index) > 1 else None,
+            'holdings': holdings,
+            'fear_greed': fear_greed,
+        }
+
+    def series(self, query):
+        start_loc, end_loc = self.locate(*self.date_range(query))
+        try:
+            points = int(query.get('points', DEFAULT_SERIES_POINTS))
+        except ValueError:
+            raise BadRequest(f"参数 points 不是整数: '{query['points']}'")
+        points = min(max(points, 2), MAX_SERIES_POINTS)
+
+        window = self.flows.iloc[start_loc:end_loc + 1]
+        positions = downsample_positions(len(window), points)
+        sampled = window.iloc[positions]
+        return {
+            'start': window.index[0].strftime('%Y-%m-%d'),
+            'end': window.index[-1].strftime('%Y-%m-%d'),
+            'total_points': len(window),
+            'dates': sampled.index.strftime('%Y-%m-%d').tolist(),
+            'total_value': [_number(x, 2) for x in sampled['total_value']],
+            'daily_return': [_number(x) for x in sampled['daily_return']],
+        }
+
+    def returns(self, query):
+        if 'start' not in query and 'end' not in query:
+            periods = build_periods(self.index)
+        else:
+            periods = {'custom': self.date_range(query)}
+
+        results = []
+        for name, (start_date, end_date) in periods.items():
+            result = calculate_period_return(self.flows, start_date, end_date, name)
+            if result:
+                results.append({
+                    'period': name,
+                    'start': result['Start Date'],
+                    'end': result['End Date'],
+                    'trading_days': int(result['Trading Days']),
+                    'return': _number(result['Return']),
+                    'profit': _number(result['Market Gain'], 2),
+                    'growth': _number(result['Growth'], 2),
+                    'inferred_flow': _number(result['Inferred Flow'], 2),
+                })
+        if not results:
+            raise BadRequest("所选区间内无法计算收益")
+        return results
+
+    def asset_returns(self, query):
+        start_loc, end_loc = self.locate(*self.date_range(query))
+        result = period_attribution(self.matrices, [start_loc], [end_loc])
+        held = (self.values[start_loc:end_loc + 1] != 0).any(axis=0)
+        return {
+            'start': self.index[start_loc].strftime('%Y-%m-%d'),
+            'end': self.index[end_loc].strftime('%Y-%m-%d'),
+            'assets': {
+                asset: {
+                    'return': _number(result['return'][0, j]),
+                    'contribution': _number(result['contribution'][0, j]),
+                    'gain': _number(result['gain'][0, j], 2),
+                    'value': _number(self.values[end_loc, j], 2),
+                }
+                for j, asset in enumerate(self.assets) if held[j]
+            },
+        }
+
+
+# ==============================================================================
+# 2. 响应缓存与文件变化检测
+# ==============================================================================
+
+class ResponseCache:
+    """
+    线程安全的 LRU 缓存: (路径, 排序后的查询参数) -> 已编码的 JSON 响应
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MetricsStore:
+    """
+    持有当前的数据快照和响应缓存；被监视的文件变化时重新加载快照并清空缓存
+    """
+
+    def __init__(self, history_file=HISTORY_FILE, cache_size=DEFAULT_CACHE_SIZE):
+        self.history_file = history_file
+        self.watched = (history_file, partition_manifest_file(history_file), FEAR_GREED_FILE, CORPORATE_ACTIONS_FILE)
+        self.cache = ResponseCache(cache_size)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._snapshot = None
+
+    def _file_signature(self):
+        signature = []
+        for path in self.watched:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def snapshot(self):
+        signature = self._file_signature()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    print(f"[metrics-server] 数据文件已变化，重新加载 '{self.history_file}'...")
+                    self._snapshot = MetricsSnapshot(self.history_file)
+                    self._signature = signature
+                    self.cache.clear()
+        return self._snapshot
+
+    def respond(self, path, query):
+        """
+        返回 (HTTP 状态码, 已编码的 JSON 响应)。成功的响应进入 LRU 缓存。
+        """
+        handler = ROUTES.get(path)
+        if handler is None:
+            return 404, _encode({'error': f"未知接口: {path}", 'endpoints': sorted(ROUTES)})
+
+        snapshot = self.snapshot()
+        key = (path, tuple(sorted(query.items())))
+        body = self.cache.get(key)
+        if body is not None:
+            return 200, body
+        try:
+            body = _encode(handler(snapshot, query))
+        except BadRequest as e:
+            return 400, _encode({'error': str(e)})
+        self.cache.put(key, body)
+        return 200, body
+
+
+def _encode(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+ROUTES = {
+    '/api/summary': MetricsSnapshot.summary,
+    '/api/series': MetricsSnapshot.series,
+    '/api/returns': MetricsSnapshot.returns,
+    '/api/assets': MetricsSnapshot.asset_returns,
+    '/api/fear-greed': lambda snapshot, query: snapshot.fear_greed,
+}
+
+
+# ==============================================================================
+# 3. HTTP 服务
+# ==============================================================================
+
+def make_handler(store):
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                status, body = store.respond(url.path.rstrip('/') or '/', query)
+            except Exception as e:
+                status, body = 500, _encode({'error': str(e)})
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            # 允许本地打开的 docs/ 仪表盘跨域读取
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            print(f"[metrics-server] {self.address_string()} {fmt % args}")
+
+    return MetricsRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地只读指标 API")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"监听地址 (默认 {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"监听端口 (默认 {DEFAULT_PORT})")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f"LRU 响应缓存的最大条目数 (默认 {DEFAULT_CACHE_SIZE})")
+    args = parser.parse_args()
+
+    store = MetricsStore(args.history, args.cache_size)
+    store.snapshot()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(store))
+    print(f"[metrics-server] 正在监听 http://{args.host}:{args.port}/ ，接口: {', '.join(sorted(ROUTES))}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[metrics-server] 已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+投资组合价值的蒙特卡洛预测
+基于历史数据对未来若干年的组合价值做两种模拟，输出各分位数的价值区间 (供仪表盘绘制扇形图):
+  - bootstrap: 从 calculate_inferred_cash_flows 计算的组合每日收益率 (已剔除现金流) 中有放回地抽取交易日，
+               保留历史收益率分布的厚尾和偏度，隐含历史上的调仓行为
+  - normal:    以当前持仓为初始权重，按各资产 (已按拆股/分红调整的) 日对数收益率的均值和协方差抽取相关的正态收益率，
+               各资产独立复利、期间不再调仓 (买入持有)；现金收益率为0
+所有路径在 NumPy 中按块向量化模拟 (路径数 × 交易日数 × 资产数)，每块使用由固定种子派生的独立随机数流，
+因此结果只取决于种子和路径数，与块的划分方式和 --workers 指定的进程数无关。
+不考虑未来的现金流和期权到期，结果写入 data/portfolio_projection.json。
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from calculate_return import build_flows_frame
+from corporate_actions import load_adjustment_factors
+from history_store import load_history_arrays
+from instruments import REGISTRY
+from market_calendar import trading_days_between
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_projection.json')
+TRADING_DAYS_PER_YEAR = 252
+DEFAULT_PATHS = 10000
+DEFAULT_YEARS = 3
+DEFAULT_SEED = 20240101
+# 估计收益率分布使用的最近交易日数
+LOOKBACK_DAYS = 756
+# 协方差估计中每对资产最少的共同观测数
+MIN_OBSERVATIONS = 20
+# 每块的路径数 (正态模拟时按 路径 × 交易日 × 资产数 不超过 MAX_BLOCK_ELEMENTS 缩小)
+BLOCK_PATHS = 1000
+MAX_BLOCK_ELEMENTS = 8_000_000
+# 输出的分位数和输出间隔 (交易日)
+PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+OUTPUT_STEP_DAYS = 5
+
+
+# ==============================================================================
+# 1. 模型参数估计
+# ==============================================================================
+
+def bootstrap_sample(df_with_flows, lookback=LOOKBACK_DAYS):
+    """
+    最近 lookback 个交易日的组合日对数收益率 (第一天没有收益率，不计入)
+    """
+    daily_returns = df_with_flows['daily_return'].to_numpy(dtype=np.float64)[1:][-lookback:]
+    daily_returns = daily_returns[np.isfinite(daily_returns) & (daily_returns > -1.0)]
+    return np.log1p(daily_returns)
+
+
+def normal_parameters(arrays, lookback=LOOKBACK_DAYS, min_observations=MIN_OBSERVATIONS):
+    """
+    由当前持仓和各资产的价格历史估计正态模拟的参数。
+    返回 {'assets', 'weights', 'cash_weight', 'mean', 'transform'}:
+    weights 为当前非现金持仓占总价值的比例，mean 为日对数收益率均值，
+    transform 满足 transform @ transform.T = 协方差 (对协方差做特征值截断，保证半正定)。
+    """
+    values, prices = arrays['values'], arrays['prices']
+    latest = values[-1]
+    total = latest.sum()
+    is_cash = np.array([REGISTRY.get(asset) is not None and REGISTRY[asset].is_cash for asset in arrays['assets']])
+    held = np.flatnonzero((latest > 0) & ~is_cash)
+
+    adjusted = prices[-(lookback + 1):, held] * arrays['adjustments'][-(lookback + 1):, held]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_returns = np.log(adjusted[1:] / adjusted[:-1])
+    log_returns[~((adjusted[1:] > 0) & (adjusted[:-1] > 0))] = np.nan
+
+    frame = pd.DataFrame(log_returns)
+    mean = frame.mean().fillna(0.0).to_numpy()
+    covariance = frame.cov(min_periods=min_observations).fillna(0.0).to_numpy()
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance) if len(held) else (np.zeros(0), np.zeros((0, 0)))
+    transform = eigenvectors * np.sqrt(np.clip(eigenvalues, 0.0, None))
+
+    weights = latest[held] / total if total > 0 else np.zeros(len(held))
+    return {
+        'assets': [arrays['assets'][j] for j in held],
+        'weights': weights,
+        'cash_weight': 1.0 - weights.sum(),
+        'mean': mean,
+        'transform': transform,
+    }
+
+
+# ==============================================================================
+# 2. 向量化模拟
+# ==============================================================================
+
+def output_steps(horizon, step=OUTPUT_STEP_DAYS):
+    """
+    输出的交易日位置 (0 为当前，总是包含最后一天)
+    """
+    return np.unique(np.append(np.arange(0, horizon + 1, step), horizon))
+
+
+def simulate_bootstrap(sample, n_paths, horizon, steps, rng):
+    """
+    有放回抽取历史日对数收益率，返回各路径在 steps 处的价值倍数 (路径数 × 输出点数)
+    """
+    draws = sample[rng.integers(0, len(sample), size=(n_paths, horizon))]
+    cumulative = np.concatenate([np.zeros((n_paths, 1)), np.cumsum(draws, axis=1)], axis=1)
+    return np.exp(cumulative[:, steps])
+
+
+def simulate_normal(params, n_paths, horizon, steps, rng):
+    """
+    抽取相关的正态日对数收益率，各资产买入持有，返回各路径在 steps 处的价值倍数 (路径数 × 输出点数)
+    """
+    n_assets = len(params['weights'])
+    growth = np.full((n_paths, len(steps)), params['cash_weight'])
+    if n_assets == 0:
+        return growth
+    shocks = rng.standard_normal(size=(n_paths, horizon, n_assets)) @ params['transform'].T
+    cumulative = np.cumsum(shocks + params['mean'], axis=1)
+    cumulative = np.concatenate([np.zeros((n_paths, 1, n_assets)), cumulative], axis=1)
+    return growth + np.exp(cumulative[:, steps, :]) @ params['weights']
+
+
+def _simulate_block(task):
+    """
+    模拟一块路径 (进程池的工作函数，参数打包为一个元组以便序列化)
+    """
+    method, model, n_paths, horizon, steps, seed = task
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        return simulate_bootstrap(model, n_paths, horizon, steps, rng)
+    return simulate_normal(model, n_paths, horizon, steps, rng)
+
+
+def block_sizes(n_paths, block_paths):
+    sizes = [block_paths] * (n_paths // block_paths)
+    if n_paths % block_paths:
+        sizes.append(n_paths % block_paths)
+    return sizes
+
+
+def run_simulation(method, model, n_paths, horizon, steps, seed, workers=1):
+    """
+    分块模拟 n_paths 条路径，返回价值倍数矩阵 (路径数 × 输出点数)。
+    每块的随机数流由 (种子, 方法) 派生的 SeedSequence 按块序号生成，workers > 1 时在进程池中并行。
+    """
+    block_paths = BLOCK_PATHS
+    if method == 'normal' and len(model['weights']):
+        block_paths = max(1, min(block_paths, MAX_BLOCK_ELEMENTS // (horizon * len(model['weights']))))
+    sizes = block_sizes(n_paths, block_paths)
+    method_key = 0 if method == 'bootstrap' else 1
+    seeds = np.random.SeedSequence([seed, method_key]).spawn(len(sizes))
+    tasks = [(method, model, size, horizon, steps, block_seed) for size, block_seed in zip(sizes, seeds)]
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            blocks = list(executor.map(_simulate_block, tasks))
+    else:
+        blocks = [_simulate_block(task) for task in tasks]
+    return np.concatenate(blocks, axis=0)
+
+
+# ==============================================================================
+# 3. 汇总与输出
+# ==============================================================================
+
+def summarize_paths(growth, start_value, steps):
+    """
+    各输出点的分位数价值区间和最后一天的分布摘要
+    """
+    bands = np.percentile(growth, PERCENTILES, axis=0) * start_value
+    final = growth[:, -1]
+    years = steps[-1] / TRADING_DAYS_PER_YEAR
+    return {
+        'bands': {f"p{q}": np.round(bands[k], 2).tolist() for k, q in enumerate(PERCENTILES)},
+        'mean': np.round(growth.mean(axis=0) * start_value, 2).tolist(),
+        'final': {
+            'mean': round(float(final.mean() * start_value), 2),
+            'median_annualized_return': round(float(np.median(final) ** (1.0 / years) - 1.0), 6) if years > 0 else None,
+            'probability_of_loss': round(float((final < 1.0).mean()), 4),
+            **{f"p{q}": round(float(np.percentile(final, q) * start_value), 2) for q in PERCENTILES},
+        },
+    }
+
+
+def projection_dates(last_date, steps):
+    """
+    输出点对应的未来交易日 (由 market_calendar 的规则日历推算)
+    """
+    horizon = int(steps[-1])
+    first = last_date.date() + timedelta(days=1)
+    # 每年约252个交易日，多取一些日历天数保证足够
+    sessions = trading_days_between(first, first + timedelta(days=int(horizon * 1.5) + 30))[:horizon]
+    dates = [last_date.strftime('%Y-%m-%d')] + [day.strftime('%Y-%m-%d') for day in sessions]
+    return [dates[step] for step in steps]
+
+
+def build_projection(arrays, df_with_flows, n_paths=DEFAULT_PATHS, years=DEFAULT_YEARS, seed=DEFAULT_SEED,
+                     workers=1):
+    """
+    运行两种模拟并汇总为可直接序列化的字典
+    """
+    horizon = int(round(years * TRADING_DAYS_PER_YEAR))
+    steps = output_steps(horizon)
+    start_value = float(df_with_flows['total_value'].iloc[-1])
+
+    models = {'bootstrap': bootstrap_sample(df_with_flows), 'normal': normal_parameters(arrays)}
+    methods = {}
+    for method, model in models.items():
+        if method == 'bootstrap' and len(model) == 0:
+            print("警告: 没有可用的历史日收益率，跳过 bootstrap 模拟。")
+            continue
+        growth = run_simulation(method, model, n_paths, horizon, steps, seed, workers)
+        methods[method] = summarize_paths(growth, start_value, steps)
+
+    normal = models['normal']
+    return {
+        'as_of': df_with_flows.index[-1].strftime('%Y-%m-%d'),
+        'start_value': round(start_value, 2),
+        'paths': n_paths,
+        'horizon_days': horizon,
+        'seed': seed,
+        'percentiles': PERCENTILES,
+        'steps': steps.tolist(),
+        'dates': projection_dates(df_with_flows.index[-1], steps),
+        'bootstrap_observations': int(len(models['bootstrap'])),
+        'normal_weights': {asset: round(float(w), 6) for asset, w in zip(normal['assets'], normal['weights'])},
+        'methods': methods,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投资组合价值的蒙特卡洛预测")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="输出路径")
+    parser.add_argument('--paths', type=int, default=DEFAULT_PATHS, help="每种方法模拟的路径数")
+    parser.add_argument('--years', type=float, default=DEFAULT_YEARS, help="预测年数")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="随机数种子")
+    parser.add_argument('--workers', type=int, default=1, help="并行的进程数 (默认在当前进程中运行)")
+    args = parser.parse_args()
+
+    try:
+        arrays = load_history_arrays(args.history)
+    except FileNotFoundError:
+        print(f"错误: 找不到历史文件 '{args.history}'。")
+        return
+
+    arrays['adjustments'] = load_adjustment_factors(arrays, refresh=False)
+    df_with_flows = build_flows_frame(arrays)
+    if len(df_with_flows) < 2:
+        print("错误: 历史数据不足两个交易日，无法进行模拟。")
+        return
+
+    report = build_projection(arrays, df_with_flows, args.paths, args.years, args.seed, args.workers)
+
+    print("=" * 70)
+    print(f"蒙特卡洛预测 (截至 {report['as_of']}, {report['paths']} 条路径, {report['horizon_days']} 个交易日)")
+    print("=" * 70)
+    for method, summary in report['methods'].items():
+        final = summary['final']
+        print(f"  {method:<10} 中位数 ${final['p50']:,.2f}  5%~95% ${final['p5']:,.2f} ~ ${final['p95']:,.2f}"
+              f"  亏损概率 {final['probability_of_loss']:.2%}")
+
+    if write_json(args.output, report):
+        print(f"\n已生成预测文件: '{args.output}'")
+    else:
+        print(f"\n预测文件内容未变化，无需写入: '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+期权合约生命周期
+[OptionsPortfolio] 中的合约会一直保留在配置里，到期后期权链已不存在，每次运行都会对它们反复请求并重试。
+本模块根据合约代码中的到期日判断合约是否已到期 (到期日美东 16:00，到期日休市时为之前最后一个交易日)，
+已到期的合约按标的在结算日的收盘价计算内在价值完成结算:
+  - 结算结果保存在 data/cache/option_settlements.json，每个合约只计算一次
+  - 结算价写入对应历史文件中结算日那一行 (每个历史文件只写一次)，之后的数据行中该合约价值为0。
+    结算登记先于当次运行的年度归档；只有结算被推迟 (如标的收盘价暂缺) 到结算日所在年份归档之后时，
+    才会改写已归档的年度分区，这是归档分区不变性的唯一日常例外，改写后同时更新分区清单中的摘要
+  - 所有实时报价、历史价格修复、收益率分析和希腊值计算都会跳过已到期合约，网络请求只与存续合约数量有关
+"""
+
+import json
+import os
+import threading
+from datetime import date, datetime, time
+
+import numpy as np
+import pandas as pd
+
+from history_store import (
+    format_history_cells,
+    history_partitions,
+    iter_history_chunks,
+    parse_history_matrix,
+    refresh_partition_digests,
+    write_history_chunks,
+)
+from instruments import REGISTRY
+from market_calendar import ET_ZONE, is_trading_day, previous_trading_day
+from output_writer import write_json
+from price_cache import get_close_panel
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+SETTLEMENTS_FILE = os.path.join(CACHE_DIR, 'option_settlements.json')
+# 期权在结算日美东 16:00 到期
+EXPIRY_TIME_ET = time(16, 0)
+
+_settlements_lock = threading.Lock()
+# 本次运行的结算记录，第一次使用时从文件读取，之后所有读写共用这一份
+_settlements = None
+
+
+def parse_option_key(key):
+    """
+    解析 TICKER_YYYY-MM-DD_STRIKE_TYPE 格式的期权代码，非期权代码返回 None
+    """
+    instrument = REGISTRY.get(key)
+    if instrument is None or not instrument.is_option:
+        return None
+    return {'key': instrument.key, 'ticker': instrument.underlying, 'expiry': instrument.expiry,
+            'strike': instrument.strike, 'type': instrument.option_type}
+
+
+def settlement_day(expiry):
+    """
+    结算日: 到期日本身，到期日休市 (如耶稣受难日) 时为之前最后一个交易日
+    """
+    day = date.fromisoformat(expiry)
+    return day if is_trading_day(day) else previous_trading_day(day)
+
+
+def is_expired(expiry, now=None):
+    now = (now or datetime.now(ET_ZONE)).astimezone(ET_ZONE)
+    return now >= datetime.combine(settlement_day(expiry), EXPIRY_TIME_ET, tzinfo=ET_ZONE)
+
+
+def is_expired_key(key, now=None):
+    """
+    期权代码对应的合约是否已到期；非期权代码返回 False
+    """
+    option = parse_option_key(key)
+    return option is not None and is_expired(option['expiry'], now)
+
+
+def partition_options(options, now=None):
+    """
+    把期权配置列表分为 (存续合约, 已到期合约)
+    """
+    live, expired = [], []
+    for opt in options:
+        (expired if is_expired(opt['expiry'], now) else live).append(opt)
+    return live, expired
+
+
+def intrinsic_value(spot, strike, is_call):
+    """
+    向量化计算到期内在价值 (每股)
+    """
+    spot, strike = np.asarray(spot, dtype=np.float64), np.asarray(strike, dtype=np.float64)
+    return np.where(np.asarray(is_call, dtype=bool), np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+
+
+# ==============================================================================
+# 1. 结算记录
+# ==============================================================================
+
+def load_settlements():
+    """
+    结算记录每次运行只从文件读取一次，之后返回内存中的同一个字典
+    """
+    global _settlements
+    if _settlements is None:
+        try:
+            with open(SETTLEMENTS_FILE, 'r', encoding='utf-8') as f:
+                _settlements = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _settlements = {}
+    return _settlements
+
+
+def save_settlements(settlements):
+    global _settlements
+    _settlements = settlements
+    write_json(SETTLEMENTS_FILE, settlements)
+
+
+def settle_expired_options(expired, settlements=None):
+    """
+    结算已到期合约: 已有结算记录的直接使用；新到期的合约通过 price_cache 一次批量获取
+    所有标的在结算日的收盘价，向量化计算内在价值。标的收盘价缺失的合约暂不结算，下次运行重试。
+    返回 {期权key: {'settlement_date', 'underlying_close', 'settlement_price', 'recorded'}}。
+    """
+    settlements = load_settlements() if settlements is None else settlements
+    pending = [opt for opt in expired if opt['key'] not in settlements]
+    if pending:
+        days = [settlement_day(opt['expiry']) for opt in pending]
+        underlyings = [REGISTRY[opt['ticker']].yfinance for opt in pending]
+        try:
+            panel = get_close_panel(underlyings, min(days), max(days))
+        except Exception as e:
+            print(f"  - [option-lifecycle] 获取标的收盘价失败: {e}")
+            panel = pd.DataFrame()
+
+        spot = np.array([panel[u].get(pd.Timestamp(d), np.nan) if u in panel.columns else np.nan
+                         for u, d in zip(underlyings, days)], dtype=np.float64)
+        prices = intrinsic_value(spot, [opt['strike'] for opt in pending], [opt['type'] == 'CALL' for opt in pending])
+        changed = False
+        for opt, day, close, price in zip(pending, days, spot, prices):
+            if not np.isfinite(close):
+                print(f"  - [option-lifecycle] {opt['key']} 已到期，但缺少 {opt['ticker']} 在 {day} 的收盘价，暂不结算")
+                continue
+            settlements[opt['key']] = {
+                'settlement_date': day.isoformat(),
+                'underlying_close': round(float(close), 4),
+                'settlement_price': round(float(price), 4),
+                'recorded': [],
+            }
+            changed = True
+            print(f"  - [option-lifecycle] {opt['key']} 已于 {day} 到期: 标的收盘价 ${close:.2f}，"
+                  f"按内在价值 ${price:.2f} 结算")
+        if changed:
+            save_settlements(settlements)
+
+    return {opt['key']: settlements[opt['key']] for opt in expired if opt['key'] in settlements}
+
+
+def settled_price(key, target_date):
+    """
+    已到期合约在结算日的价格 (结算价)；其他日期或尚未结算时返回 None
+    """
+    entry = load_settlements().get(key.upper())
+    if entry is None or str(target_date)[:10] != entry['settlement_date']:
+        return None
+    return entry['settlement_price']
+
+
+# ==============================================================================
+# 2. 把结算写入历史文件
+# ==============================================================================
+
+def record_settlements_in_history(history_file, quantities, data_date):
+    """
+    把尚未写入该历史文件的结算记录写入结算日那一行: 单元格改为 (结算价 × 数量 × 合约乘数 | 结算价)，
+    并相应调整 total_value。结算日就是本次数据日期时，本次保存的数据行已按结算价估值，只需登记。
+    quantities: {期权key: 该历史文件对应的持仓数量}。多个投资组合并行调用时通过锁串行化。
+    """
+    name = os.path.basename(history_file)
+    with _settlements_lock:
+        settlements = load_settlements()
+        pending = {key: settlements[key] for key in quantities
+                   if key in settlements and name not in settlements[key]['recorded']
+                   and settlements[key]['settlement_date'] <= data_date}
+        if not pending:
+            return []
+
+        to_patch = {key: entry for key, entry in pending.items() if entry['settlement_date'] < data_date}
+        patched = set()
+
+        def patched_chunks(partition):
+            for chunk in iter_history_chunks(partition):
+                for key, entry in to_patch.items():
+                    day = entry['settlement_date']
+                    if day not in chunk.index or key not in chunk.columns:
+                        continue
+                    old_value = parse_history_matrix(chunk.loc[[day]], [key])[0][0, 0]
+                    price = entry['settlement_price']
+                    new_value = price * quantities[key] * REGISTRY[key].multiplier
+                    chunk.at[day, key] = format_history_cells([[new_value]], [[price]])[0, 0]
+                    total = float(pd.to_numeric(chunk.at[day, 'total_value'], errors='coerce') or 0.0)
+                    chunk.at[day, 'total_value'] = f"{total - old_value + new_value:.2f}"
+                    patched.add(key)
+                yield chunk
+
+        if to_patch and os.path.exists(history_file):
+            # 结算日可能已归入上一年的归档分区，只改写包含这些日期的分区，并更新清单中归档分区的摘要
+            days = [entry['settlement_date'] for entry in to_patch.values()]
+            partitions = history_partitions(history_file, min(days), max(days))
+            rewritten = [partition for partition in partitions
+                         if write_history_chunks(partition, patched_chunks(partition))]
+            refresh_partition_digests(history_file, rewritten)
+        for key, entry in pending.items():
+            entry['recorded'].append(name)
+            if key in patched:
+                print(f"  - [option-lifecycle] 已把 {key} 的结算价 ${entry['settlement_price']:.2f} "
+                      f"写入 {name} 中 {entry['settlement_date']} 的数据行")
+        save_settlements(settlements)
+        return sorted(pending)
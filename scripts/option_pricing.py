@@ -0,0 +1,248 @@
+"""
+向量化 Black-Scholes 期权定价与希腊值
+期权链的 lastPrice 对不活跃合约经常缺失或过期，本模块用标的价格、行权价、剩余期限和
+期权链中的隐含波动率，对整个期权组合一次性 (NumPy 向量化) 计算理论价格及 delta/gamma/theta/vega，
+作为报价缺失或过期时的备用价格，同时提供组合的希腊值风险敞口。
+
+隐含波动率等期权链数据缓存在 data/cache/option_chain.json，期权链获取失败时使用上次的数据。
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instruments import REGISTRY
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+OPTION_CHAIN_CACHE_FILE = os.path.join(CACHE_DIR, 'option_chain.json')
+GREEKS_OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_options_greeks.json')
+
+# --- 模型参数 ---
+RISK_FREE_RATE = 0.04
+DAYS_PER_YEAR = 365.0
+# 期权在到期日美东 16:00 到期
+EXPIRY_HOUR_ET = 16
+# 剩余期限下限 (约1分钟)，避免到期时除零
+MIN_TIME_TO_EXPIRY = 1.0 / (DAYS_PER_YEAR * 24 * 60)
+# 隐含波动率的有效区间，期权链中超出该区间的值视为无效
+MIN_IMPLIED_VOLATILITY = 0.01
+MAX_IMPLIED_VOLATILITY = 5.0
+# 最近成交早于该天数的 lastPrice 视为过期报价
+STALE_QUOTE_DAYS = 3
+
+
+# ==============================================================================
+# 1. 正态分布函数
+# ==============================================================================
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x):
+    """
+    标准正态分布函数 (Abramowitz & Stegun 7.1.26 误差函数近似，绝对误差 < 1.5e-7)，
+    无需 scipy
+    """
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+# ==============================================================================
+# 2. Black-Scholes 定价
+# ==============================================================================
+
+def time_to_expiry(expiries, now):
+    """
+    以年为单位的剩余期限，expiries 为 'YYYY-MM-DD' 列表，now 为美东时区的当前时间
+    """
+    expiry_times = pd.to_datetime(list(expiries)) + pd.Timedelta(hours=EXPIRY_HOUR_ET)
+    now = pd.Timestamp(now).tz_localize(None) if pd.Timestamp(now).tzinfo else pd.Timestamp(now)
+    seconds = (expiry_times - now).total_seconds().to_numpy()
+    return np.maximum(seconds / (DAYS_PER_YEAR * 24 * 3600), MIN_TIME_TO_EXPIRY)
+
+
+def black_scholes(spot, strike, t, vol, is_call, rate=RISK_FREE_RATE):
+    """
+    向量化计算欧式期权的理论价格与希腊值 (每份合约对应1股标的)。
+    返回字典: price, delta, gamma, theta (每自然日), vega (波动率每变动1个百分点)。
+    """
+    spot, strike, t, vol = (np.asarray(a, dtype=np.float64) for a in (spot, strike, t, vol))
+    is_call = np.asarray(is_call, dtype=bool)
+
+    sqrt_t = np.sqrt(t)
+    vol_sqrt_t = vol * sqrt_t
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / vol_sqrt_t
+    d2 = d1 - vol_sqrt_t
+    discount = np.exp(-rate * t)
+    pdf_d1 = norm_pdf(d1)
+
+    call_price = spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    put_price = strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    price = np.where(is_call, call_price, put_price)
+
+    delta = np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0)
+    gamma = pdf_d1 / (spot * vol_sqrt_t)
+    decay = -spot * pdf_d1 * vol / (2 * sqrt_t)
+    call_theta = decay - rate * strike * discount * norm_cdf(d2)
+    put_theta = decay + rate * strike * discount * norm_cdf(-d2)
+    theta = np.where(is_call, call_theta, put_theta) / DAYS_PER_YEAR
+    vega = spot * pdf_d1 * sqrt_t / 100.0
+
+    return {'price': price, 'delta': delta, 'gamma': gamma, 'theta': theta, 'vega': vega}
+
+
+# ==============================================================================
+# 3. 期权链数据缓存
+# ==============================================================================
+
+def load_chain_cache():
+    try:
+        with open(OPTION_CHAIN_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_chain_cache(cache):
+    write_json(OPTION_CHAIN_CACHE_FILE, cache)
+
+
+def extract_chain_data(chain_df, strike, underlying=None, now=None):
+    """
+    从期权链中提取单个合约的定价数据:
+      - implied_volatility: 合约自身的隐含波动率无效时，取行权价 ±20% 范围内有效值的中位数
+      - underlying_price: 期权链返回的标的价格
+      - stale: lastPrice 是否缺失或过期
+    """
+    now = pd.Timestamp(now or pd.Timestamp.now(tz='UTC'))
+    ivs = pd.to_numeric(chain_df['impliedVolatility'], errors='coerce')
+    valid_iv = ivs.between(MIN_IMPLIED_VOLATILITY, MAX_IMPLIED_VOLATILITY)
+    is_contract = chain_df['strike'] == strike
+
+    contract_iv = ivs[is_contract & valid_iv]
+    if not contract_iv.empty:
+        implied_volatility = float(contract_iv.iloc[0])
+    else:
+        nearby = valid_iv & (chain_df['strike'] - strike).abs().le(0.2 * strike)
+        implied_volatility = float(ivs[nearby].median()) if nearby.any() else None
+
+    contract = chain_df[is_contract]
+    last_price = pd.to_numeric(contract['lastPrice'], errors='coerce').iloc[0] if not contract.empty else np.nan
+    last_trade = contract['lastTradeDate'].iloc[0] if not contract.empty else pd.NaT
+    stale = (not np.isfinite(last_price) or last_price <= 0 or pd.isna(last_trade) or
+             now - pd.Timestamp(last_trade) > pd.Timedelta(days=STALE_QUOTE_DAYS))
+
+    underlying_price = (underlying or {}).get('regularMarketPrice')
+    return {
+        'implied_volatility': implied_volatility,
+        'underlying_price': float(underlying_price) if underlying_price else None,
+        'stale': bool(stale),
+    }
+
+
+# ==============================================================================
+# 4. 期权组合定价与希腊值
+# ==============================================================================
+
+def price_options_book(options, spot_prices, chain_data, now):
+    """
+    一次向量化计算整个期权组合的理论价格和单份合约希腊值。
+    options: 期权配置列表 (含 key/ticker/expiry/strike/type)
+    spot_prices: {标的代码: 标的价格}，缺失时使用期权链中的标的价格
+    chain_data: {期权key: extract_chain_data 的结果}
+    返回以期权 key 为索引的 DataFrame；无法定价的合约 (缺少标的价格或隐含波动率) 价格为 NaN。
+    """
+    columns = ['underlying', 'spot', 'strike', 'expiry', 'type', 'implied_volatility', 'time_to_expiry',
+               'model_price', 'delta', 'gamma', 'theta', 'vega']
+    if not options:
+        return pd.DataFrame(columns=columns)
+
+    keys = [opt['key'] for opt in options]
+    data = [chain_data.get(key, {}) for key in keys]
+    spot = np.array([spot_prices.get(opt['ticker']) or d.get('underlying_price') or np.nan
+                     for opt, d in zip(options, data)], dtype=np.float64)
+    vol = np.array([d.get('implied_volatility') or np.nan for d in data], dtype=np.float64)
+    strike = np.array([opt['strike'] for opt in options], dtype=np.float64)
+    is_call = np.array([opt['type'] == 'CALL' for opt in options])
+    t = time_to_expiry([opt['expiry'] for opt in options], now)
+
+    result = black_scholes(spot, strike, t, vol, is_call)
+    return pd.DataFrame({
+        'underlying': [opt['ticker'] for opt in options],
+        'spot': spot,
+        'strike': strike,
+        'expiry': [opt['expiry'] for opt in options],
+        'type': [opt['type'] for opt in options],
+        'implied_volatility': vol,
+        'time_to_expiry': t,
+        'model_price': result['price'],
+        'delta': result['delta'],
+        'gamma': result['gamma'],
+        'theta': result['theta'],
+        'vega': result['vega'],
+    }, index=keys)
+
+
+def position_greeks(book, quantities):
+    """
+    按持仓数量 × 合约乘数汇总希腊值，返回 (每个持仓的希腊值 DataFrame, 组合合计字典)。
+    dollar_delta 为标的价格变动1%对应的持仓价值变动。
+    """
+    positions = book.reindex(list(quantities.keys()))
+    units = pd.Series(quantities, dtype='float64') * REGISTRY.multipliers(quantities.keys())
+    exposure = positions[['delta', 'gamma', 'theta', 'vega']].mul(units, axis=0)
+    exposure['dollar_delta'] = exposure['delta'] * positions['spot'] / 100.0
+    exposure.insert(0, 'quantity', pd.Series(quantities, dtype='float64'))
+    totals = exposure.drop(columns='quantity').sum(min_count=1)
+    return exposure, totals.to_dict()
+
+
+def _clean(value, digits=4):
+    if value is None or isinstance(value, str):
+        return value
+    return None if not np.isfinite(value) else round(float(value), digits) + 0.0
+
+
+def build_greeks_report(book, portfolio_quantities, price_sources, as_of):
+    """
+    组装 portfolio_options_greeks.json 的内容
+    """
+    contracts = {}
+    for key, row in book.iterrows():
+        contracts[key] = {name: _clean(row[name]) for name in book.columns}
+        contracts[key]['price_source'] = price_sources.get(key)
+
+    portfolios = {}
+    for name, quantities in portfolio_quantities.items():
+        if not quantities:
+            continue
+        exposure, totals = position_greeks(book, quantities)
+        portfolios[name] = {
+            'positions': {key: {col: _clean(val) for col, val in row.items()} for key, row in exposure.iterrows()},
+            'total': {col: _clean(val, 2) for col, val in totals.items()},
+        }
+
+    return {'as_of': as_of, 'risk_free_rate': RISK_FREE_RATE, 'contracts': contracts, 'portfolios': portfolios}
+
+
+def save_greeks_report(report, output_file=GREEKS_OUTPUT_FILE):
+    try:
+        if write_json(output_file, report):
+            print(f"✓ 期权希腊值已保存到: {output_file}")
+        else:
+            print(f"✓ 期权希腊值未变化，无需写入: {output_file}")
+    except Exception as e:
+        print(f"✗ 错误: 无法写入期权希腊值文件 '{output_file}': {e}")
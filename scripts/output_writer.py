@@ -0,0 +1,113 @@
+"""
+生成文件的统一输出层
+所有输出 (历史CSV、图表PNG、JSON) 先在内存中序列化，与磁盘上已有文件的内容哈希比较，
+只有内容变化时才通过 "同目录临时文件 + 原子重命名" 写入。
+这样可以减少磁盘写入和 git 提交的体积，并保证手动运行与定时运行并发时不会读到写了一半的文件。
+"""
+
+import hashlib
+import io
+import json
+import os
+import stat
+import tempfile
+
+HASH_CHUNK_BYTES = 1 << 20
+# 新建文件的权限 (mkstemp 创建的临时文件为 0600)
+DEFAULT_FILE_MODE = 0o644
+
+
+def file_digest(path):
+    """
+    文件内容的 SHA-256 摘要；文件不存在时返回 None
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _temp_path(path):
+    """
+    在目标文件所在目录创建唯一的临时文件（保证 os.replace 在同一文件系统内原子完成）
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    os.close(fd)
+    return tmp_path
+
+
+def _replace(tmp_path, path):
+    """
+    把临时文件的权限设为目标文件已有的权限 (新文件为 DEFAULT_FILE_MODE)，再原子替换目标文件
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = DEFAULT_FILE_MODE
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
+
+
+def write_bytes(path, data):
+    """
+    内容与磁盘上的文件不同时原子写入，返回是否发生了写入
+    """
+    if os.path.exists(path) and os.path.getsize(path) == len(data) and \
+            file_digest(path) == hashlib.sha256(data).hexdigest():
+        return False
+
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        _replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def write_text(path, text):
+    return write_bytes(path, text.encode('utf-8'))
+
+
+def write_json(path, obj):
+    """
+    以紧凑格式 (无缩进、无多余空格) 写出 JSON
+    """
+    return write_text(path, json.dumps(obj, ensure_ascii=False, separators=(',', ':')))
+
+
+def write_figure(path, fig, **savefig_kwargs):
+    """
+    把 matplotlib 图表渲染到内存后写出；去掉 Software 元数据，保证相同图表得到相同的字节
+    """
+    image_format = os.path.splitext(path)[1].lstrip('.').lower() or 'png'
+    if image_format == 'png':
+        savefig_kwargs.setdefault('pil_kwargs', {'optimize': True})
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=image_format, metadata={'Software': None}, **savefig_kwargs)
+    return write_bytes(path, buffer.getvalue())
+
+
+def write_streamed(path, write_func):
+    """
+    流式写出大文件 (如分块写入的历史CSV): write_func(文件对象) 写入临时文件的同时计算哈希，
+    与已有文件相同时丢弃临时文件。返回是否发生了写入。
+    """
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            write_func(f)
+        if file_digest(tmp_path) == file_digest(path):
+            return False
+        _replace(tmp_path, path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,152 @@
+"""
+本地日线收盘价缓存
+按标的把 yfinance 的日线收盘价缓存在 data/cache/prices/ 下，
+每次只下载缓存尚未覆盖的日期区间，同一区间的多个标的合并为一次批量下载。
+"""
+
+import json
+import os
+
+import pandas as pd
+import yfinance as yf
+
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+PRICE_CACHE_DIR = os.path.join(CACHE_DIR, 'prices')
+os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+
+# 记录每个标的已下载过的日期区间 {symbol: [start, end]}
+COVERAGE_FILE = os.path.join(PRICE_CACHE_DIR, '_coverage.json')
+
+
+def _cache_path(symbol):
+    return os.path.join(PRICE_CACHE_DIR, f"{symbol}.csv")
+
+
+def load_coverage():
+    """
+    读取缓存覆盖区间表
+    """
+    try:
+        with open(COVERAGE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_coverage(coverage):
+    write_json(COVERAGE_FILE, coverage)
+
+
+def load_cached_closes(symbol):
+    """
+    读取某个标的的本地缓存收盘价，返回以日期为索引的 Series
+    """
+    path = _cache_path(symbol)
+    if not os.path.exists(path):
+        return pd.Series(dtype='float64', name=symbol)
+    df = pd.read_csv(path, index_col='date', parse_dates=True)
+    return df['close'].rename(symbol)
+
+
+def _save_cached_closes(symbol, closes):
+    closes = closes[~closes.index.duplicated(keep='last')].sort_index()
+    closes.rename('close').to_csv(_cache_path(symbol), index=True, index_label='date', float_format='%.4f')
+
+
+def _download_closes(symbols, start, end):
+    """
+    批量下载 [start, end] 区间的日线收盘价（未复权），返回列为标的的 DataFrame
+    """
+    print(f"  - [price-cache] 下载 {', '.join(symbols)} 的收盘价 ({start.date()} ~ {end.date()})...")
+    raw = yf.download(symbols, start=start.strftime('%Y-%m-%d'),
+                      end=(end + pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+                      auto_adjust=False, progress=False, group_by='column')
+    if raw is None or raw.empty:
+        return pd.DataFrame(columns=symbols, dtype='float64')
+
+    closes = raw['Close']
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=symbols[0])
+    if closes.index.tz is not None:
+        closes.index = closes.index.tz_localize(None)
+    closes.index = closes.index.normalize()
+    return closes
+
+
+def _missing_ranges(covered, start, end):
+    """
+    计算 [start, end] 中尚未被缓存覆盖的区间列表
+    """
+    if not covered:
+        return [(start, end)]
+
+    cov_start, cov_end = pd.Timestamp(covered[0]), pd.Timestamp(covered[1])
+    ranges = []
+    if start < cov_start:
+        ranges.append((start, cov_start - pd.Timedelta(days=1)))
+    if end > cov_end:
+        ranges.append((cov_end + pd.Timedelta(days=1), end))
+    return ranges
+
+
+def get_close_panel(symbols, start, end):
+    """
+    获取多个标的在 [start, end] 区间的日线收盘价面板。
+    缓存已覆盖的部分直接读取本地文件，缺失部分按区间分组批量下载后写回缓存。
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end).normalize()
+    # 今天的收盘价可能尚未确定，覆盖区间最多记录到昨天，下次运行会重新获取
+    last_final_day = pd.Timestamp.today().normalize() - pd.Timedelta(days=1)
+
+    coverage = load_coverage()
+    cached = {symbol: load_cached_closes(symbol) for symbol in symbols}
+
+    # 按缺失区间分组，同一区间的标的合并为一次下载
+    groups = {}
+    for symbol in symbols:
+        for missing in _missing_ranges(coverage.get(symbol), start, end):
+            groups.setdefault(missing, []).append(symbol)
+
+    coverage_changed = False
+    for (range_start, range_end), group_symbols in groups.items():
+        try:
+            downloaded = _download_closes(group_symbols, range_start, range_end)
+        except Exception as e:
+            print(f"  - [price-cache] 下载失败: {e}")
+            continue
+
+        for symbol in group_symbols:
+            new_closes = downloaded[symbol].dropna() if symbol in downloaded.columns else pd.Series(dtype='float64')
+            if new_closes.empty:
+                # 下载失败与区间内无交易无法区分，不记录覆盖区间，下次运行重试
+                continue
+            cached[symbol] = pd.concat([cached[symbol], new_closes])
+            _save_cached_closes(symbol, cached[symbol])
+
+            covered = coverage.get(symbol)
+            new_start = min(range_start, pd.Timestamp(covered[0])) if covered else range_start
+            new_end = min(max(range_end, pd.Timestamp(covered[1])) if covered else range_end, last_final_day)
+            if new_end >= new_start:
+                coverage[symbol] = [new_start.strftime('%Y-%m-%d'), new_end.strftime('%Y-%m-%d')]
+                coverage_changed = True
+
+    if coverage_changed:
+        save_coverage(coverage)
+
+    panel = pd.DataFrame({symbol: cached[symbol][~cached[symbol].index.duplicated(keep='last')]
+                          for symbol in symbols})
+    return panel.sort_index().loc[start:end]
+
+
+def get_close_history(symbol, start, end):
+    """
+    获取单个标的在 [start, end] 区间的日线收盘价
+    """
+    return get_close_panel([symbol], start, end)[symbol].dropna()
@@ -0,0 +1,367 @@
+"""
+目标权重再平衡回测 (what-if)
+饼图只能展示当前的持仓构成，无法回答 "如果过去一直按这些权重每月再平衡，结果会怎样"。
+本脚本在历史文件内嵌的价格矩阵上回放一组目标权重方案，并与实际组合比较:
+  - 价格: 历史文件中记录的价格 (价格 > 0 的单元格)；未持有期间或从未持有的股票/ETF 使用本地收盘价缓存 (price_cache)，
+    缓存的收盘价已按拆股调整，先换算回当日的实际价格，再统一按拆股/分红累计调整因子计算各资产的累计增长
+  - 方案: config.ini 中的 [Rebalance:方案名] 小节 (schedule = 再平衡频率，其余为 代码 = 目标权重)，
+    或命令行 --weights；未配置时使用最新一行的实际权重。--grid 可一次性枚举若干资产间按固定步长组合的所有权重
+  - 再平衡频率: daily / weekly / monthly / quarterly / yearly / never，在每个周期最后一个交易日收盘后恢复目标权重，
+    两次再平衡之间各资产买入持有
+  - 所有方案在一个 (方案数 × 交易日数 × 资产数) 的数组上批量计算每日收益率，
+    再与实际组合 (calculate_inferred_cash_flows 的每日收益率，已剔除现金流) 一起计算时间加权收益率、年化波动率和最大回撤
+结果写入 data/portfolio_rebalance_backtest.json。不考虑交易成本和税费。
+"""
+
+import argparse
+import configparser
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from calculate_return import build_flows_frame
+from corporate_actions import (
+    build_adjustment_factors,
+    load_adjustment_factors,
+    load_held_actions,
+    split_basis_factors,
+)
+from history_store import load_history_arrays
+from instruments import REGISTRY
+from output_writer import write_json
+from price_cache import get_close_panel, load_cached_closes
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_rebalance_backtest.json')
+CONFIG_FILE = os.path.join(ROOT_DIR, 'config.ini')
+SCENARIO_SECTION_PREFIX = 'Rebalance'
+SCHEDULES = ['daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'never']
+DEFAULT_SCHEDULE = 'monthly'
+TRADING_DAYS_PER_YEAR = 252
+# 收盘价缓存缺少某些日期时，最多沿用之前几个交易日的价格
+FILL_LIMIT = 5
+# 每批计算的 方案数 × 交易日数 × 资产数 上限
+MAX_BATCH_ELEMENTS = 20_000_000
+ACTUAL_NAME = '实际组合'
+
+
+# ==============================================================================
+# 1. 方案定义
+# ==============================================================================
+
+def normalize_weights(weights):
+    """
+    把 {代码: 权重} 规范为大写代码、权重之和为1；权重为负或总和不为正时抛出 ValueError
+    """
+    weights = {symbol.strip().upper(): float(weight) for symbol, weight in weights.items()}
+    total = sum(weights.values())
+    if any(weight < 0 for weight in weights.values()) or total <= 0:
+        raise ValueError(f"目标权重必须非负且总和为正: {weights}")
+    return {symbol: weight / total for symbol, weight in weights.items() if weight > 0}
+
+
+def parse_weights(text):
+    """
+    解析 'SPY=0.6,CASH=0.4' 形式的权重
+    """
+    pairs = (part.split('=', 1) for part in text.split(',') if part.strip())
+    return normalize_weights({symbol: weight for symbol, weight in pairs})
+
+
+def load_config_scenarios(config_file=CONFIG_FILE):
+    """
+    读取 config.ini 中的 [Rebalance:方案名] 小节，返回 [{'name', 'schedule', 'weights'}]
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
+    config.read(config_file, encoding='utf-8')
+    scenarios = []
+    for section in config.sections():
+        prefix, sep, name = section.partition(':')
+        if prefix != SCENARIO_SECTION_PREFIX or not sep or not name:
+            continue
+        items = dict(config.items(section))
+        schedule = items.pop('schedule', DEFAULT_SCHEDULE).strip().lower()
+        if schedule not in SCHEDULES:
+            raise ValueError(f"方案 '{name}' 的再平衡频率 '{schedule}' 无效，可选: {', '.join(SCHEDULES)}")
+        scenarios.append({'name': name, 'schedule': schedule, 'weights': normalize_weights(items)})
+    return scenarios
+
+
+def current_weight_scenario(arrays, schedule=DEFAULT_SCHEDULE):
+    """
+    以最新一行的实际持仓权重为目标的方案 (只取价值为正的资产)
+    """
+    latest = arrays['values'][-1]
+    weights = {asset: latest[j] for j, asset in enumerate(arrays['assets']) if latest[j] > 0}
+    return {'name': '当前权重', 'schedule': schedule, 'weights': normalize_weights(weights)}
+
+
+def grid_scenarios(symbols, step, schedule):
+    """
+    symbols 之间以 step 为步长、总和为1的所有权重组合
+    """
+    units = int(round(1.0 / step))
+    symbols = [symbol.strip().upper() for symbol in symbols]
+    scenarios = []
+    for combo in itertools.product(range(units + 1), repeat=len(symbols) - 1):
+        rest = units - sum(combo)
+        if rest < 0:
+            continue
+        weights = dict(zip(symbols, [*combo, rest]))
+        name = ' / '.join(f"{symbol} {count / units:.0%}" for symbol, count in weights.items())
+        scenarios.append({'name': name, 'schedule': schedule, 'weights': normalize_weights(weights)})
+    return scenarios
+
+
+# ==============================================================================
+# 2. 价格矩阵与资产累计增长
+# ==============================================================================
+
+def scenario_price_matrix(arrays, symbols, actions, refresh=False):
+    """
+    与历史日期对齐的价格矩阵 (交易日数 × 方案涉及的资产数)，缺失为 NaN，现金恒为1。
+    优先使用历史文件记录的价格，其余股票/ETF位置使用收盘价缓存 (按 split_basis_factors 换算回当日的实际价格，
+    与记录的价格口径一致)；refresh=True 时先批量增量下载一次。
+    """
+    dates = arrays['dates']
+    prices = np.full((len(dates), len(symbols)), np.nan)
+    column = {asset: j for j, asset in enumerate(arrays['assets'])}
+    for k, symbol in enumerate(symbols):
+        if symbol in column:
+            recorded = arrays['prices'][:, column[symbol]]
+            prices[:, k] = np.where(recorded > 0, recorded, np.nan)
+
+    stocks = {k: REGISTRY[symbol].yfinance for k, symbol in enumerate(symbols)
+              if REGISTRY.get(symbol) is not None and REGISTRY[symbol].is_stock}
+    if stocks and len(dates):
+        yf_symbols = list(dict.fromkeys(stocks.values()))
+        if refresh:
+            panel = get_close_panel(yf_symbols, dates[0], dates[-1])
+        else:
+            panel = pd.DataFrame({symbol: load_cached_closes(symbol) for symbol in yf_symbols})
+        panel = panel.reindex(panel.index.union(dates)).ffill(limit=FILL_LIMIT).reindex(dates)
+        basis = split_basis_factors(dates, symbols, actions)
+        for k, symbol in stocks.items():
+            if symbol in panel.columns:
+                missing = np.isnan(prices[:, k])
+                prices[missing, k] = (panel[symbol].to_numpy(dtype=np.float64) * basis[:, k])[missing]
+
+    is_cash = np.array([REGISTRY.get(symbol) is not None and REGISTRY[symbol].is_cash for symbol in symbols])
+    prices[:, is_cash] = 1.0
+    return prices
+
+
+def asset_growth(dates, symbols, prices, actions):
+    """
+    各资产按拆股/分红调整后的累计增长 (交易日数 × 资产数，第0行为1)；价格缺失的日期视为不变。
+    prices 须为当日的实际价格 (scenario_price_matrix 的结果)，拆股在这里只计入一次
+    """
+    factors = build_adjustment_factors(dates, symbols, np.nan_to_num(prices), actions)
+    adjusted = pd.DataFrame(prices * factors).ffill().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = adjusted[1:] / adjusted[:-1]
+    ratios = np.where(np.isfinite(ratios) & (ratios > 0), ratios, 1.0)
+    return np.cumprod(np.vstack([np.ones((1, len(symbols))), ratios]), axis=0)
+
+
+# ==============================================================================
+# 3. 批量回放
+# ==============================================================================
+
+def period_keys(dates, schedule):
+    """
+    每个交易日所属再平衡周期的整数编号
+    """
+    if schedule == 'weekly':
+        return (dates - pd.to_timedelta(dates.weekday, unit='D')).normalize().asi8
+    if schedule == 'monthly':
+        return np.asarray(dates.year * 12 + dates.month)
+    if schedule == 'quarterly':
+        return np.asarray(dates.year * 4 + (dates.month - 1) // 3)
+    if schedule == 'yearly':
+        return np.asarray(dates.year)
+    return np.zeros(len(dates), dtype=np.int64)
+
+
+def rebalance_flags(dates, schedule):
+    """
+    每个交易日收盘后是否恢复目标权重: 第0行建仓，之后为每个周期的最后一个交易日
+    """
+    flags = np.zeros(len(dates), dtype=bool)
+    if len(dates) == 0:
+        return flags
+    if schedule == 'daily':
+        flags[:] = True
+    elif schedule != 'never':
+        keys = period_keys(dates, schedule)
+        flags[:-1] = keys[1:] != keys[:-1]
+    flags[0] = True
+    return flags
+
+
+def simulate_scenarios(growth, weights, rebalance):
+    """
+    批量回放目标权重方案。
+    growth 为各资产的累计增长 (交易日数 × 资产数)，weights 为目标权重 (方案数 × 资产数，每行之和为1)，
+    rebalance 为各方案每日收盘后是否再平衡 (方案数 × 交易日数)。
+    第 t 日的组合收益率 = Σ w · growth[t] / growth[r] ÷ Σ w · growth[t-1] / growth[r] - 1，
+    r 为第 t-1 日 (含) 之前最近的再平衡日。返回每日收益率 (方案数 × 交易日数，第0列为0)。
+    """
+    n_scenarios, n_days = rebalance.shape
+    returns = np.zeros((n_scenarios, n_days))
+    if n_days < 2 or n_scenarios == 0:
+        return returns
+
+    last = np.maximum.accumulate(np.where(rebalance, np.arange(n_days), 0), axis=1)[:, :-1]
+    batch = max(1, MAX_BATCH_ELEMENTS // (n_days * growth.shape[1]))
+    for s in range(0, n_scenarios, batch):
+        base = growth[last[s:s + batch]]
+        previous = np.einsum('su,stu->st', weights[s:s + batch], growth[:-1] / base)
+        current = np.einsum('su,stu->st', weights[s:s + batch], growth[1:] / base)
+        returns[s:s + batch, 1:] = current / previous - 1.0
+    return returns
+
+
+def performance_metrics(daily_returns):
+    """
+    每行一个组合的每日收益率 (第0列为0)，返回时间加权收益率、年化收益率、年化波动率、Sharpe (无风险利率为0) 和最大回撤
+    """
+    n_days = daily_returns.shape[1]
+    wealth = np.cumprod(1.0 + daily_returns, axis=1)
+    twrr = wealth[:, -1] - 1.0
+    years = (n_days - 1) / TRADING_DAYS_PER_YEAR
+    observed = daily_returns[:, 1:]
+    annualized = np.full(len(wealth), np.nan)
+    volatility = np.full(len(wealth), np.nan)
+    if years > 0:
+        annualized = np.power(np.maximum(wealth[:, -1], 0.0), 1.0 / years) - 1.0
+    if n_days > 2:
+        volatility = observed.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = observed.mean(axis=1) * TRADING_DAYS_PER_YEAR / volatility
+    drawdown = wealth / np.maximum.accumulate(wealth, axis=1) - 1.0
+    return {
+        'twrr': twrr,
+        'annualized_return': annualized,
+        'volatility': volatility,
+        'sharpe': sharpe,
+        'max_drawdown': drawdown.min(axis=1),
+    }, wealth
+
+
+def _to_json_number(x, digits=6):
+    if x is None or not np.isfinite(x):
+        return None
+    return round(float(x), digits)
+
+
+def run_backtest(arrays, scenarios, refresh=False):
+    """
+    回放所有方案并与实际组合比较，返回 (结果字典, 各组合的累计净值矩阵，第0行为实际组合)
+    """
+    dates = arrays['dates']
+    symbols = sorted({symbol for scenario in scenarios for symbol in scenario['weights']})
+    actions = load_held_actions(dates, symbols, np.ones(len(symbols), dtype=bool), refresh)
+    prices = scenario_price_matrix(arrays, symbols, actions, refresh)
+    for k, symbol in enumerate(symbols):
+        if np.isnan(prices[:, k]).all():
+            print(f"警告: {symbol} 没有可用的价格 (历史文件和收盘价缓存中都没有)，回放中视为价格不变。")
+
+    growth = asset_growth(dates, symbols, prices, actions)
+    weights = np.array([[scenario['weights'].get(symbol, 0.0) for symbol in symbols] for scenario in scenarios])
+    schedules = {schedule: rebalance_flags(dates, schedule) for schedule in {s['schedule'] for s in scenarios}}
+    rebalance = np.array([schedules[scenario['schedule']] for scenario in scenarios]).reshape(len(scenarios), len(dates))
+
+    actual = build_flows_frame(arrays)['daily_return'].to_numpy(dtype=np.float64, copy=True)
+    actual[0] = 0.0
+    all_returns = np.vstack([actual, simulate_scenarios(growth, weights, rebalance)])
+    metrics, wealth = performance_metrics(all_returns)
+
+    def metric_report(i):
+        return {key: _to_json_number(values[i]) for key, values in metrics.items()}
+
+    scenario_reports = []
+    for i, scenario in enumerate(scenarios, start=1):
+        report = {'name': scenario['name'], 'schedule': scenario['schedule'],
+                  'weights': {symbol: round(weight, 6) for symbol, weight in scenario['weights'].items()},
+                  'rebalances': int(rebalance[i - 1].sum()) - 1}
+        report.update(metric_report(i))
+        report['excess_twrr'] = _to_json_number(metrics['twrr'][i] - metrics['twrr'][0])
+        scenario_reports.append(report)
+
+    result = {
+        'start_date': dates[0].strftime('%Y-%m-%d'),
+        'end_date': dates[-1].strftime('%Y-%m-%d'),
+        'trading_days': len(dates),
+        'actual': metric_report(0),
+        'scenarios': scenario_reports,
+    }
+    return result, wealth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="目标权重再平衡回测，与实际组合比较收益率、波动率和回撤")
+    parser.add_argument('--history', default=HISTORY_FILE, help="历史文件路径")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="输出路径")
+    parser.add_argument('--start', default=None, help="回测开始日期 (只读取与之重叠的历史分区)")
+    parser.add_argument('--weights', default=None, help="临时方案的目标权重，如 'SPY=0.6,CASH=0.4'")
+    parser.add_argument('--schedule', default=DEFAULT_SCHEDULE, choices=SCHEDULES, help="临时方案和网格方案的再平衡频率")
+    parser.add_argument('--grid', default=None, help="逗号分隔的资产，枚举它们之间的所有权重组合")
+    parser.add_argument('--grid-step', type=float, default=0.1, help="网格方案的权重步长")
+    parser.add_argument('--refresh', action='store_true', help="先批量增量更新收盘价和拆股/分红缓存")
+    args = parser.parse_args()
+
+    try:
+        arrays = load_history_arrays(args.history, start=args.start)
+    except FileNotFoundError:
+        print(f"错误: 找不到历史文件 '{args.history}'。")
+        return
+    if len(arrays['dates']) < 2:
+        print("错误: 历史数据不足两个交易日，无法回测。")
+        return
+    arrays['adjustments'] = load_adjustment_factors(arrays, refresh=False)
+
+    try:
+        scenarios = load_config_scenarios()
+        if args.weights:
+            scenarios.append({'name': args.weights, 'schedule': args.schedule, 'weights': parse_weights(args.weights)})
+        if not scenarios:
+            scenarios.append(current_weight_scenario(arrays, args.schedule))
+        named = len(scenarios)
+        if args.grid:
+            scenarios.extend(grid_scenarios(args.grid.split(','), args.grid_step, args.schedule))
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+
+    result, wealth = run_backtest(arrays, scenarios, refresh=args.refresh)
+    # 净值序列只输出实际组合和具名方案 (网格方案只输出汇总指标)
+    result['series'] = {
+        'dates': arrays['dates'].strftime('%Y-%m-%d').tolist(),
+        ACTUAL_NAME: np.round(wealth[0], 6).tolist(),
+        **{scenario['name']: np.round(wealth[i], 6).tolist() for i, scenario in enumerate(scenarios[:named], start=1)},
+    }
+
+    print("=" * 100)
+    print(f"再平衡回测 ({result['start_date']} ~ {result['end_date']}, {result['trading_days']} 个交易日, "
+          f"{len(scenarios)} 个方案)")
+    print("=" * 100)
+    rows = [{'name': ACTUAL_NAME, 'schedule': '-', **result['actual']}] + result['scenarios']
+    summary = pd.DataFrame(rows).set_index('name')[['schedule', 'twrr', 'volatility', 'sharpe', 'max_drawdown']]
+    print(summary.sort_values('twrr', ascending=False).head(30).to_string())
+
+    if write_json(args.output, result):
+        print(f"\n已生成回测结果: '{args.output}'")
+    else:
+        print(f"\n回测结果未变化，无需写入: '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+投资组合风险指标计算
+基于 calculate_inferred_cash_flows 生成的每日收益率序列，
+对所有统计窗口一次性向量化计算波动率、最大回撤(含恢复日期)、Sharpe/Sortino、
+相对 SPY 的 Beta 以及各资产对收益的贡献，结果写入 data/portfolio_risk.json。
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from calculate_return import build_flows_frame, build_periods
+from corporate_actions import load_adjustment_factors
+from history_store import load_history_arrays
+from output_writer import write_json
+from asset_attribution import build_attribution_matrices, period_attribution
+from price_cache import get_close_history
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# --- 配置 ---
+HISTORY_FILE = os.path.join(DATA_DIR, 'portfolio_details_history.csv')
+OUTPUT_FILE = os.path.join(DATA_DIR, 'portfolio_risk.json')
+TRADING_DAYS_PER_YEAR = 252
+ANNUAL_RISK_FREE_RATE = 0.0
+BENCHMARK_SYMBOL = 'SPY'
+# 以交易日计的滚动窗口（除 build_periods 中的报告周期外额外统计）
+TRADING_DAY_WINDOWS = [5, 10, 21, 42, 63, 126, 189, 252, 504, 756]
+# 输出完整滚动序列的窗口
+ROLLING_SERIES_WINDOWS = [21, 63, 252]
+
+
+# ==============================================================================
+# 1. 窗口定义
+# ==============================================================================
+
+def build_windows(index):
+    """
+    构建所有统计窗口: {名称: (开始位置, 结束位置)}，位置均为闭区间。
+    包括 calculate_return 的报告周期、固定交易日窗口以及全部历史。
+    """
+    n = len(index)
+    windows = {}
+
+    for name, (start_date, end_date) in build_periods(index).items():
+        start_loc = index.searchsorted(start_date, side='left')
+        end_loc = index.searchsorted(end_date, side='right') - 1
+        if 0 <= start_loc <= end_loc:
+            windows[name] = (start_loc, end_loc)
+
+    for w in TRADING_DAY_WINDOWS:
+        if w < n:
+            windows[f"过去{w}个交易日"] = (n - w, n - 1)
+
+    windows["全部历史"] = (0, n - 1)
+    return windows
+
+
+def _prefix_sum(x):
+    """
+    沿第0轴的前缀和，首行补0，使区间 [s, e] 之和 = P[e + 1] - P[s]
+    """
+    x = np.asarray(x, dtype=np.float64)
+    return np.concatenate([np.zeros((1,) + x.shape[1:]), np.cumsum(x, axis=0)])
+
+
+# ==============================================================================
+# 2. 向量化指标计算
+# ==============================================================================
+
+def window_moments(daily_returns, benchmark_returns, starts, ends):
+    """
+    对任意形状的 (starts, ends) 位置数组，一次性计算各窗口的收益与风险指标。
+    第0天没有收益率，因此窗口实际从 max(start, 1) 开始。
+    """
+    r = np.asarray(daily_returns, dtype=np.float64)
+    starts = np.maximum(np.asarray(starts), 1)
+    ends = np.asarray(ends)
+    m = (ends - starts + 1).astype(np.float64)
+
+    rf_daily = (1 + ANNUAL_RISK_FREE_RATE) ** (1 / TRADING_DAYS_PER_YEAR) - 1
+    excess = r - rf_daily
+
+    p1 = _prefix_sum(r)
+    p2 = _prefix_sum(r * r)
+    pd2 = _prefix_sum(np.minimum(excess, 0.0) ** 2)
+    wealth = np.cumprod(1 + r)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s1 = p1[ends + 1] - p1[starts]
+        s2 = p2[ends + 1] - p2[starts]
+        sd2 = pd2[ends + 1] - pd2[starts]
+
+        mean_excess = s1 / m - rf_daily
+        std = np.sqrt(np.maximum((s2 - s1 * s1 / m) / (m - 1), 0.0))
+        downside = np.sqrt(sd2 / m)
+
+        annual = np.sqrt(TRADING_DAYS_PER_YEAR)
+        period_return = wealth[ends] / wealth[starts - 1] - 1
+        metrics = {
+            'return': np.where(m >= 1, period_return, np.nan),
+            'annualized_return': np.where(m >= 1, (1 + period_return) ** (TRADING_DAYS_PER_YEAR / m) - 1, np.nan),
+            'volatility': np.where(m >= 2, std * annual, np.nan),
+            'sharpe': np.where((m >= 2) & (std > 0), mean_excess / std * annual, np.nan),
+            'sortino': np.where((m >= 2) & (downside > 0), mean_excess / downside * annual, np.nan),
+            'beta': np.full(m.shape, np.nan),
+        }
+
+        if benchmark_returns is not None:
+            b = np.asarray(benchmark_returns, dtype=np.float64)
+            pb = _prefix_sum(b)
+            pbb = _prefix_sum(b * b)
+            prb = _prefix_sum(r * b)
+            sb = pb[ends + 1] - pb[starts]
+            sbb = pbb[ends + 1] - pbb[starts]
+            srb = prb[ends + 1] - prb[starts]
+            var_b = sbb - sb * sb / m
+            metrics['beta'] = np.where((m >= 2) & (var_b > 1e-12), (srb - s1 * sb / m) / var_b, np.nan)
+
+    return metrics
+
+
+def window_drawdowns(daily_returns, starts, end):
+    """
+    计算所有截止于 end 的窗口内的最大回撤、峰值日、谷底日和恢复日(位置)。
+    以窗口开始前一日的收盘净值作为起点，构造 (窗口数 × 天数) 的净值矩阵一次求解。
+    """
+    r = np.asarray(daily_returns, dtype=np.float64)[:end + 1]
+    wealth = np.cumprod(1 + r)
+    base = np.maximum(np.asarray(starts), 1) - 1
+    cols = np.arange(len(wealth))
+
+    in_window = cols[None, :] >= base[:, None]
+    curve = np.where(in_window, wealth[None, :], np.nan)
+    peaks = np.fmax.accumulate(curve, axis=1)
+    with np.errstate(invalid='ignore'):
+        drawdowns = np.where(in_window, curve / peaks - 1, np.inf)
+
+    trough = np.argmin(drawdowns, axis=1)
+    rows = np.arange(len(base))
+    max_drawdown = drawdowns[rows, trough]
+    peak_value = peaks[rows, trough]
+
+    reached_peak = in_window & (cols[None, :] <= trough[:, None]) & (curve >= peak_value[:, None])
+    peak = np.argmax(reached_peak, axis=1)
+
+    recovered_mask = (cols[None, :] > trough[:, None]) & (curve >= peak_value[:, None])
+    recovered = recovered_mask.any(axis=1)
+    recovery = np.where(recovered, np.argmax(recovered_mask, axis=1), -1)
+
+    return max_drawdown, peak, trough, recovery
+
+
+def asset_contributions(values, prices, total_values, starts, ends, adjustments=None):
+    """
+    计算各资产在每个窗口内对组合收益率的贡献(昨日权重 × 今日价格收益率 之和)
+    以及市场收益金额(持有数量 × 价格变化 之和)。
+    返回两个 (窗口数 × 资产数) 的矩阵。
+    """
+    matrices = build_attribution_matrices(values, prices, total_values, adjustments)
+    result = period_attribution(matrices, starts, ends)
+    return result['contribution'], result['gain']
+
+
+def rolling_series(daily_returns, benchmark_returns, windows):
+    """
+    计算每个交易日的滚动指标，返回 {指标: (窗口数 × 天数) 矩阵}，不足窗口长度的位置为 NaN。
+    """
+    n = len(daily_returns)
+    windows = np.asarray(windows)
+    ends = np.broadcast_to(np.arange(n)[None, :], (len(windows), n))
+    starts = ends - windows[:, None] + 1
+    valid = starts >= 1
+
+    metrics = window_moments(daily_returns, benchmark_returns, np.where(valid, starts, 1), ends)
+    return {name: np.where(valid, values, np.nan) for name, values in metrics.items()}
+
+
+# ==============================================================================
+# 3. 数据准备
+# ==============================================================================
+
+def load_benchmark_returns(index):
+    """
+    获取与历史日期对齐的基准每日收益率；获取失败时返回 None
+    """
+    closes = get_close_history(BENCHMARK_SYMBOL, index[0] - pd.Timedelta(days=7), index[-1])
+    if closes.empty:
+        print(f"警告: 无法获取基准 {BENCHMARK_SYMBOL} 的价格，Beta 将不会被计算。")
+        return None
+
+    aligned = closes.reindex(closes.index.union(index)).ffill().reindex(index)
+    returns = aligned.pct_change().fillna(0.0).to_numpy()
+    returns[0] = 0.0
+    return returns
+
+
+def _to_json_number(x, digits=6):
+    if x is None or not np.isfinite(x):
+        return None
+    return round(float(x), digits)
+
+
+def _date_at(index, loc):
+    return index[loc].strftime('%Y-%m-%d') if loc >= 0 else None
+
+
+# ==============================================================================
+# 4. 主执行逻辑
+# ==============================================================================
+
+def calculate_risk_report(df_with_flows, arrays, benchmark_returns):
+    """
+    汇总所有窗口的风险指标和滚动序列，返回可直接序列化的字典
+    """
+    index = df_with_flows.index
+    daily_returns = df_with_flows['daily_return'].to_numpy(dtype=np.float64, copy=True)
+    daily_returns[0] = 0.0
+    n = len(index)
+
+    windows = build_windows(index)
+    names = list(windows.keys())
+    starts = np.array([windows[name][0] for name in names])
+    ends = np.array([windows[name][1] for name in names])
+
+    metrics = window_moments(daily_returns, benchmark_returns, starts, ends)
+    max_dd, peak, trough, recovery = window_drawdowns(daily_returns, starts, n - 1)
+
+    asset_columns = arrays['assets']
+    contributions, gains = asset_contributions(
+        arrays['values'], arrays['prices'], df_with_flows['total_value'].to_numpy(dtype=np.float64), starts, ends,
+        arrays.get('adjustments'))
+
+    window_reports = []
+    for i, name in enumerate(names):
+        has_drawdown = max_dd[i] < 0
+        window_reports.append({
+            'window': name,
+            'start_date': _date_at(index, starts[i]),
+            'end_date': _date_at(index, ends[i]),
+            'trading_days': int(ends[i] - max(starts[i], 1) + 1),
+            'return': _to_json_number(metrics['return'][i]),
+            'annualized_return': _to_json_number(metrics['annualized_return'][i]),
+            'volatility': _to_json_number(metrics['volatility'][i]),
+            'sharpe': _to_json_number(metrics['sharpe'][i]),
+            'sortino': _to_json_number(metrics['sortino'][i]),
+            'beta': _to_json_number(metrics['beta'][i]),
+            'max_drawdown': _to_json_number(max_dd[i]) if has_drawdown else 0.0,
+            'drawdown_peak_date': _date_at(index, peak[i]) if has_drawdown else None,
+            'drawdown_trough_date': _date_at(index, trough[i]) if has_drawdown else None,
+            'recovery_date': _date_at(index, recovery[i]) if has_drawdown else None,
+            'asset_contributions': {
+                asset: {'contribution': _to_json_number(contributions[i, j]),
+                        'gain': _to_json_number(gains[i, j], 2)}
+                for j, asset in enumerate(asset_columns)
+                if contributions[i, j] != 0 or gains[i, j] != 0
+            },
+        })
+
+    rolling_windows = [w for w in ROLLING_SERIES_WINDOWS if w < n]
+    rolling = rolling_series(daily_returns, benchmark_returns, rolling_windows) if rolling_windows else {}
+    rolling_report = {'dates': [d.strftime('%Y-%m-%d') for d in index]}
+    for metric in ['volatility', 'sharpe', 'sortino', 'beta']:
+        rolling_report[metric] = {
+            str(w): [_to_json_number(x) for x in rolling[metric][k]]
+            for k, w in enumerate(rolling_windows)
+        } if rolling else {}
+
+    return {
+        'as_of': index[-1].strftime('%Y-%m-%d'),
+        'benchmark': BENCHMARK_SYMBOL,
+        'annual_risk_free_rate': ANNUAL_RISK_FREE_RATE,
+        'windows': window_reports,
+        'rolling': rolling_report,
+    }
+
+
+def main():
+    """
+    主执行函数
+    """
+    try:
+        arrays = load_history_arrays(HISTORY_FILE)
+    except FileNotFoundError:
+        print(f"错误: 找不到历史文件 '{HISTORY_FILE}'。")
+        return
+
+    arrays['adjustments'] = load_adjustment_factors(arrays)
+    df_with_flows = build_flows_frame(arrays)
+    if len(df_with_flows) < 2:
+        print("错误: 历史数据不足两个交易日，无法计算风险指标。")
+        return
+
+    benchmark_returns = load_benchmark_returns(df_with_flows.index)
+    report = calculate_risk_report(df_with_flows, arrays, benchmark_returns)
+
+    print("=" * 110)
+    print(f"投资组合风险指标 (截至 {report['as_of']}, 基准: {BENCHMARK_SYMBOL})")
+    print("=" * 110)
+    summary = pd.DataFrame(report['windows']).set_index('window')[
+        ['trading_days', 'return', 'volatility', 'sharpe', 'sortino', 'beta', 'max_drawdown', 'recovery_date']]
+    print(summary.to_string())
+
+    try:
+        if write_json(OUTPUT_FILE, report):
+            print(f"\n已成功生成风险指标文件: '{OUTPUT_FILE}'")
+        else:
+            print(f"\n风险指标文件内容未变化，无需写入: '{OUTPUT_FILE}'")
+    except Exception as e:
+        print(f"\n错误：无法写入风险指标文件 '{OUTPUT_FILE}': {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+稀疏长表持仓存储
+宽表历史为每个曾持有过的资产保留一列，未持有的单元格都是 '(0.00|0.00)'。
+频繁换仓 (例如轮换过数百个期权合约) 时绝大部分单元格为0，而每一行都携带所有这些列，
+逐行逐列的计算成本与 "曾出现过的资产数" 成正比，而不是与实际持仓数成正比。
+
+本模块提供 (日期, 资产, 价值, 价格) 长表形式的稀疏表示，只记录非零单元格:
+  - 长表存储: data/cache/holdings_long/<历史文件名>.csv，列为 date,symbol,value,price，
+    每个日期另有一行 symbol 为 'total_value' 的记录保存文件中记录的总价值 (保证没有持仓的日期也不丢失)
+  - load_sparse_history 先增量同步长表: 已归档年份 (history_store 的年度分区) 内容未变化时直接沿用，
+    只重新展开当前年份的热分区；之后的计算只读取长表，内存占用与实际持仓数成正比
+  - 内存中的稀疏表示为 COO 格式的数组字典，条目按 (日期, 资产) 排序:
+      dates (升序 DatetimeIndex)、assets (按字母排序)、rows / cols (条目所在的日期/资产位置)、
+      values / prices (条目的价值/价格)、total_value (每个日期记录的总价值)
+计算路径见 calculate_return.calculate_flows_from_sparse 和 corporate_actions.load_sparse_adjustments。
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from history_store import iter_history_blocks, load_partition_manifest, partition_dir
+from output_writer import file_digest, write_json, write_streamed
+
+# 长表存储目录 (与历史文件同级的 cache 目录下)
+LONG_DIR_NAME = os.path.join('cache', 'holdings_long')
+TOTAL_SYMBOL = 'total_value'
+LONG_COLUMNS = ['date', 'symbol', 'value', 'price']
+
+
+# ==============================================================================
+# 1. 稀疏表示
+# ==============================================================================
+
+def _make_sparse(entry_dates, entry_symbols, values, prices, dates, total_value):
+    """
+    由 'YYYY-MM-DD' 字符串形式的条目构建稀疏表示。dates/total_value 为每个日期一项 (日期不重复)。
+    """
+    dates = np.asarray(dates, dtype=str)
+    order = np.argsort(dates, kind='stable')
+    dates, total_value = dates[order], np.asarray(total_value, dtype=np.float64)[order]
+
+    rows = np.searchsorted(dates, np.asarray(entry_dates, dtype=str))
+    assets, cols = np.unique(np.asarray(entry_symbols, dtype=str), return_inverse=True)
+    entry_order = np.lexsort((cols, rows))
+    return {
+        'dates': pd.DatetimeIndex(dates),
+        'assets': assets.tolist(),
+        'rows': rows[entry_order].astype(np.int64),
+        'cols': cols.reshape(-1)[entry_order].astype(np.int64),
+        'values': np.asarray(values, dtype=np.float64)[entry_order],
+        'prices': np.asarray(prices, dtype=np.float64)[entry_order],
+        'total_value': total_value,
+    }
+
+
+def _sparse_entries(sparse):
+    """
+    稀疏表示的逆操作: 返回 (条目日期字符串, 条目资产名, 价值, 价格, 日期字符串, 总价值)
+    """
+    dates = np.asarray(sparse['dates'].strftime('%Y-%m-%d'), dtype=str)
+    assets = np.asarray(sparse['assets'], dtype=str)
+    return (dates[sparse['rows']], assets[sparse['cols']], sparse['values'], sparse['prices'],
+            dates, sparse['total_value'])
+
+
+def sparse_from_blocks(blocks):
+    """
+    由 history_store.iter_history_blocks 的数值块构建稀疏表示，只保留价值或价格非零的单元格
+    (价值为0但价格非零的单元格在计算次日的期望价值时仍会用到，因此一并保留)
+    """
+    parts = []
+    for block in blocks:
+        block_dates = np.asarray(block['dates'].strftime('%Y-%m-%d'), dtype=str)
+        r, c = np.nonzero((block['values'] != 0) | (block['prices'] != 0))
+        parts.append((block_dates[r], np.asarray(block['assets'], dtype=str)[c],
+                      block['values'][r, c], block['prices'][r, c], block_dates, block['total_value']))
+    if not parts:
+        return _make_sparse([], [], [], [], [], [])
+    return _make_sparse(*(np.concatenate([part[k] for part in parts]) for k in range(6)))
+
+
+def concat_sparse(first, second):
+    """
+    合并两个日期不重叠的稀疏表示 (资产取并集)
+    """
+    merged = zip(_sparse_entries(first), _sparse_entries(second))
+    return _make_sparse(*(np.concatenate(pair) for pair in merged))
+
+
+def entry_keys(sparse):
+    """
+    条目键 行 × 资产数 + 列，按条目顺序升序排列
+    """
+    return sparse['rows'] * len(sparse['assets']) + sparse['cols']
+
+
+def lookup_sorted(keys, data, targets, default=0.0):
+    """
+    在升序的 keys 中查找 targets，返回对应的 data；找不到的位置为 default
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    if len(keys) == 0:
+        return np.full(len(targets), default, dtype=np.float64)
+    loc = np.minimum(np.searchsorted(keys, targets), len(keys) - 1)
+    return np.where(keys[loc] == targets, data[loc], default)
+
+
+def sparse_to_dense(sparse):
+    """
+    展开为 history_store.load_history_arrays 的宽表数组结构 (未记录的单元格为0)
+    """
+    shape = (len(sparse['dates']), len(sparse['assets']))
+    values, prices = np.zeros(shape), np.zeros(shape)
+    values[sparse['rows'], sparse['cols']] = sparse['values']
+    prices[sparse['rows'], sparse['cols']] = sparse['prices']
+    return {'dates': sparse['dates'], 'assets': list(sparse['assets']), 'values': values, 'prices': prices,
+            'total_value': sparse['total_value'].copy()}
+
+
+# ==============================================================================
+# 2. 长表存储
+# ==============================================================================
+
+def long_history_file(history_file):
+    directory, name = os.path.split(os.path.abspath(history_file))
+    return os.path.join(directory, LONG_DIR_NAME, os.path.splitext(name)[0] + '.csv')
+
+
+def write_long_history(path, sparse):
+    """
+    按日期升序写出长表；每个日期先写 total_value 行，再按字母顺序写该日的非零持仓。返回是否发生了写入。
+    """
+    entry_dates, entry_symbols, values, prices, dates, total_value = _sparse_entries(sparse)
+    frame = pd.DataFrame({
+        'date': np.concatenate([dates, entry_dates]),
+        'symbol': np.concatenate([np.full(len(dates), TOTAL_SYMBOL), entry_symbols]),
+        'value': np.concatenate([total_value, values]),
+        'price': np.concatenate([np.zeros(len(dates)), prices]),
+        'order': np.concatenate([np.zeros(len(dates)), np.ones(len(entry_dates))]),
+    }).sort_values(['date', 'order'], kind='stable')
+    return write_streamed(path, lambda f: frame[LONG_COLUMNS].to_csv(f, index=False, float_format='%.2f'))
+
+
+def read_long_history(path, before=None):
+    """
+    读取长表存储为稀疏表示；指定 before ('YYYY-MM-DD') 时只保留更早的日期
+    """
+    frame = pd.read_csv(path, dtype={'date': str, 'symbol': str}, keep_default_na=False)
+    if before is not None:
+        frame = frame[frame['date'] < before]
+    is_total = (frame['symbol'] == TOTAL_SYMBOL).to_numpy()
+    totals, entries = frame[is_total], frame[~is_total]
+    return _make_sparse(entries['date'].to_numpy(), entries['symbol'].to_numpy(),
+                        entries['value'].to_numpy(dtype=np.float64), entries['price'].to_numpy(dtype=np.float64),
+                        totals['date'].to_numpy(), totals['value'].to_numpy(dtype=np.float64))
+
+
+def archive_signature(history_file):
+    """
+    已归档年度分区的内容摘要 {文件名: 哈希}，用于判断长表中归档年份的部分是否仍然有效
+    """
+    directory = partition_dir(history_file)
+    return {entry['file']: file_digest(os.path.join(directory, entry['file']))
+            for entry in load_partition_manifest(history_file)['partitions']}
+
+
+def sync_long_history(history_file):
+    """
+    使长表存储与宽表历史一致，返回稀疏表示。
+    已归档分区未变化时沿用长表中这些年份的行，只重新展开热分区；否则 (首次运行、归档有变化) 完整重建。
+    """
+    path = long_history_file(history_file)
+    meta_path = os.path.splitext(path)[0] + '.json'
+    signature = archive_signature(history_file)
+    partitions = load_partition_manifest(history_file)['partitions']
+
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+    if partitions and meta == {'archive': signature}:
+        hot_start = f"{partitions[-1]['year'] + 1}-01-01"
+        sparse = concat_sparse(read_long_history(path, before=hot_start),
+                               sparse_from_blocks(iter_history_blocks(history_file, start=hot_start)))
+    else:
+        sparse = sparse_from_blocks(iter_history_blocks(history_file))
+
+    write_long_history(path, sparse)
+    write_json(meta_path, {'archive': signature})
+    return sparse
+
+
+def load_sparse_history(history_file):
+    """
+    同步并返回历史的稀疏表示；历史文件不存在时抛出 FileNotFoundError
+    """
+    if not os.path.exists(history_file):
+        raise FileNotFoundError(history_file)
+    return sync_long_history(history_file)
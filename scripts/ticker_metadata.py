@@ -0,0 +1,91 @@
+"""
+标的元数据缓存
+yfinance 的 stock.info 是最重的请求，除价格外还包含板块、行业、币种、证券类型、beta 等很少变化的字段。
+本模块把这些字段缓存在 data/cache/ticker_metadata.json，股票在获取价格时顺带从已有的 info 响应中写入
+(不额外发起请求)；只出现在期权组合中的底层标的由 main.refresh_underlying_metadata 对缓存缺失的标的批量获取一次。
+同一标的在有效期 (默认90天) 内不会重复更新。
+"""
+
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+from output_writer import write_json
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+TICKER_METADATA_FILE = os.path.join(CACHE_DIR, 'ticker_metadata.json')
+METADATA_TTL = timedelta(days=90)
+
+# 从 info 中保留的慢变字段
+METADATA_FIELDS = ['quoteType', 'shortName', 'longName', 'sector', 'industry', 'category', 'fundFamily',
+                   'currency', 'exchange', 'country', 'beta']
+
+
+class TickerMetadataStore:
+    """
+    持久化的标的元数据表 {代码: {字段: 值, 'updated': 'YYYY-MM-DD'}}。
+    超过有效期的记录仍然可以读取，只是在下一次获取到 info 时会被更新。
+    """
+
+    def __init__(self, path=TICKER_METADATA_FILE, ttl=METADATA_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+
+    def get(self, symbol):
+        with self._lock:
+            return dict(self._entries.get(symbol, {}))
+
+    def is_fresh(self, symbol, today=None):
+        today = today or date.today()
+        with self._lock:
+            entry = self._entries.get(symbol)
+        return entry is not None and date.fromisoformat(entry['updated']) + self.ttl > today
+
+    def stale(self, symbols, today=None):
+        """
+        返回 symbols 中没有记录或记录已过期的标的 (去重，保持顺序)
+        """
+        return [symbol for symbol in dict.fromkeys(symbols) if not self.is_fresh(symbol, today)]
+
+    def update_from_info(self, symbol, info, today=None):
+        """
+        用已经获取到的 info 响应更新元数据；记录仍在有效期内或 info 中没有任何字段时不做改动。
+        返回是否发生了更新。
+        """
+        today = today or date.today()
+        if self.is_fresh(symbol, today):
+            return False
+        entry = {field: info[field] for field in METADATA_FIELDS if info.get(field) not in (None, '')}
+        if not entry:
+            return False
+        entry['updated'] = today.isoformat()
+        with self._lock:
+            self._entries[symbol] = entry
+            self._dirty = True
+        return True
+
+    def save(self):
+        """
+        有改动时写回文件
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            write_json(self.path, self._entries)
+            self._dirty = False
+
+
+TICKER_METADATA = TickerMetadataStore()
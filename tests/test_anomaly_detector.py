@@ -0,0 +1,47 @@
+"""
+anomaly_detector: 参考收盘价 (已按拆股调整) 换算回历史记录口径后再比较
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from anomaly_detector import detect_anomalies  # noqa: E402
+
+SPLIT_ROW = 5
+
+
+def split_history():
+    """
+    AAPL 在第 SPLIT_ROW 行 10:1 拆股: 记录价格 1000 -> 100，数量 10 -> 100，市值不变；
+    参考收盘价是拆股调整后的 100。
+    """
+    dates = pd.bdate_range('2024-01-01', periods=10)
+    prices = np.where(np.arange(10) < SPLIT_ROW, 1000.0, 100.0)[:, None]
+    values = np.full((10, 1), 10000.0)
+    factors = np.where(np.arange(10) < SPLIT_ROW, 1.0, 10.0)[:, None]
+    reference = np.full((10, 1), 100.0)
+    arrays = {'dates': dates, 'assets': ['AAPL'], 'values': values, 'prices': prices,
+              'total_value': values.sum(axis=1)}
+    return arrays, factors, reference
+
+
+def test_split_does_not_flag_pre_split_rows():
+    arrays, factors, reference = split_history()
+    anomalies = detect_anomalies(arrays, factors, reference)
+    assert [a for a in anomalies if a['kind'] == 'reference_mismatch'] == []
+
+
+def test_wrong_pre_split_price_is_repaired_on_recorded_basis():
+    arrays, factors, reference = split_history()
+    arrays['prices'][2, 0] = 1200.0
+    arrays['values'][2, 0] = 12000.0
+    mismatches = [a for a in detect_anomalies(arrays, factors, reference) if a['kind'] == 'reference_mismatch']
+    assert len(mismatches) == 1
+    assert mismatches[0]['date'] == arrays['dates'][2].strftime('%Y-%m-%d')
+    assert mismatches[0]['detail']['reference_close'] == 1000.0
+    assert mismatches[0]['repair'] == {'value': 10000.0, 'price': 1000.0}
@@ -0,0 +1,42 @@
+"""
+asof_returns: 缓存的收盘价 (已按拆股调整) 与历史文件记录的价格使用同一口径
+"""
+
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import asof_returns  # noqa: E402
+from market_calendar import trading_days_between  # noqa: E402
+
+SPLIT_DAY = '2024-06-10'
+ACTIONS = {'NVDA': {'splits': {SPLIT_DAY: 10.0}, 'dividends': {}}}
+
+
+def split_history():
+    """
+    NVDA 在 2024-06-10 10:1 拆股: 记录价格 1000 -> 100，数量 10 -> 100，市值不变
+    """
+    dates = pd.DatetimeIndex(trading_days_between(date(2024, 5, 1), date(2024, 7, 31)))
+    prices = np.where(dates < SPLIT_DAY, 1000.0, 100.0)[:, None]
+    values = np.full((len(dates), 1), 10000.0)
+    return {'dates': dates, 'assets': ['NVDA'], 'values': values, 'prices': prices,
+            'total_value': values.sum(axis=1)}
+
+
+def test_split_gives_zero_returns_before_and_after(monkeypatch):
+    flat_close = pd.Series(100.0, index=pd.bdate_range('2023-01-01', '2024-12-31'))
+    monkeypatch.setattr(asof_returns, 'load_cached_closes', lambda symbol: flat_close)
+    monkeypatch.setattr(asof_returns, 'load_held_actions', lambda *args, **kwargs: ACTIONS)
+
+    reports = asof_returns.asof_returns(split_history(), pd.DatetimeIndex(['2024-06-07', '2024-07-31']))
+    assert list(reports) == ['2024-06-07', '2024-07-31']
+    for report in reports.values():
+        returns = report['portfolio_returns']['NVDA']['returns']
+        assert all(value is not None for value in returns.values())
+        assert np.allclose(list(returns.values()), 0.0)
@@ -0,0 +1,38 @@
+"""
+benchmarks: 已按拆股调整的收盘价不再重复乘以拆股比例
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import benchmarks  # noqa: E402
+
+
+def flat_panel(symbols, start, end):
+    index = pd.bdate_range(start, end)
+    return pd.DataFrame({symbol: 120.0 for symbol in symbols}, index=index)
+
+
+def test_split_is_not_counted_twice(monkeypatch):
+    actions = {'NVDA': {'splits': {'2024-06-10': 10.0}, 'dividends': {}}}
+    monkeypatch.setattr(benchmarks, 'get_close_panel', flat_panel)
+    monkeypatch.setattr(benchmarks, 'load_held_actions', lambda *args, **kwargs: actions)
+
+    returns = benchmarks.component_returns(pd.bdate_range('2024-06-03', '2024-06-14'), ['NVDA'])
+    assert np.allclose(returns, 0.0)
+
+
+def test_dividends_are_still_reinvested(monkeypatch):
+    actions = {'NVDA': {'splits': {'2024-06-10': 10.0}, 'dividends': {'2024-06-11': 1.2}}}
+    monkeypatch.setattr(benchmarks, 'get_close_panel', flat_panel)
+    monkeypatch.setattr(benchmarks, 'load_held_actions', lambda *args, **kwargs: actions)
+
+    index = pd.bdate_range('2024-06-03', '2024-06-14')
+    returns = benchmarks.component_returns(index, ['NVDA'])[:, 0]
+    assert np.isclose(returns[index.get_loc('2024-06-11')], 0.01)
+    assert np.isclose(np.abs(returns).sum(), 0.01)
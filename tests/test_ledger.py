@@ -0,0 +1,58 @@
+"""
+ledger: 到期时仍持有的期权按内在价值结算，之后持仓清零、结算金额计入现金
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import ledger  # noqa: E402
+
+OPTION = 'SPY_2024-03-15_500_CALL'
+
+
+def option_ledger(tmp_path):
+    path = tmp_path / 'transactions.csv'
+    path.write_text('date,action,symbol,quantity,price,amount,fee\n'
+                    '2024-03-01,DEPOSIT,,,,10000,\n'
+                    f'2024-03-01,BUY,{OPTION},2,5.00,,\n', encoding='utf-8')
+    return ledger.load_ledger(str(path))
+
+
+def test_expired_option_settles_into_cash(tmp_path, monkeypatch):
+    settlements = {OPTION: {'settlement_date': '2024-03-15', 'underlying_close': 512.0,
+                            'settlement_price': 12.0, 'recorded': []}}
+    monkeypatch.setattr(ledger, 'settle_expired_options', lambda expired: settlements)
+    days = ledger.trading_days('2024-03-01', '2024-03-29')
+    # 期权报价在到期前几天就已中断，结算日之后再无报价
+    closes = pd.DataFrame({OPTION: np.where(days < '2024-03-13', 6.0, np.nan)}, index=days)
+
+    entries, closes = ledger.settle_expired_holdings(option_ledger(tmp_path), days, closes)
+    assets, values, prices, cash = ledger.reconstruct_history(entries, days, closes, {})
+
+    settle_row = days.get_loc(pd.Timestamp('2024-03-15'))
+    assert assets == [OPTION]
+    assert values[settle_row, 0] == 2 * 12.0 * 100
+    assert np.all(values[settle_row + 1:, 0] == 0)
+    assert np.all(cash[settle_row + 1:] == 10000 - 2 * 5.0 * 100 + 2 * 12.0 * 100)
+    total = values.sum(axis=1) + cash
+    assert np.all(total[settle_row:] == total[settle_row])
+
+
+def test_closed_before_expiry_is_not_settled_again(tmp_path, monkeypatch):
+    settlements = {OPTION: {'settlement_date': '2024-03-15', 'underlying_close': 512.0,
+                            'settlement_price': 12.0, 'recorded': []}}
+    monkeypatch.setattr(ledger, 'settle_expired_options', lambda expired: settlements)
+    entries = option_ledger(tmp_path)
+    closing = entries.iloc[[1]].assign(date=pd.Timestamp('2024-03-14'), action='SELL',
+                                       units=-2.0, cash=2 * 9.0 * 100)
+    entries = pd.concat([entries, closing], ignore_index=True)
+    days = ledger.trading_days('2024-03-01', '2024-03-29')
+    closes = pd.DataFrame({OPTION: 6.0}, index=days)
+
+    settled, _ = ledger.settle_expired_holdings(entries, days, closes)
+    assert len(settled) == len(entries)
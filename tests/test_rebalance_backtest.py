@@ -0,0 +1,40 @@
+"""
+rebalance_backtest: 缓存的收盘价 (已按拆股调整) 不重复计入拆股
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import rebalance_backtest  # noqa: E402
+
+DATES = pd.bdate_range('2024-06-03', '2024-06-14')
+ACTIONS = {'NVDA': {'splits': {'2024-06-10': 10.0}, 'dividends': {}}}
+
+
+def history(assets, prices):
+    values = np.where(prices > 0, prices * 10, 0.0)
+    return {'dates': DATES, 'assets': assets, 'values': values, 'prices': prices,
+            'total_value': values.sum(axis=1)}
+
+
+def nvda_growth(monkeypatch, arrays):
+    flat_close = pd.Series(120.0, index=pd.bdate_range('2024-05-01', '2024-06-30'))
+    monkeypatch.setattr(rebalance_backtest, 'load_cached_closes', lambda symbol: flat_close)
+    prices = rebalance_backtest.scenario_price_matrix(arrays, ['NVDA'], ACTIONS)
+    return rebalance_backtest.asset_growth(DATES, ['NVDA'], prices, ACTIONS)[:, 0]
+
+
+def test_cache_only_symbol_is_flat_across_split(monkeypatch):
+    arrays = history(['SPY'], np.full((len(DATES), 1), 500.0))
+    assert np.allclose(nvda_growth(monkeypatch, arrays), 1.0)
+
+
+def test_cached_then_recorded_prices_are_flat_across_split(monkeypatch):
+    # 拆股后才买入: 拆股前的价格来自收盘价缓存，拆股后为记录的实际价格 120
+    recorded = np.where(DATES < '2024-06-10', 0.0, 120.0)[:, None]
+    assert np.allclose(nvda_growth(monkeypatch, history(['NVDA'], recorded)), 1.0)